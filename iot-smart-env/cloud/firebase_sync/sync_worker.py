@@ -0,0 +1,470 @@
+"""
+Sincronização incremental EDGE -> nuvem.
+
+Envia as tabelas `readings` e `action_logs` do SQLite do EDGE para um destino
+remoto, sem reler as tabelas:
+
+- Marca d'água durável por tabela (maior id já aceito pelo destino) em
+  SYNC_STATE_FILE, gravada de forma atômica (temporário + fsync + os.replace)
+  só depois do aceite do lote. Após queda de rede ou reinício, a leitura
+  recomeça exatamente do checkpoint (`WHERE id > ? ORDER BY id`, pela chave
+  primária).
+- Lotes em NDJSON (um registro por linha, com o campo "table"), comprimidos
+  com zstd (pacote `zstandard`) ou, se ausente, gzip. O lote fecha ao atingir
+  SYNC_BATCH_MAX_BYTES (antes da compressão) ou quando o registro mais antigo
+  dele espera há SYNC_BATCH_MAX_DELAY_SEC.
+- Entrega "pelo menos uma vez": se o processo cair entre o aceite e o
+  checkpoint, o lote é reenviado. Cada lote leva um Idempotency-Key (faixas
+  de id) e cada registro o seu id, para o destino deduplicar.
+- Não disputa a trava de escrita com a ingestão: conexão somente leitura
+  (mode=ro), páginas pequenas (SYNC_PAGE_ROWS) em transações curtas (no WAL,
+  um leitor longo impede o checkpoint do arquivo -wal) e ciclo de trabalho
+  limitado (SYNC_MAX_DUTY = fração do tempo gasta lendo o banco). Banco
+  ocupado: espera SYNC_BUSY_BACKOFF_SEC e tenta de novo.
+- Destino plugável (qualquer objeto com `upload(batch)`): HttpUploader (POST
+  em SYNC_TARGET http(s)://, conexão keep-alive; ex.: uma Cloud Function que
+  grava no Firebase) ou DirectoryUploader (um arquivo por lote;
+  SYNC_TARGET=file://... ou caminho). Falha no envio: o mesmo lote é
+  reenviado com backoff exponencial.
+- Particionamento do EDGE (STORAGE_PARTITIONING): as tabelas
+  readings_pAAAAMMDD são lidas junto com `readings` (ids globais e crescentes).
+
+Atenção: leituras removidas pela retenção do EDGE antes de sincronizadas não
+são enviadas; mantenha RETENTION_DAYS acima da maior queda de rede esperada.
+
+Uso:
+    EDGE_DB_PATH=../../edge/edge_readings.db SYNC_TARGET=https://... python sync_worker.py
+    python sync_worker.py --once   # envia o que houver e sai
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import gzip
+import http.client
+import json
+import os
+import random
+import signal
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Optional, Protocol
+from urllib.parse import quote, urlsplit
+
+try:
+    from dotenv import load_dotenv  # type: ignore
+
+    load_dotenv()
+except Exception:
+    pass
+
+try:
+    import zstandard  # type: ignore
+except Exception:  # dependência opcional
+    zstandard = None
+
+
+@dataclass
+class Settings:
+    EDGE_DB_PATH: str = os.getenv("EDGE_DB_PATH", "../../edge/edge_readings.db")
+    # http(s)://... (POST) | file://<dir> ou caminho de diretório
+    SYNC_TARGET: str = os.getenv("SYNC_TARGET", "./sync_outbox")
+    SYNC_TOKEN: str = os.getenv("SYNC_TOKEN", "")  # Authorization: Bearer <token>
+    SYNC_STATE_FILE: str = os.getenv("SYNC_STATE_FILE", "./sync_state.json")
+    SYNC_TABLES: tuple = tuple(
+        t.strip() for t in os.getenv("SYNC_TABLES", "readings,action_logs").split(",") if t.strip()
+    )
+
+    SYNC_PAGE_ROWS: int = int(os.getenv("SYNC_PAGE_ROWS", "500"))
+    SYNC_BATCH_MAX_BYTES: int = int(os.getenv("SYNC_BATCH_MAX_BYTES", str(1 << 20)))
+    SYNC_BATCH_MAX_DELAY_SEC: float = float(os.getenv("SYNC_BATCH_MAX_DELAY_SEC", "5"))
+    SYNC_POLL_SEC: float = float(os.getenv("SYNC_POLL_SEC", "1"))
+
+    # Leitura do banco: no máximo esta fração do tempo (0..1]
+    SYNC_MAX_DUTY: float = float(os.getenv("SYNC_MAX_DUTY", "0.2"))
+    SYNC_BUSY_TIMEOUT_MS: int = int(os.getenv("SYNC_BUSY_TIMEOUT_MS", "100"))
+    SYNC_BUSY_BACKOFF_SEC: float = float(os.getenv("SYNC_BUSY_BACKOFF_SEC", "0.5"))
+
+    SYNC_HTTP_TIMEOUT_SEC: float = float(os.getenv("SYNC_HTTP_TIMEOUT_SEC", "30"))
+    SYNC_RETRY_BASE_SEC: float = float(os.getenv("SYNC_RETRY_BASE_SEC", "1"))
+    SYNC_RETRY_MAX_SEC: float = float(os.getenv("SYNC_RETRY_MAX_SEC", "300"))
+
+
+settings = Settings()
+
+_TIME_COLS = ("timestamp", "created_at")
+_PARTITION_GLOB = "readings_p[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]"
+
+
+# ---------- lotes ----------
+@dataclass(frozen=True)
+class Batch:
+    key: str                    # faixas de id, ex.: readings-1-500_action_logs-3-7
+    body: bytes                 # NDJSON comprimido
+    encoding: str               # zstd | gzip
+    records: int
+    raw_bytes: int              # tamanho antes da compressão
+    watermarks: dict = field(default_factory=dict)  # checkpoint após o aceite
+
+
+def compress(data: bytes) -> tuple[bytes, str]:
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(data), "zstd"
+    return gzip.compress(data, 6), "gzip"
+
+
+def decompress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("lote zstd requer o pacote 'zstandard'")
+        return zstandard.ZstdDecompressor().decompress(body)
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    raise ValueError(f"encoding desconhecido: {encoding}")
+
+
+def encode_record(table: str, row: dict) -> bytes:
+    out = {"table": table}
+    for k, v in row.items():
+        if isinstance(v, bytes):
+            v = base64.b64encode(v).decode("ascii")
+        elif k in _TIME_COLS and isinstance(v, str):
+            v = v.replace(" ", "T", 1)
+        out[k] = v
+    return json.dumps(out, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+
+
+# ---------- checkpoint ----------
+def load_state(path: str, tables) -> dict[str, int]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            saved = json.load(f)
+    except (FileNotFoundError, ValueError):
+        saved = {}
+    return {t: int(saved.get(t, 0)) for t in tables}
+
+
+def save_state(path: str, watermarks: dict[str, int]) -> None:
+    data = dict(watermarks, updated_at=datetime.utcnow().isoformat())
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# ---------- destinos ----------
+class UploadError(Exception):
+    pass
+
+
+class Uploader(Protocol):
+    def upload(self, batch: Batch) -> None:
+        """Entrega o lote; qualquer exceção = não aceito (será reenviado)."""
+
+    def close(self) -> None: ...
+
+
+class HttpUploader:
+    """POST do lote com Content-Encoding; 2xx = aceito. Reaproveita a conexão."""
+
+    def __init__(self, url: str, token: str = "", timeout: float = 30.0) -> None:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"URL inválida: {url}")
+        self._cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._host = parts.netloc
+        self._path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        self._token = token
+        self._timeout = timeout
+        self._conn: Optional[http.client.HTTPConnection] = None
+
+    def upload(self, batch: Batch) -> None:
+        headers = {
+            "Content-Type": "application/x-ndjson",
+            "Content-Encoding": batch.encoding,
+            "Idempotency-Key": batch.key,
+            "X-Sync-Records": str(batch.records),
+        }
+        if self._token:
+            headers["Authorization"] = f"Bearer {self._token}"
+        # Uma nova tentativa imediata: a conexão keep-alive pode ter sido
+        # fechada pelo servidor entre dois lotes
+        for attempt in (0, 1):
+            if self._conn is None:
+                self._conn = self._cls(self._host, timeout=self._timeout)
+            try:
+                self._conn.request("POST", self._path, body=batch.body, headers=headers)
+                resp = self._conn.getresponse()
+                resp.read()
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                if attempt:
+                    raise UploadError(f"{type(e).__name__}: {e}") from e
+                continue
+            if resp.will_close:
+                self.close()
+            if not 200 <= resp.status < 300:
+                raise UploadError(f"HTTP {resp.status}")
+            return
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class DirectoryUploader:
+    """Grava cada lote em <dir>/<key>.ndjson.<encoding> (atômico)."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def upload(self, batch: Batch) -> None:
+        final = os.path.join(self.path, f"{batch.key}.ndjson.{batch.encoding}")
+        with open(final + ".tmp", "wb") as f:
+            f.write(batch.body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(final + ".tmp", final)
+
+    def close(self) -> None:
+        pass
+
+
+def make_uploader(cfg: Settings = settings) -> Uploader:
+    target = cfg.SYNC_TARGET
+    if target.startswith(("http://", "https://")):
+        return HttpUploader(target, cfg.SYNC_TOKEN, cfg.SYNC_HTTP_TIMEOUT_SEC)
+    if target.startswith("file://"):
+        target = target[len("file://"):]
+    return DirectoryUploader(target)
+
+
+# ---------- worker ----------
+class SyncWorker:
+    """
+    Laço de sincronização; `step()` faz um passo e diz quanto esperar, `run()`
+    repete até `stop` e `drain()` envia tudo o que já existe (--once, testes).
+    """
+
+    def __init__(
+        self,
+        uploader: Uploader,
+        cfg: Settings = settings,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.uploader = uploader
+        self.cfg = cfg
+        self.clock = clock
+        self.tables = tuple(cfg.SYNC_TABLES)
+        self.state = load_state(cfg.SYNC_STATE_FILE, self.tables)  # aceito pelo destino
+        self._read = dict(self.state)                              # já colocado em lote
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lines: list[bytes] = []
+        self._size = 0
+        self._first_at: Optional[float] = None
+        self._ranges: dict[str, list[int]] = {}
+        self._sealed: Optional[Batch] = None
+        self._attempts = 0
+        self._retry_at = 0.0
+        self._resume_at = 0.0
+        self._full = False
+        self.caught_up = False
+        self.batches = 0
+        self.records = 0
+
+    # --- banco (somente leitura) ---
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            uri = "file:" + quote(os.path.abspath(self.cfg.EDGE_DB_PATH)) + "?mode=ro"
+            conn = sqlite3.connect(
+                uri, uri=True, isolation_level=None, check_same_thread=False,
+                timeout=self.cfg.SYNC_BUSY_TIMEOUT_MS / 1000,
+            )
+            conn.row_factory = sqlite3.Row
+            self._conn = conn
+        return self._conn
+
+    def _physical(self, conn: sqlite3.Connection, table: str) -> list[str]:
+        if table != "readings":
+            return [table]
+        rows = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND (name = 'readings' OR name GLOB ?)",
+            (_PARTITION_GLOB,),
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def _fetch(self, conn: sqlite3.Connection, table: str, after: int) -> list[dict]:
+        limit = self.cfg.SYNC_PAGE_ROWS
+        rows: list[dict] = []
+        # Uma transação de leitura (um snapshot) para todas as partições: um lote
+        # da ingestão grava em mais de uma; lido pela metade, o id da partição
+        # nova passaria o marcador à frente de linhas ainda não vistas na antiga
+        conn.execute("BEGIN")
+        try:
+            for name in self._physical(conn, table):
+                cur = conn.execute(f'SELECT * FROM "{name}" WHERE id > ? ORDER BY id LIMIT ?', (after, limit))
+                rows.extend(dict(r) for r in cur.fetchall())
+        finally:
+            conn.execute("COMMIT")
+        rows.sort(key=lambda r: r["id"])
+        return rows[:limit]
+
+    def _read_page(self) -> int:
+        """Lê uma página de cada tabela para o lote aberto. Retorna quantos registros entraram."""
+        t0 = time.perf_counter()
+        conn = self._connection()
+        added, caught_up = 0, True
+        for table in self.tables:
+            rows = self._fetch(conn, table, self._read[table])
+            if len(rows) >= self.cfg.SYNC_PAGE_ROWS:
+                caught_up = False
+            for row in rows:
+                line = encode_record(table, row)
+                if self._lines and self._size + len(line) > self.cfg.SYNC_BATCH_MAX_BYTES:
+                    # Lote cheio: o resto fica para o próximo (a partir de _read)
+                    self._full, self.caught_up = True, False
+                    self._throttle(time.perf_counter() - t0)
+                    return added
+                if self._first_at is None:
+                    self._first_at = self.clock()
+                self._lines.append(line)
+                self._size += len(line)
+                rid = row["id"]
+                self._ranges.setdefault(table, [rid, rid])[1] = rid
+                self._read[table] = rid
+                added += 1
+        self.caught_up = caught_up
+        self._throttle(time.perf_counter() - t0)
+        return added
+
+    def _throttle(self, elapsed: float) -> None:
+        duty = min(1.0, max(0.01, self.cfg.SYNC_MAX_DUTY))
+        self._resume_at = self.clock() + elapsed * (1.0 - duty) / duty
+
+    # --- lotes ---
+    def _seal(self) -> None:
+        raw = b"".join(self._lines)
+        body, encoding = compress(raw)
+        key = "_".join(f"{t}-{lo}-{hi}" for t, (lo, hi) in self._ranges.items())
+        self._sealed = Batch(key, body, encoding, len(self._lines), len(raw), dict(self._read))
+        self._lines, self._size, self._first_at, self._ranges = [], 0, None, {}
+        self._full = False
+
+    def _upload(self) -> float:
+        batch = self._sealed
+        try:
+            self.uploader.upload(batch)
+        except Exception as e:
+            self._attempts += 1
+            delay = min(self.cfg.SYNC_RETRY_MAX_SEC, self.cfg.SYNC_RETRY_BASE_SEC * 2 ** (self._attempts - 1))
+            delay *= random.uniform(0.8, 1.2)
+            print(f"[SYNC] envio de {batch.key} falhou ({e}); nova tentativa em {delay:.1f}s")
+            self._retry_at = self.clock() + delay
+            return delay
+        save_state(self.cfg.SYNC_STATE_FILE, batch.watermarks)
+        self.state = dict(batch.watermarks)
+        self._sealed, self._attempts = None, 0
+        self.batches += 1
+        self.records += batch.records
+        return 0.0
+
+    def step(self, force: bool = False) -> float:
+        """
+        Um passo: reenvia o lote pendente, lê uma página ou fecha o lote.
+        force=True fecha o lote assim que as tabelas estão em dia (sem esperar
+        SYNC_BATCH_MAX_DELAY_SEC). Retorna os segundos até o próximo passo.
+        """
+        now = self.clock()
+        if self._sealed is not None:
+            return self._retry_at - now if now < self._retry_at else self._upload()
+        if now < self._resume_at:
+            return self._resume_at - now
+
+        added = 0
+        if not self._full:
+            try:
+                added = self._read_page()
+            except sqlite3.OperationalError as e:
+                # Banco ocupado/travado (ou ainda inexistente): reabre depois
+                print(f"[SYNC] leitura adiada: {e}")
+                self.close_db()
+                return self.cfg.SYNC_BUSY_BACKOFF_SEC
+
+        if not self._lines:
+            return 0.0 if added else self.cfg.SYNC_POLL_SEC
+        age = self.clock() - self._first_at
+        if self._full or age >= self.cfg.SYNC_BATCH_MAX_DELAY_SEC or (force and self.caught_up):
+            self._seal()
+            return self._upload()
+        if not self.caught_up:
+            return 0.0
+        return min(self.cfg.SYNC_POLL_SEC, self.cfg.SYNC_BATCH_MAX_DELAY_SEC - age)
+
+    def pending(self) -> bool:
+        return bool(self._lines) or self._sealed is not None
+
+    def drain(self, timeout: float = 60.0, sleep: Callable[[float], None] = time.sleep) -> bool:
+        """Envia tudo até o fim atual das tabelas. True se terminou dentro do prazo."""
+        deadline = time.monotonic() + timeout
+        self.caught_up = False
+        while time.monotonic() < deadline:
+            wait = self.step(force=True)
+            if self.caught_up and not self.pending():
+                return True
+            if wait > 0:
+                sleep(min(wait, max(0.0, deadline - time.monotonic())))
+        return False
+
+    def run(self, stop: threading.Event) -> None:
+        while not stop.is_set():
+            wait = self.step()
+            if wait > 0:
+                stop.wait(wait)
+        # Encerramento: tenta entregar o lote aberto; o que faltar sai do checkpoint
+        if self._lines:
+            self._seal()
+        if self._sealed is not None:
+            self._upload()
+
+    def close_db(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def close(self) -> None:
+        self.close_db()
+        self.uploader.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sincronização incremental EDGE -> nuvem")
+    parser.add_argument("--once", action="store_true", help="envia o que houver e sai")
+    args = parser.parse_args()
+
+    worker = SyncWorker(make_uploader(settings))
+    print(f"[SYNC] {settings.EDGE_DB_PATH} -> {settings.SYNC_TARGET} (checkpoint {worker.state})")
+    try:
+        if args.once:
+            ok = worker.drain(timeout=float("inf"))
+            print(f"[SYNC] {worker.records} registros em {worker.batches} lotes ({'ok' if ok else 'incompleto'})")
+            return
+        stop = threading.Event()
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        worker.run(stop)
+    finally:
+        worker.close()
+        print(f"[SYNC] encerrado; checkpoint {worker.state}")
+
+
+if __name__ == "__main__":
+    main()
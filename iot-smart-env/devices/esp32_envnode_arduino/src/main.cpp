@@ -16,6 +16,10 @@
 
 #define PUBLISH_INTERVAL_MS  2000UL
 
+// 1 = publica em MessagePack com IDs curtos em BASE_TOPIC "/mp"
+// (tabela de IDs em edge/app/services/codec.py); 0 = JSON
+#define PAYLOAD_MSGPACK  0
+
 #define DHTPIN     4
 #define DHTTYPE    DHT22
 #define PIR_PIN    14
@@ -30,6 +34,11 @@ DHT dht(DHTPIN, DHTTYPE);
 
 unsigned long lastPublish = 0;
 
+// Id de cada mensagem: "<boot>-<contador>". O edge ignora uma leitura com
+// msg_id repetido (reentrega); bootId distingue os contadores entre reinícios.
+uint32_t bootId = 0;
+uint32_t msgSeq = 0;
+
 static float clampf(float v, float lo, float hi) {
   if (v < lo) return lo;
   if (v > hi) return hi;
@@ -150,7 +159,33 @@ static void publishReading() {
   bool motion;
   readSensors(tempC, humRH, motion, soilPct);
 
+  char msgId[24];
+  snprintf(msgId, sizeof(msgId), "%08lx-%lu", (unsigned long)bootId, (unsigned long)++msgSeq);
+
   StaticJsonDocument<320> doc;
+#if PAYLOAD_MSGPACK
+  // ArduinoJson só gera chaves string: os IDs vão como "0", "1", ...
+  // Sem relógio de tempo real: sem timestamp (o edge usa a hora de chegada)
+  doc["0"] = NODE_ID;
+  if (!isnan(tempC)) doc["2"] = tempC;
+  if (!isnan(humRH)) doc["3"] = humRH;
+  doc["4"] = soilPct;
+  doc["5"] = motion;
+  doc["6"] = FW_VERSION;
+  doc["7"] = WiFi.RSSI();
+  doc["8"] = msgId;
+
+  uint8_t buf[160];
+  size_t n = serializeMsgPack(doc, buf, sizeof(buf));
+  String topic = String(BASE_TOPIC) + "/mp";
+
+  if (mqttClient.publish(topic.c_str(), buf, n, false)) {
+    Serial.print(F("[PUB] msgpack bytes="));
+    Serial.println(n);
+  } else {
+    Serial.println(F("[PUB] Falha ao publicar"));
+  }
+#else
   doc["node_id"] = NODE_ID;
   if (!isnan(tempC)) doc["temperature_c"] = tempC;
   if (!isnan(humRH)) doc["humidity_pct"] = humRH;
@@ -158,6 +193,7 @@ static void publishReading() {
   doc["motion"] = motion;
   doc["firmware"] = FW_VERSION;
   doc["rssi_dbm"] = WiFi.RSSI();
+  doc["msg_id"] = msgId;
 
   char buf[384];
   size_t n = serializeJson(doc, buf, sizeof(buf));
@@ -168,12 +204,15 @@ static void publishReading() {
   } else {
     Serial.println(F("[PUB] Falha ao publicar"));
   }
+#endif
 }
 
 void setup() {
   Serial.begin(115200);
   delay(100);
 
+  bootId = esp_random();
+
   pinMode(PIR_PIN, INPUT);
   analogReadResolution(12);
 
@@ -1,23 +1,42 @@
 """
 Rotas REST do EDGE:
 - /health        (GET/HEAD)
+- /metrics       (GET, formato texto do Prometheus)
 - /readings      (GET, POST opcional p/ testes)
+- /readings/aggregate (GET, agregados 1m/1h/1d por nó)
+- /readings/page (GET, paginação por cursor em (timestamp, id))
+- /readings/export (GET, NDJSON/CSV em streaming, sem limite de linhas)
+- /readings/{id}/raw (GET, payload original reconstruído)
 - /rules         (GET, POST, PUT, DELETE)
+- /partitions    (GET, DELETE; com STORAGE_PARTITIONING=day|week)
+- /nodes         (GET, estado atual de todos os nós, da memória)
 """
 
 from __future__ import annotations
-from datetime import datetime
+import csv
+import io
+import json
+from datetime import date, datetime, timezone
 from typing import List, Optional
 
 from fastapi import APIRouter, Query, Depends, HTTPException, Response
-from pydantic import BaseModel, Field
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, model_validator
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from sqlalchemy import text
 
 from ..core.config import settings
 from ..core.security import AdminDep
-from ..db.db import get_session, init_db
-from ..db import models
+from ..db.db import engine, get_session, get_write_session, init_db, read_engine
+from ..db import models, partitions
+from ..services import readings as readings_q
+from ..services import metrics, rollups
+from ..services.ingest import ingest_readings
+from ..services.nodes import node_registry
+from ..services.rawpayload import rebuild_payload
+from ..services.recent import recent_readings
+from ..services.rules import rule_cache
+from ..services.stats import pipeline_stats
 
 api_router = APIRouter()
 
@@ -33,6 +52,11 @@ class ReadingOut(BaseModel):
     timestamp: datetime
 
 
+class ReadingPage(BaseModel):
+    items: List[ReadingOut]
+    next: Optional[str] = None  # cursor opaco da próxima página
+
+
 class ReadingIn(BaseModel):
     node_id: str = Field(..., min_length=1, max_length=120)
     temperature_c: float | None = None
@@ -41,23 +65,78 @@ class ReadingIn(BaseModel):
     motion: bool | None = None
     # se não vier timestamp, usamos "agora" (UTC) no backend
     timestamp: Optional[datetime] = None
+    # id da mensagem no nó: repetir o mesmo msg_id não grava de novo (409)
+    msg_id: Optional[str] = Field(None, max_length=64)
 
 
 class HealthOut(BaseModel):
     status: str
     mqtt: dict
     counts: dict
+    pipeline: dict
     db_url: str
 
 
+class MetricAggregate(BaseModel):
+    count: int
+    min: float | None = None
+    max: float | None = None
+    avg: float | None = None
+    last: float | None = None
+
+
+class AggregateOut(BaseModel):
+    node_id: str
+    bucket_start: datetime
+    count: int
+    metrics: dict[str, MetricAggregate]
+    motion_samples: int
+    motion_count: int
+
+
+class PartitionOut(BaseModel):
+    name: str
+    start: datetime
+    end: datetime
+
+
+class NodeOut(BaseModel):
+    node_id: str
+    online: bool | None = None  # último <tópico>/status (None = nunca recebido)
+    status_at: datetime | None = None
+    last_seen: datetime | None = None
+    firmware: str | None = None
+    topic: str | None = None
+    last: ReadingOut | None = None
+
+
 class RuleIn(BaseModel):
     name: str = Field(..., min_length=3, max_length=120)
     enabled: bool = True
     metric: str = Field(..., pattern="^(temperature_c|humidity_pct|soil_moisture_pct)$")
     operator: str = Field(..., pattern="^(<|<=|>|>=|==|!=)$")
     value: float
-    action: str = Field(..., pattern="^(notify|irrigation_on)$")
-    action_params: dict | None = None
+    action: str = Field(..., pattern="^(notify|irrigation_on|webhook)$")
+    action_params: dict | None = None  # webhook: {"url": "https://..."}
+    # Janela (opcional): "aggregate(metric) operator value" sobre window_sec
+    # segundos ou as últimas window_samples leituras do nó; rate = variação por minuto
+    aggregate: str | None = Field(None, pattern="^(avg|min|max|rate)$")
+    window_sec: float | None = Field(None, gt=0)
+    window_samples: int | None = Field(None, ge=1)
+
+    @model_validator(mode="after")
+    def _check_window(self):
+        has_window = (self.window_sec is not None) + (self.window_samples is not None)
+        if self.aggregate is None and has_window:
+            raise ValueError("window_sec/window_samples exigem aggregate")
+        if self.aggregate is not None and has_window != 1:
+            raise ValueError("aggregate exige exatamente um de window_sec ou window_samples")
+        if self.aggregate == "rate" and self.window_samples == 1:
+            raise ValueError("rate exige window_samples >= 2")
+        url = (self.action_params or {}).get("url")
+        if self.action == "webhook" and not (isinstance(url, str) and url.startswith(("http://", "https://"))):
+            raise ValueError("action webhook exige action_params.url (http/https)")
+        return self
 
 
 class RuleOut(RuleIn):
@@ -68,30 +147,44 @@ class RuleOut(RuleIn):
 
 # ---------- Inicialização do DB (uma vez) ----------
 init_db()
+with engine.begin() as _conn:
+    # Bancos criados antes dos agregados: preenche a partir de readings
+    rollups.backfill(_conn)
+    # Contadores do /health: única varredura, depois mantidos pela ingestão
+    pipeline_stats.seed(_conn)
+    # Últimas leituras por nó em memória (GET /readings sem intervalo, replay do WS)
+    recent_readings.warm(_conn)
+    # Registro dos nós (/nodes): última leitura de cada um
+    node_registry.warm(_conn)
+
+
+def _parse_dt(value: Optional[str]) -> Optional[datetime]:
+    """ISO 8601 (aceita 'Z') -> datetime UTC sem tzinfo; inválido -> None."""
+    if not value:
+        return None
+    try:
+        d = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except Exception:
+        return None
+    if d.tzinfo is not None:
+        d = d.astimezone(timezone.utc).replace(tzinfo=None)
+    return d
 
 
 # ---------- Endpoints ----------
 @api_router.get("/health", response_model=HealthOut)
-def health(db: Session = Depends(get_session)):
-    try:
-        total = db.execute(text("select count(1) from readings")).scalar_one()
-        nodes = db.execute(
-            text("select count(distinct node_id) from readings")
-        ).scalar_one()
-        status = "ok"
-    except Exception:
-        # Em caso de falha pontual de DB, não derruba a rota
-        total = 0
-        nodes = 0
-        status = "degraded"
+def health():
+    # O(1): contadores mantidos pela ingestão (services/stats.py), sem consultar o banco
+    snap = pipeline_stats.snapshot()
     return HealthOut(
-        status=status,
+        status="ok" if pipeline_stats.seeded else "degraded",
         mqtt={
             "host": settings.MQTT_HOST,
             "port": settings.MQTT_PORT,
             "topic": settings.MQTT_TOPIC,
         },
-        counts={"readings": int(total or 0), "nodes": int(nodes or 0)},
+        counts={"readings": snap.pop("readings"), "nodes": snap.pop("nodes")},
+        pipeline=snap,
         db_url=settings.DB_URL,
     )
 
@@ -102,6 +195,18 @@ def health_head():
     return Response(status_code=200)
 
 
+@api_router.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    # Só lê contadores em memória (sem consultar o banco)
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@api_router.get("/nodes", response_model=List[NodeOut])
+def list_nodes():
+    # Uma leitura do registro em memória (services/nodes.py), sem consultar o banco
+    return node_registry.snapshot()
+
+
 @api_router.get("/readings", response_model=List[ReadingOut])
 def get_readings(
     limit: int = Query(100, ge=1, le=5000),
@@ -110,52 +215,101 @@ def get_readings(
     until: Optional[str] = None,  # ISO 8601
     db: Session = Depends(get_session),
 ):
-    q = db.query(models.Reading)
-    if node_id:
-        q = q.filter(models.Reading.node_id == node_id)
-    if since:
-        try:
-            d = datetime.fromisoformat(since.replace("Z", "+00:00"))
-            q = q.filter(models.Reading.timestamp >= d)
-        except Exception:
-            pass
-    if until:
-        try:
-            d = datetime.fromisoformat(until.replace("Z", "+00:00"))
-            q = q.filter(models.Reading.timestamp <= d)
-        except Exception:
-            pass
-    q = q.order_by(models.Reading.id.desc()).limit(limit)
-    rows = list(reversed(q.all()))
-    return [
-        ReadingOut(
-            id=r.id,
-            node_id=r.node_id,
-            temperature_c=r.temperature_c,
-            humidity_pct=r.humidity_pct,
-            soil_moisture_pct=r.soil_moisture_pct,
-            motion=r.motion,
-            timestamp=r.timestamp,
+    # Sem intervalo ("últimas N"): responde da memória quando o buffer cobre o pedido
+    rows = recent_readings.latest(limit, node_id) if since is None and until is None else None
+    if rows is None:
+        rows = readings_q.latest(db.connection(), limit, node_id=node_id, since=_parse_dt(since), until=_parse_dt(until))
+    return [ReadingOut(**r) for r in rows]
+
+
+@api_router.get("/readings/aggregate", response_model=List[AggregateOut])
+def get_readings_aggregate(
+    bucket: str = Query("1h", pattern="^(1m|1h|1d)$"),
+    node_id: Optional[str] = None,
+    since: Optional[str] = None,  # ISO 8601
+    until: Optional[str] = None,  # ISO 8601
+    limit: int = Query(1000, ge=1, le=50000),
+):
+    """Agregados por nó (count/min/max/avg/last) lidos das tabelas de rollup."""
+    with read_engine.connect() as conn:
+        rows = rollups.query(conn, bucket, node_id=node_id, since=_parse_dt(since), until=_parse_dt(until), limit=limit)
+    return [AggregateOut(**r) for r in rows]
+
+
+@api_router.get("/readings/page", response_model=ReadingPage)
+def get_readings_page(
+    limit: int = Query(500, ge=1, le=5000),
+    node_id: Optional[str] = None,
+    since: Optional[str] = None,  # ISO 8601
+    until: Optional[str] = None,  # ISO 8601
+    cursor: Optional[str] = None,
+):
+    """Páginas em ordem crescente de (timestamp, id); siga `next` até vir null."""
+    try:
+        after = readings_q.decode_cursor(cursor) if cursor else None
+    except readings_q.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+    with read_engine.connect() as conn:
+        rows, nxt = readings_q.page(
+            conn, limit, node_id=node_id, since=_parse_dt(since), until=_parse_dt(until), after=after
         )
-        for r in rows
-    ]
+    return ReadingPage(
+        items=[ReadingOut(**r) for r in rows],
+        next=readings_q.encode_cursor(*nxt) if nxt else None,
+    )
+
+
+def _export_ndjson(rows):
+    for r in rows:
+        yield json.dumps(dict(r, timestamp=r["timestamp"].isoformat()), ensure_ascii=False) + "\n"
+
+
+def _export_csv(rows):
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(readings_q.COLUMNS)
+    for i, r in enumerate(rows, 1):
+        w.writerow([r["timestamp"].isoformat() if c == "timestamp" else r[c] for c in readings_q.COLUMNS])
+        if i % 500 == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+@api_router.get("/readings/export")
+def export_readings(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    node_id: Optional[str] = None,
+    since: Optional[str] = None,  # ISO 8601
+    until: Optional[str] = None,  # ISO 8601
+):
+    """Exporta um intervalo arbitrário em streaming (memória constante)."""
+    rows = readings_q.iter_rows(read_engine, node_id=node_id, since=_parse_dt(since), until=_parse_dt(until))
+    if format == "csv":
+        return StreamingResponse(_export_csv(rows), media_type="text/csv")
+    return StreamingResponse(_export_ndjson(rows), media_type="application/x-ndjson")
+
+
+@api_router.get("/readings/{reading_id}/raw")
+def get_reading_raw(reading_id: int):
+    """Payload original recebido do nó (reconstruído no modo compacto)."""
+    with read_engine.connect() as conn:
+        row = readings_q.get_raw(conn, reading_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Leitura não encontrada.")
+    return rebuild_payload(row)
 
 
 @api_router.post("/readings", response_model=ReadingOut, dependencies=[AdminDep])
-def create_reading(body: ReadingIn, db: Session = Depends(get_session)):
-    """Endpoint opcional para testes manuais sem MQTT."""
-    ts = body.timestamp or datetime.utcnow()
-    r = models.Reading(
-        node_id=body.node_id,
-        temperature_c=body.temperature_c,
-        humidity_pct=body.humidity_pct,
-        soil_moisture_pct=body.soil_moisture_pct,
-        motion=body.motion,
-        timestamp=ts,
-    )
-    db.add(r)
-    db.commit()
-    db.refresh(r)
+def create_reading(body: ReadingIn):
+    """Endpoint opcional para testes manuais sem MQTT (mesmo pipeline da ingestão)."""
+    payload = body.model_dump(mode="json", exclude_none=True)
+    payload.setdefault("timestamp", datetime.utcnow().isoformat())
+    created = ingest_readings([payload])
+    if not created:
+        raise HTTPException(status_code=409, detail="Leitura já registrada para este nó e msg_id.")
+    r = created[0]
     return ReadingOut(
         id=r.id,
         node_id=r.node_id,
@@ -167,28 +321,32 @@ def create_reading(body: ReadingIn, db: Session = Depends(get_session)):
     )
 
 
+def _rule_out(r: models.Rule) -> RuleOut:
+    return RuleOut(
+        id=r.id,
+        name=r.name,
+        enabled=r.enabled,
+        metric=r.metric,
+        operator=r.operator,
+        value=r.value,
+        action=r.action,
+        action_params=r.action_params,
+        aggregate=r.aggregate,
+        window_sec=r.window_sec,
+        window_samples=r.window_samples,
+        created_at=r.created_at,
+        updated_at=r.updated_at,
+    )
+
+
 @api_router.get("/rules", response_model=List[RuleOut])
 def list_rules(db: Session = Depends(get_session)):
     rules = db.query(models.Rule).order_by(models.Rule.id.asc()).all()
-    return [
-        RuleOut(
-            id=r.id,
-            name=r.name,
-            enabled=r.enabled,
-            metric=r.metric,
-            operator=r.operator,
-            value=r.value,
-            action=r.action,
-            action_params=r.action_params,
-            created_at=r.created_at,
-            updated_at=r.updated_at,
-        )
-        for r in rules
-    ]
+    return [_rule_out(r) for r in rules]
 
 
 @api_router.post("/rules", response_model=RuleOut, dependencies=[AdminDep])
-def create_rule(body: RuleIn, db: Session = Depends(get_session)):
+def create_rule(body: RuleIn, db: Session = Depends(get_write_session)):
     if db.query(models.Rule).filter(models.Rule.name == body.name).first():
         raise HTTPException(status_code=400, detail="Nome de regra já existe.")
     r = models.Rule(
@@ -199,26 +357,19 @@ def create_rule(body: RuleIn, db: Session = Depends(get_session)):
         value=body.value,
         action=body.action,
         action_params=body.action_params or {},
+        aggregate=body.aggregate,
+        window_sec=body.window_sec,
+        window_samples=body.window_samples,
     )
     db.add(r)
     db.commit()
+    rule_cache.invalidate()
     db.refresh(r)
-    return RuleOut(
-        id=r.id,
-        name=r.name,
-        enabled=r.enabled,
-        metric=r.metric,
-        operator=r.operator,
-        value=r.value,
-        action=r.action,
-        action_params=r.action_params,
-        created_at=r.created_at,
-        updated_at=r.updated_at,
-    )
+    return _rule_out(r)
 
 
 @api_router.put("/rules/{rule_id}", response_model=RuleOut, dependencies=[AdminDep])
-def update_rule(rule_id: int, body: RuleIn, db: Session = Depends(get_session)):
+def update_rule(rule_id: int, body: RuleIn, db: Session = Depends(get_write_session)):
     r = db.query(models.Rule).filter(models.Rule.id == rule_id).first()
     if not r:
         raise HTTPException(status_code=404, detail="Regra não encontrada.")
@@ -229,27 +380,44 @@ def update_rule(rule_id: int, body: RuleIn, db: Session = Depends(get_session)):
     r.value = body.value
     r.action = body.action
     r.action_params = body.action_params or {}
+    r.aggregate = body.aggregate
+    r.window_sec = body.window_sec
+    r.window_samples = body.window_samples
     db.commit()
+    rule_cache.invalidate()
     db.refresh(r)
-    return RuleOut(
-        id=r.id,
-        name=r.name,
-        enabled=r.enabled,
-        metric=r.metric,
-        operator=r.operator,
-        value=r.value,
-        action=r.action,
-        action_params=r.action_params,
-        created_at=r.created_at,
-        updated_at=r.updated_at,
-    )
+    return _rule_out(r)
 
 
 @api_router.delete("/rules/{rule_id}", dependencies=[AdminDep])
-def delete_rule(rule_id: int, db: Session = Depends(get_session)):
+def delete_rule(rule_id: int, db: Session = Depends(get_write_session)):
     r = db.query(models.Rule).filter(models.Rule.id == rule_id).first()
     if not r:
         raise HTTPException(status_code=404, detail="Regra não encontrada.")
     db.delete(r)
     db.commit()
+    rule_cache.invalidate()
     return {"status": "deleted", "id": rule_id}
+
+
+@api_router.get("/partitions", response_model=List[PartitionOut])
+def list_partitions():
+    with read_engine.connect() as conn:
+        parts = partitions.list_partitions(conn)
+    return [PartitionOut(name=p.name, start=p.start, end=p.end) for p in parts]
+
+
+@api_router.delete("/partitions/{start}", dependencies=[AdminDep])
+def drop_partition(start: date):
+    """Remove a partição inteira que começa em `start` (DROP TABLE, sem DELETE)."""
+    with read_engine.connect() as conn:
+        part = next((p for p in partitions.list_partitions(conn) if p.start.date() == start), None)
+        # Contagem pelo rollup de 1h (mesma transação da ingestão), sem varrer a partição
+        r = models.ReadingRollup1h.__table__
+        removed = conn.execute(
+            select(func.coalesce(func.sum(r.c.count), 0)).where(r.c.bucket_start >= part.start, r.c.bucket_start < part.end)
+        ).scalar_one() if part else 0
+    if not partitions.drop_partition(engine, start):
+        raise HTTPException(status_code=404, detail="Partição não encontrada.")
+    pipeline_stats.record_removed(removed)
+    return {"status": "dropped", "start": start.isoformat()}
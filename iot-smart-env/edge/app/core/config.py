@@ -30,9 +30,135 @@ class Settings:
     MQTT_PORT: int = int(os.getenv("MQTT_PORT", "1883"))
     MQTT_TOPIC: str = os.getenv("MQTT_TOPIC", "iot/+/+/reading")  # wildcard suportado
     MQTT_CLIENT_ID: str = os.getenv("MQTT_CLIENT_ID", "edge-consumer")
+    # Assinatura compartilhada (MQTT v5, "$share/<grupo>/<tópico>"): várias
+    # instâncias do EDGE dividem as mensagens. Com grupo definido, o client id
+    # vira "<MQTT_CLIENT_ID>-<MQTT_INSTANCE_ID>" (padrão: host-pid), único por processo.
+    MQTT_SHARED_GROUP: str = os.getenv("MQTT_SHARED_GROUP", "").strip()
+    MQTT_INSTANCE_ID: str = os.getenv("MQTT_INSTANCE_ID", "").strip()
+    MQTT_PROTOCOL: str = os.getenv("MQTT_PROTOCOL", "3.1.1").strip()  # 3.1.1 | 5
+    # Leituras em MessagePack (services/codec.py) chegam em <tópico><sufixo>
+    # (ex.: iot/env/room1/reading/mp) ou com content-type application/msgpack
+    # (MQTT v5). Vazio: só content-type.
+    MQTT_BINARY_SUFFIX: str = os.getenv("MQTT_BINARY_SUFFIX", "/mp").strip()
+    # QoS da assinatura das leituras. Com INGEST_JOURNAL_DIR, o PUBACK só sai
+    # depois do fsync do journal e a sessão é persistente (clean_session=False;
+    # no v5, expira em MQTT_SESSION_EXPIRY_SEC): o broker reentrega o que não
+    # foi confirmado. O client id precisa ser estável (MQTT_INSTANCE_ID com
+    # grupo), e o limite de mensagens em voo do broker (ex.: Mosquitto
+    # max_inflight_messages, padrão 20) limita a vazão a ~N por fsync.
+    MQTT_QOS: int = int(os.getenv("MQTT_QOS", "1"))
+    MQTT_SESSION_EXPIRY_SEC: int = int(os.getenv("MQTT_SESSION_EXPIRY_SEC", "3600"))
 
     # Banco
     DB_URL: str = os.getenv("DB_URL", "sqlite:///./edge_readings.db")
+    # Bancos existentes: cria os índices únicos novos (ex.: node_id + msg_id
+    # das leituras) no init_db. Nunca apaga linhas; com conflitos, lista-os
+    # e não cria o índice.
+    DB_MIGRATE_UNIQUE_INDEXES: bool = os.getenv("DB_MIGRATE_UNIQUE_INDEXES", "0").strip().lower() in ("1", "true", "yes")
+
+    # Perfil do SQLite: "wal" (WAL + um escritor dedicado + pool de leitura
+    # somente-leitura) ou "legacy" (engine única, journal padrão)
+    SQLITE_PROFILE: str = os.getenv("SQLITE_PROFILE", "wal").strip().lower()
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").strip().upper()
+    SQLITE_CACHE_MB: int = int(os.getenv("SQLITE_CACHE_MB", "64"))
+    SQLITE_MMAP_MB: int = int(os.getenv("SQLITE_MMAP_MB", "256"))
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_READ_POOL: int = int(os.getenv("SQLITE_READ_POOL", "4"))
+
+    # Particionamento das leituras por tempo: none | day | week
+    STORAGE_PARTITIONING: str = os.getenv("STORAGE_PARTITIONING", "none").strip().lower()
+
+    # Retenção: leituras mais antigas que N dias vão para segmentos
+    # comprimidos em ARCHIVE_DIR (0 = desativado)
+    RETENTION_RAW_DAYS: int = int(os.getenv("RETENTION_RAW_DAYS", "0"))
+    ARCHIVE_DIR: str = os.getenv("ARCHIVE_DIR", "./archive")
+    RETENTION_INTERVAL_SEC: float = float(os.getenv("RETENTION_INTERVAL_SEC", "3600"))
+    RETENTION_DELETE_CHUNK: int = int(os.getenv("RETENTION_DELETE_CHUNK", "500"))
+    RETENTION_PAUSE_MS: int = int(os.getenv("RETENTION_PAUSE_MS", "20"))
+
+    # Payload bruto: "json" (raw_json completo) ou "compact" (só campos não
+    # mapeados em colunas, comprimidos em raw_extra)
+    RAW_PAYLOAD_MODE: str = os.getenv("RAW_PAYLOAD_MODE", "json").strip().lower()
+
+    # Ingestão em lote (group commit): até N mensagens ou T ms por transação.
+    # INGEST_BATCH_SIZE=1 equivale ao modo antigo (um commit por leitura).
+    INGEST_BATCH_SIZE: int = int(os.getenv("INGEST_BATCH_SIZE", "200"))
+    INGEST_BATCH_LINGER_MS: int = int(os.getenv("INGEST_BATCH_LINGER_MS", "50"))
+    # Threads de ingestão; mensagens são distribuídas por hash do node_id
+    # (a ordem por nó é preservada, nós diferentes em paralelo)
+    INGEST_WORKERS: int = int(os.getenv("INGEST_WORKERS", "2"))
+    # Decodificador das mensagens: "fast" (esquema tipado, msgspec se
+    # instalado, com fallback tolerante) ou "lenient" (sempre tolerante)
+    INGEST_DECODER: str = os.getenv("INGEST_DECODER", "fast").strip().lower()
+    # Modo da ingestão MQTT: "threads" (paho + pipeline em threads) ou
+    # "asyncio" (aiomqtt + SQLAlchemy assíncrono no event loop do FastAPI;
+    # requer aiomqtt e aiosqlite)
+    INGEST_MODE: str = os.getenv("INGEST_MODE", "threads").strip().lower()
+    # Journal de ingestão em disco (services/journal.py; modo threads): cada
+    # mensagem é anexada antes do PUBACK e reprocessada na partida se não
+    # chegou ao banco. Vazio = desligado.
+    INGEST_JOURNAL_DIR: str = os.getenv("INGEST_JOURNAL_DIR", "").strip()
+    INGEST_JOURNAL_SEGMENT_MB: int = int(os.getenv("INGEST_JOURNAL_SEGMENT_MB", "16"))
+    INGEST_JOURNAL_FSYNC_MS: int = int(os.getenv("INGEST_JOURNAL_FSYNC_MS", "20"))
+    INGEST_JOURNAL_REPLAY_BATCH: int = int(os.getenv("INGEST_JOURNAL_REPLAY_BATCH", "5000"))
+    # Desligamento: tempo máximo para esvaziar as filas da ingestão
+    INGEST_DRAIN_TIMEOUT_SEC: float = float(os.getenv("INGEST_DRAIN_TIMEOUT_SEC", "10"))
+
+    # Pipeline em etapas (decode -> persist -> broadcast / rules), ligadas por
+    # filas limitadas. Política quando a fila enche: block | drop_oldest | sample
+    # (sample: aceita 1 a cada PIPELINE_SAMPLE_EVERY itens excedentes,
+    # descartando o mais antigo). A etapa decode usa INGEST_WORKERS threads e
+    # recebe do loop de rede do paho: "block" nela atrasa keepalives, por isso
+    # o padrão é descartar. Com INGEST_JOURNAL_DIR, decode e persist usam
+    # sempre "block" (as mensagens já foram confirmadas ao broker).
+    PIPELINE_DECODE_QUEUE_MAX: int = int(os.getenv("PIPELINE_DECODE_QUEUE_MAX", "10000"))
+    PIPELINE_DECODE_POLICY: str = os.getenv("PIPELINE_DECODE_POLICY", "drop_oldest").strip().lower()
+    PIPELINE_PERSIST_WORKERS: int = int(os.getenv("PIPELINE_PERSIST_WORKERS", "1"))
+    PIPELINE_PERSIST_QUEUE_MAX: int = int(os.getenv("PIPELINE_PERSIST_QUEUE_MAX", "10000"))
+    PIPELINE_PERSIST_POLICY: str = os.getenv("PIPELINE_PERSIST_POLICY", "block").strip().lower()
+    # Falha temporária do banco (travado/ocupado): a etapa persist tenta
+    # de novo com backoff (BASE .. MAX) e as mensagens ficam no journal
+    PIPELINE_PERSIST_RETRY_BASE_SEC: float = float(os.getenv("PIPELINE_PERSIST_RETRY_BASE_SEC", "0.5"))
+    PIPELINE_PERSIST_RETRY_MAX_SEC: float = float(os.getenv("PIPELINE_PERSIST_RETRY_MAX_SEC", "30"))
+    PIPELINE_BROADCAST_WORKERS: int = int(os.getenv("PIPELINE_BROADCAST_WORKERS", "1"))
+    PIPELINE_BROADCAST_QUEUE_MAX: int = int(os.getenv("PIPELINE_BROADCAST_QUEUE_MAX", "5000"))
+    PIPELINE_BROADCAST_POLICY: str = os.getenv("PIPELINE_BROADCAST_POLICY", "drop_oldest").strip().lower()
+    PIPELINE_RULES_WORKERS: int = int(os.getenv("PIPELINE_RULES_WORKERS", "1"))
+    PIPELINE_RULES_QUEUE_MAX: int = int(os.getenv("PIPELINE_RULES_QUEUE_MAX", "10000"))
+    PIPELINE_RULES_POLICY: str = os.getenv("PIPELINE_RULES_POLICY", "block").strip().lower()
+    PIPELINE_SAMPLE_EVERY: int = int(os.getenv("PIPELINE_SAMPLE_EVERY", "10"))
+
+    # Regras com janela: teto de amostras guardadas por (nó, métrica, janela)
+    RULE_WINDOW_MAX_SAMPLES: int = int(os.getenv("RULE_WINDOW_MAX_SAMPLES", "10000"))
+
+    # Despachante de ações (services/actions.py): ActionLog em lote e webhooks
+    # com pool keep-alive, limite por endpoint, lotes por requisição e retry
+    ACTIONS_BATCH_SIZE: int = int(os.getenv("ACTIONS_BATCH_SIZE", "200"))
+    ACTIONS_BATCH_LINGER_MS: int = int(os.getenv("ACTIONS_BATCH_LINGER_MS", "50"))
+    ACTIONS_HTTP_TIMEOUT_SEC: float = float(os.getenv("ACTIONS_HTTP_TIMEOUT_SEC", "5"))
+    ACTIONS_HTTP_MAX_CONNECTIONS: int = int(os.getenv("ACTIONS_HTTP_MAX_CONNECTIONS", "20"))
+    ACTIONS_HTTP_PER_ENDPOINT: int = int(os.getenv("ACTIONS_HTTP_PER_ENDPOINT", "2"))
+    ACTIONS_HTTP_BATCH: int = int(os.getenv("ACTIONS_HTTP_BATCH", "50"))
+    ACTIONS_RETRY_BASE_SEC: float = float(os.getenv("ACTIONS_RETRY_BASE_SEC", "1"))
+    ACTIONS_RETRY_MAX_SEC: float = float(os.getenv("ACTIONS_RETRY_MAX_SEC", "300"))
+    ACTIONS_RETRY_MAX_ATTEMPTS: int = int(os.getenv("ACTIONS_RETRY_MAX_ATTEMPTS", "10"))
+    # Ação "notify" também vai para este webhook (vazio = só ActionLog)
+    NOTIFY_WEBHOOK_URL: str = os.getenv("NOTIFY_WEBHOOK_URL", "").strip()
+
+    # WebSocket: fila de saída por cliente e tempo máximo de um envio
+    WS_SEND_QUEUE_MAX: int = int(os.getenv("WS_SEND_QUEUE_MAX", "256"))
+    WS_SEND_TIMEOUT_SEC: float = float(os.getenv("WS_SEND_TIMEOUT_SEC", "10"))
+    # Com mais que isso na fila o cliente está atrasado: conflaciona por node_id
+    WS_CONFLATE_AFTER: int = int(os.getenv("WS_CONFLATE_AFTER", "32"))
+    # Leituras recentes repetidas a cada cliente WebSocket novo (0 = nenhuma)
+    WS_REPLAY: int = int(os.getenv("WS_REPLAY", "50"))
+
+    # Leituras recentes em memória (GET /readings sem intervalo, replay do WS);
+    # RECENT_PER_NODE=0 desliga (ver services/recent.py)
+    RECENT_PER_NODE: int = int(os.getenv("RECENT_PER_NODE", "100"))
+    RECENT_GLOBAL: int = int(os.getenv("RECENT_GLOBAL", "1000"))
+    # Máximo de nós com buffer próprio; o menos recente sai (volta a consultar o banco)
+    RECENT_MAX_NODES: int = int(os.getenv("RECENT_MAX_NODES", "1000"))
 
     # CORS (usar default_factory para evitar lista mutável estática)
     ALLOW_ORIGINS: List[str] = field(default_factory=_split_origins)
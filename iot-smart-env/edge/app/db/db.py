@@ -1,9 +1,32 @@
 """
 Inicialização do banco (SQLAlchemy 2.x)
+
+- engine / SessionLocal: escrita (ingestão, log de ações, CRUD de regras).
+- read_engine / ReadSessionLocal: consultas da API (get_session).
+
+Com SQLite em arquivo e SQLITE_PROFILE=wal (padrão):
+- journal em WAL: leitores não bloqueiam o escritor (e vice-versa);
+- `engine` tem uma única conexão (pool de tamanho 1): as escritas fazem fila
+  no pool em vez de disputar o lock do arquivo ("database is locked");
+- `read_engine` é um pool separado de SQLITE_READ_POOL conexões com
+  PRAGMA query_only;
+- synchronous/cache/mmap/busy_timeout configuráveis (SQLITE_*). Com
+  INGEST_JOURNAL_DIR, synchronous é no mínimo FULL: o journal apaga as
+  mensagens depois do commit, e em WAL com NORMAL um commit pode se perder
+  numa queda de energia.
+Nos demais casos (outros bancos, SQLite em memória, perfil "legacy"),
+read_engine é a própria engine.
+
+get_async_engine(): engine assíncrona (aiosqlite/asyncpg) para
+INGEST_MODE=asyncio, criada sob demanda; com SQLite ajustado, também tem uma
+única conexão e os mesmos PRAGMAs do escritor.
 """
 
 from __future__ import annotations
-from sqlalchemy import create_engine
+from typing import Any
+
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import Connection, make_url
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
 from ..core.config import settings
@@ -13,17 +36,204 @@ class Base(DeclarativeBase):
     pass
 
 
+def _tuned_sqlite() -> bool:
+    url = make_url(settings.DB_URL)
+    return (
+        url.get_backend_name() == "sqlite"
+        and settings.SQLITE_PROFILE == "wal"
+        and url.database not in (None, "", ":memory:")
+    )
+
+
+def _pragmas(dbapi_conn, statements: list[str]) -> None:
+    cur = dbapi_conn.cursor()
+    try:
+        for stmt in statements:
+            cur.execute(stmt)
+    finally:
+        cur.close()
+
+
+def _common_pragmas() -> list[str]:
+    return [
+        f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA cache_size=-{settings.SQLITE_CACHE_MB * 1024}",
+        f"PRAGMA mmap_size={settings.SQLITE_MMAP_MB * 1024 * 1024}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+
+def _synchronous() -> str:
+    if settings.INGEST_JOURNAL_DIR and settings.SQLITE_SYNCHRONOUS not in ("FULL", "EXTRA"):
+        print(f"[DB] SQLITE_SYNCHRONOUS={settings.SQLITE_SYNCHRONOUS} com INGEST_JOURNAL_DIR; usando FULL")
+        return "FULL"
+    return settings.SQLITE_SYNCHRONOUS
+
+
+def _on_writer_connect(dbapi_conn, _record):
+    _pragmas(dbapi_conn, [
+        "PRAGMA journal_mode=WAL",
+        f"PRAGMA synchronous={_synchronous()}",
+        *_common_pragmas(),
+    ])
+
+
 _engine_kwargs = {"connect_args": {"check_same_thread": False}} if settings.DB_URL.startswith("sqlite") else {}
-engine = create_engine(settings.DB_URL, **_engine_kwargs)
+
+if _tuned_sqlite():
+    # Escritor dedicado: uma conexão; quem precisar escrever espera no pool
+    engine = create_engine(settings.DB_URL, pool_size=1, max_overflow=0, pool_timeout=60, **_engine_kwargs)
+    read_engine = create_engine(
+        settings.DB_URL, pool_size=max(1, settings.SQLITE_READ_POOL), max_overflow=0, **_engine_kwargs
+    )
+    event.listen(engine, "connect", _on_writer_connect)
+
+    @event.listens_for(read_engine, "connect")
+    def _on_reader_connect(dbapi_conn, _record):
+        _pragmas(dbapi_conn, [*_common_pragmas(), "PRAGMA query_only=1"])
+else:
+    engine = create_engine(settings.DB_URL, **_engine_kwargs)
+    read_engine = engine
+
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+ReadSessionLocal = sessionmaker(bind=read_engine, expire_on_commit=False)
+
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+_async_engine: Any = None
+
+
+def async_url(url: str) -> str:
+    """DB_URL com o driver assíncrono equivalente (sqlite -> sqlite+aiosqlite...)."""
+    u = make_url(url)
+    driver = _ASYNC_DRIVERS.get(u.get_backend_name())
+    if driver is None:
+        raise RuntimeError(f"sem driver assíncrono para {u.get_backend_name()!r}")
+    return u.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def get_async_engine():
+    """
+    Engine assíncrona (INGEST_MODE=asyncio), criada na primeira chamada.
+    Requer o pacote `aiosqlite` (SQLite) ou `asyncpg` (PostgreSQL).
+    """
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+        kwargs: dict = {}
+        if _tuned_sqlite():
+            # Mesma regra do escritor síncrono: uma conexão, reaproveitada
+            kwargs = {"poolclass": AsyncAdaptedQueuePool, "pool_size": 1, "max_overflow": 0, "pool_timeout": 60}
+        _async_engine = create_async_engine(async_url(settings.DB_URL), **kwargs)
+        if _tuned_sqlite():
+            event.listen(_async_engine.sync_engine, "connect", _on_writer_connect)
+    return _async_engine
+
+
+async def dispose_async_engine() -> None:
+    global _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+
+
+def ensure_columns(conn: Connection, table) -> None:
+    """
+    Migração mínima: adiciona colunas novas (anuláveis) que ainda não existem
+    em tabelas criadas por versões anteriores.
+    """
+    existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    for col in table.columns:
+        if col.name not in existing and col.nullable:
+            col_type = col.type.compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" {col_type}')
+
+
+def drop_indexes(conn: Connection, table, names: list[str]) -> None:
+    """Remove índices de versões anteriores (os dados não mudam)."""
+    existing = {ix["name"] for ix in inspect(conn).get_indexes(table.name)}
+    for name in names:
+        if name in existing:
+            conn.exec_driver_sql(f'DROP INDEX "{name}"')
+            print(f"[DB] {table.name}: índice antigo {name} removido")
+
+
+def ensure_indexes(conn: Connection, table) -> None:
+    """Cria, em tabelas já existentes, índices comuns (não únicos) declarados depois delas."""
+    existing = {ix["name"] for ix in inspect(conn).get_indexes(table.name)}
+    for ix in table.indexes:
+        if not ix.unique and ix.name not in existing:
+            ix.create(conn)
+            print(f"[DB] {table.name}: índice {ix.name} criado")
+
+
+def unique_conflicts(conn: Connection, table, ix, limit: int = 5) -> tuple[int, list]:
+    """
+    Grupos de linhas que violariam o índice único `ix` (NULL não conflita):
+    total de grupos e até `limit` exemplos (valores das colunas, quantidade).
+    """
+    cols = ", ".join(f'"{c.name}"' for c in ix.columns)
+    not_null = " AND ".join(f'"{c.name}" IS NOT NULL' for c in ix.columns)
+    groups = (
+        f'SELECT {cols}, COUNT(*) AS n FROM "{table.name}" WHERE {not_null} '
+        f"GROUP BY {cols} HAVING COUNT(*) > 1"
+    )
+    total = conn.exec_driver_sql(f"SELECT COUNT(*) FROM ({groups}) AS g").scalar() or 0
+    sample = [tuple(r) for r in conn.exec_driver_sql(f"{groups} LIMIT {int(limit)}")] if total else []
+    return total, sample
+
+
+def ensure_unique_indexes(conn: Connection, table) -> None:
+    """
+    Cria, em tabelas já existentes, índices únicos declarados depois delas.
+    Só com DB_MIGRATE_UNIQUE_INDEXES=1, e nunca apaga linhas: se houver
+    conflitos, eles são listados e o índice não é criado até serem
+    resolvidos (a ingestão segue, sem deduplicação nessa tabela).
+    """
+    existing = {ix["name"] for ix in inspect(conn).get_indexes(table.name)}
+    for ix in table.indexes:
+        if not ix.unique or ix.name in existing:
+            continue
+        if not settings.DB_MIGRATE_UNIQUE_INDEXES:
+            print(f"[DB] {table.name}: índice único {ix.name} ausente "
+                  "(DB_MIGRATE_UNIQUE_INDEXES=1 para criar)")
+            continue
+        total, sample = unique_conflicts(conn, table, ix)
+        if total:
+            print(f"[DB] {table.name}: {total} grupos de linhas violam {ix.name}; índice não criado. "
+                  f"Exemplos (colunas..., linhas): {sample}")
+            continue
+        ix.create(conn)
+        print(f"[DB] {table.name}: índice {ix.name} criado")
 
 
 def init_db():
     from . import models  # importa para registrar mapeamentos
+    from . import partitions
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            ensure_columns(conn, table)
+            if table.name == models.Reading.__tablename__:
+                # Versões anteriores deduplicavam por (node_id, timestamp)
+                drop_indexes(conn, table, ["ux_readings_node_ts"])
+            ensure_indexes(conn, table)
+            ensure_unique_indexes(conn, table)
+        partitions.migrate(conn)
 
 
 def get_session():
+    """Sessão somente-leitura (pool de leitura)."""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_write_session():
+    """Sessão de escrita (conexão do escritor); use só em rotas que gravam."""
     db = SessionLocal()
     try:
         yield db
@@ -1,15 +1,19 @@
 """
 Modelos SQLAlchemy:
 - Reading: leituras dos sensores
-- Rule: regras de automação (thresholds, etc.)
+- Rule: regras de automação (thresholds, opcionalmente sobre janelas)
 - ActionLog: log de ações disparadas por regras
+- ActionOutbox: entregas de webhook pendentes (outbox persistente)
+- ReadingRollup1m / ReadingRollup1h: agregados por nó (count/min/max/sum/last)
+  mantidos incrementalmente pela ingestão
+- ReadingIdSequence: próximo ID de leitura quando há particionamento por tempo
 """
 
 from __future__ import annotations
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import String, Integer, Float, Boolean, DateTime, Text, ForeignKey, JSON
+from sqlalchemy import String, Integer, Float, Boolean, DateTime, Text, ForeignKey, JSON, LargeBinary, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .db import Base
@@ -17,6 +21,11 @@ from .db import Base
 
 class Reading(Base):
     __tablename__ = "readings"
+    # Uma leitura por nó e msg_id (id da mensagem gerado pelo nó): a ingestão
+    # ignora reentregas (redelivery, reinício de instância, vários
+    # consumidores). Sem msg_id (NULL) não há deduplicação: duas leituras no
+    # mesmo instante são leituras distintas.
+    __table_args__ = (Index("ux_readings_node_msg", "node_id", "msg_id", unique=True),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     node_id: Mapped[str] = mapped_column(String(64), index=True)
@@ -25,7 +34,11 @@ class Reading(Base):
     soil_moisture_pct: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
     motion: Mapped[Optional[bool]] = mapped_column(Boolean, nullable=True)
     timestamp: Mapped[datetime] = mapped_column(DateTime, index=True)
+    msg_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     raw_json: Mapped[str] = mapped_column(Text, nullable=False)
+    # RAW_PAYLOAD_MODE=compact: raw_json fica vazio e só os campos não mapeados
+    # vão aqui, comprimidos (ver services/rawpayload.py)
+    raw_extra: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True)
 
 
 class Rule(Base):
@@ -38,6 +51,10 @@ class Rule(Base):
     metric: Mapped[str] = mapped_column(String(64))  # ex: temperature_c | humidity_pct | soil_moisture_pct
     operator: Mapped[str] = mapped_column(String(8))  # <, <=, >, >=, ==, !=
     value: Mapped[float] = mapped_column(Float)
+    # Janela (opcional): compara o agregado da métrica na janela em vez do valor atual
+    aggregate: Mapped[Optional[str]] = mapped_column(String(8), nullable=True)  # avg | min | max | rate
+    window_sec: Mapped[Optional[float]] = mapped_column(Float, nullable=True)  # duração (pelo timestamp)
+    window_samples: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)  # ou últimas N amostras
     action: Mapped[str] = mapped_column(String(64))   # ex: "irrigation_on", "notify"
     action_params: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
@@ -57,3 +74,63 @@ class ActionLog(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     rule: Mapped[Optional["Rule"]] = relationship(back_populates="logs")
+
+
+class ActionOutbox(Base):
+    """Entregas HTTP pendentes das ações (webhooks); a linha sai quando a entrega dá certo."""
+    __tablename__ = "action_outbox"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    url: Mapped[str] = mapped_column(String(500), index=True)
+    body: Mapped[dict] = mapped_column(JSON)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    # Sem próxima tentativa: esgotou as tentativas (ou erro permanente, ex.: HTTP 404)
+    next_attempt_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True, index=True)
+    last_error: Mapped[Optional[str]] = mapped_column(String(300), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class _RollupColumns:
+    """Colunas comuns das tabelas de agregados (uma linha por nó e intervalo)."""
+
+    node_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    bucket_start: Mapped[datetime] = mapped_column(DateTime, primary_key=True, index=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+    last_ts: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+    temperature_c_count: Mapped[int] = mapped_column(Integer, default=0)
+    temperature_c_min: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    temperature_c_max: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    temperature_c_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    temperature_c_last: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+
+    humidity_pct_count: Mapped[int] = mapped_column(Integer, default=0)
+    humidity_pct_min: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    humidity_pct_max: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    humidity_pct_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    humidity_pct_last: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+
+    soil_moisture_pct_count: Mapped[int] = mapped_column(Integer, default=0)
+    soil_moisture_pct_min: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    soil_moisture_pct_max: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    soil_moisture_pct_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    soil_moisture_pct_last: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+
+    # motion: amostras com o campo presente e quantas foram "true"
+    motion_samples: Mapped[int] = mapped_column(Integer, default=0)
+    motion_count: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class ReadingRollup1m(_RollupColumns, Base):
+    __tablename__ = "reading_rollups_1m"
+
+
+class ReadingRollup1h(_RollupColumns, Base):
+    __tablename__ = "reading_rollups_1h"
+
+
+class ReadingIdSequence(Base):
+    __tablename__ = "reading_id_seq"
+
+    name: Mapped[str] = mapped_column(String(32), primary_key=True)
+    next_id: Mapped[int] = mapped_column(Integer)
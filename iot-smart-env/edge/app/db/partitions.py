@@ -0,0 +1,178 @@
+"""
+Particionamento opcional das leituras por tempo (STORAGE_PARTITIONING=day|week).
+
+- Uma tabela por dia/semana (readings_pAAAAMMDD, data de início), com as mesmas
+  colunas de `readings`; criada automaticamente na ingestão.
+- IDs continuam globais e crescentes: são reservados em blocos na tabela
+  reading_id_seq (um UPDATE ... RETURNING por lote).
+- Consultas recebem só as partições que cruzam o intervalo pedido.
+- Remover uma partição antiga é um DROP TABLE, sem DELETE linha a linha.
+- A tabela `readings` original continua sendo lida (dados anteriores ao
+  particionamento) como uma partição sem limites.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from sqlalchemy import Index, MetaData, Table, func, inspect, select, update
+from sqlalchemy.engine import Connection, Engine
+
+from ..core.config import settings
+from . import models
+from .db import drop_indexes, ensure_columns, ensure_indexes, ensure_unique_indexes
+
+_NAME_RE = re.compile(r"^readings_p(\d{8})$")
+_metadata = MetaData()
+_lock = threading.Lock()
+_known: dict[date, Table] | None = None
+
+
+@dataclass(frozen=True)
+class Partition:
+    start: Optional[datetime]  # None = tabela legada (sem limites)
+    end: Optional[datetime]    # exclusivo
+    table: Table
+
+    @property
+    def name(self) -> str:
+        return self.table.name
+
+
+def enabled() -> bool:
+    return settings.STORAGE_PARTITIONING in ("day", "week")
+
+
+def _span() -> timedelta:
+    return timedelta(days=7 if settings.STORAGE_PARTITIONING == "week" else 1)
+
+
+def partition_start(ts: datetime) -> date:
+    d = ts.date()
+    if settings.STORAGE_PARTITIONING == "week":
+        d -= timedelta(days=d.weekday())  # semana começa na segunda
+    return d
+
+
+def partition_table(start: date) -> Table:
+    name = f"readings_p{start:%Y%m%d}"
+    t = _metadata.tables.get(name)
+    if t is None:
+        cols = [c._copy() for c in models.Reading.__table__.columns]
+        for c in cols:
+            c.index = None  # índices declarados abaixo, com nomes próprios
+            if c.name == "id":
+                c.autoincrement = False
+        t = Table(name, _metadata, *cols)
+        Index(f"ix_{name}_node_id", t.c.node_id)
+        Index(f"ix_{name}_timestamp", t.c.timestamp)
+        Index(f"ux_{name}_node_msg", t.c.node_id, t.c.msg_id, unique=True)
+    return t
+
+
+def _load(conn: Connection) -> dict[date, Table]:
+    global _known
+    if _known is None:
+        found = {}
+        for name in inspect(conn).get_table_names():
+            m = _NAME_RE.match(name)
+            if m:
+                start = datetime.strptime(m.group(1), "%Y%m%d").date()
+                found[start] = partition_table(start)
+        _known = found
+    return _known
+
+
+def ensure_partitions(engine: Engine, starts: set[date]) -> None:
+    """Cria (fora da transação de ingestão) as partições que ainda não existem."""
+    with _lock:
+        with engine.connect() as conn:
+            known = _load(conn)
+        missing = [s for s in starts if s not in known]
+        if not missing:
+            return
+        with engine.begin() as conn:
+            for s in missing:
+                partition_table(s).create(conn, checkfirst=True)
+        for s in missing:
+            known[s] = partition_table(s)
+
+
+def partitions_for_range(
+    conn: Connection, since: Optional[datetime] = None, until: Optional[datetime] = None
+) -> list[Partition]:
+    """Partições que cruzam [since, until], em ordem crescente; a legada vem primeiro."""
+    legacy = Partition(None, None, models.Reading.__table__)
+    if not enabled():
+        return [legacy]
+    span = _span()
+    out = [legacy]
+    known = _load(conn)
+    for start in sorted(known):
+        lo = datetime.combine(start, time.min)
+        hi = lo + span
+        if since is not None and hi <= since:
+            continue
+        if until is not None and lo > until:
+            continue
+        out.append(Partition(lo, hi, known[start]))
+    return out
+
+
+def list_partitions(conn: Connection) -> list[Partition]:
+    return [p for p in partitions_for_range(conn) if p.start is not None]
+
+
+def drop_partition(engine: Engine, start: date) -> bool:
+    """Remove uma partição inteira (DROP TABLE)."""
+    with _lock:
+        with engine.connect() as conn:
+            known = _load(conn)
+        if start not in known:
+            return False
+        with engine.begin() as conn:
+            known[start].drop(conn, checkfirst=True)
+        del known[start]
+        return True
+
+
+def allocate_ids(conn: Connection, n: int) -> range:
+    """Reserva `n` IDs consecutivos (globais entre partições) na transação atual."""
+    seq = models.ReadingIdSequence.__table__
+    stmt = (
+        update(seq)
+        .where(seq.c.name == "readings")
+        .values(next_id=seq.c.next_id + n)
+        .returning(seq.c.next_id)
+    )
+    end = conn.execute(stmt).scalar()
+    if end is None:
+        # Primeira reserva: começa após o maior ID já existente
+        first = 1
+        for p in partitions_for_range(conn):
+            first = max(first, (conn.execute(select(func.max(p.table.c.id))).scalar() or 0) + 1)
+        conn.execute(seq.insert().values(name="readings", next_id=first + n))
+        end = first + n
+    return range(end - n, end)
+
+
+def migrate(conn: Connection) -> None:
+    """Aplica colunas/índices novos de `readings` às partições já existentes (init_db)."""
+    for name in inspect(conn).get_table_names():
+        m = _NAME_RE.match(name)
+        if m:
+            table = partition_table(datetime.strptime(m.group(1), "%Y%m%d").date())
+            ensure_columns(conn, table)
+            drop_indexes(conn, table, [f"ux_{name}_node_ts"])
+            ensure_indexes(conn, table)
+            ensure_unique_indexes(conn, table)
+
+
+def reset_cache() -> None:
+    global _known
+    with _lock:
+        _known = None
@@ -2,12 +2,18 @@
 Aplicação FastAPI principal do EDGE (backend local).
 - Inclui rotas REST
 - Gerencia WebSocket
-- Inicializa workers (MQTT ingest + regras)
+- Inicializa workers (MQTT ingest + regras, despachante de ações,
+  retenção/arquivo) no lifespan:
+  INGEST_MODE=threads (padrão) roda o MqttWorker (paho) numa thread;
+  INGEST_MODE=asyncio roda a ingestão no próprio event loop (mqtt/aio_client.py).
 """
 
 from __future__ import annotations
 
+import asyncio
 import threading
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -15,34 +21,33 @@ from .core.config import settings
 from .api.routes import api_router
 from .ws.websocket import ws_router
 from .mqtt.client import MqttWorker
+from .db.db import engine, read_engine
+from .services.actions import action_dispatcher
+from .services.retention import RetentionService
 
-app = FastAPI(title="IoT Edge Backend", version="0.1.0")
-
-# CORS
-origins = ["*"] if settings.ALLOW_ORIGINS == ["*"] else settings.ALLOW_ORIGINS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Rotas REST
-app.include_router(api_router, prefix="")
-
-# WebSocket
-app.include_router(ws_router, prefix="")
-
-# MQTT Worker (singleton controlado neste módulo)
+# Workers (singletons controlados neste módulo)
 _mqtt_worker: MqttWorker | None = None
 _mqtt_thread: threading.Thread | None = None
+_aio_ingest = None  # AsyncMqttIngest (INGEST_MODE=asyncio)
+_retention: RetentionService | None = None
 
 
-@app.on_event("startup")
-def _startup():
-    global _mqtt_worker, _mqtt_thread
-    if _mqtt_worker is None:
+async def _startup():
+    global _mqtt_worker, _mqtt_thread, _aio_ingest, _retention
+    # Antes da ingestão: ações das regras já vão para a fila (e o outbox é retomado)
+    action_dispatcher.start()
+    if settings.INGEST_MODE == "asyncio":
+        if _aio_ingest is None:
+            from .mqtt.aio_client import AsyncMqttIngest
+
+            _aio_ingest = AsyncMqttIngest(
+                host=settings.MQTT_HOST,
+                port=settings.MQTT_PORT,
+                topic=settings.MQTT_TOPIC,
+                keepalive=30,
+            )
+            await _aio_ingest.start()
+    elif _mqtt_worker is None:
         _mqtt_worker = MqttWorker(
             host=settings.MQTT_HOST,
             port=settings.MQTT_PORT,
@@ -51,13 +56,54 @@ def _startup():
         )
         _mqtt_thread = threading.Thread(target=_mqtt_worker.run_forever, daemon=True)
         _mqtt_thread.start()
+    if _retention is None and settings.RETENTION_RAW_DAYS > 0:
+        _retention = RetentionService(engine, read_engine)
+        _retention.start()
 
 
-@app.on_event("shutdown")
-def _shutdown():
-    global _mqtt_worker
+async def _shutdown():
+    global _mqtt_worker, _aio_ingest
     try:
         if _mqtt_worker:
-            _mqtt_worker.stop()
+            # Drena o pipeline (até INGEST_DRAIN_TIMEOUT_SEC) fora do event loop:
+            # o broadcast das últimas leituras ainda passa por ele
+            await asyncio.to_thread(_mqtt_worker.stop)
+            _mqtt_worker = None
     except Exception:
         pass
+    if _aio_ingest is not None:
+        # Para de ler do broker e drena o que já foi recebido
+        await _aio_ingest.stop()
+        _aio_ingest = None
+    if _retention:
+        _retention.stop()
+    # Depois da ingestão: grava as últimas ações; webhooks pendentes ficam no outbox
+    action_dispatcher.stop()
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    await _startup()
+    try:
+        yield
+    finally:
+        await _shutdown()
+
+
+app = FastAPI(title="IoT Edge Backend", version="0.1.0", lifespan=lifespan)
+
+# CORS
+origins = ["*"] if settings.ALLOW_ORIGINS == ["*"] else settings.ALLOW_ORIGINS
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=origins,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Rotas REST
+app.include_router(api_router, prefix="")
+
+# WebSocket
+app.include_router(ws_router, prefix="")
@@ -0,0 +1,248 @@
+"""
+Ingestão MQTT em asyncio (INGEST_MODE=asyncio), no event loop do FastAPI.
+
+    aiomqtt -> decode -> fila persist -> INSERT em lote -> broadcast WS
+                                                        -> fila rules -> regras
+
+- Nenhuma thread própria: cliente MQTT (aiomqtt), banco (SQLAlchemy
+  assíncrono: aiosqlite/asyncpg) e WebSocket rodam no mesmo event loop. O
+  fan-out do WS é chamado direto (ws_manager.broadcast_local), sem
+  call_soon_threadsafe nem espera por mensagem.
+- A gravação e as regras reaproveitam persist_rows/evaluate_readings do modo
+  threads via greenlet_spawn do SQLAlchemy: mesmo SQL (dedup, rollups,
+  partições), com a E/S feita pelo driver assíncrono.
+- Filas asyncio limitadas (PIPELINE_PERSIST_QUEUE_MAX / PIPELINE_RULES_QUEUE_MAX):
+  cheias, o leitor espera. A fila interna do aiomqtt não bloqueia o socket
+  (descarta quando cheia): só é limitada por PIPELINE_DECODE_QUEUE_MAX se
+  PIPELINE_DECODE_POLICY não for "block".
+- Uma tarefa de gravação (o SQLite tem um escritor) preserva a ordem por nó;
+  regras lentas não atrasam a gravação (tarefa e fila próprias).
+- O índice de regras, quando invalidado, é recompilado numa thread
+  (asyncio.to_thread): a consulta síncrona não trava o event loop.
+- <tópico>/status (presença dos nós) vai direto para o registro dos nós.
+- Queda do broker: reconecta a cada RECONNECT_SEC.
+- stop(): para de ler, drena as filas (até INGEST_DRAIN_TIMEOUT_SEC) e fecha
+  a engine assíncrona.
+- QoS 1 (MQTT_QOS) com PUBACK automático do aiomqtt: o journal em disco
+  (INGEST_JOURNAL_DIR) só existe no modo threads.
+
+Requer os pacotes `aiomqtt` e `aiosqlite` (ou `asyncpg`).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Optional
+
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.util import greenlet_spawn
+
+from ..core.config import settings
+from ..db.db import dispose_async_engine, get_async_engine
+from ..services import codec, metrics
+from ..services.decoder import decode_reading
+from ..services.ingest import broadcast_readings, evaluate_readings, persist_rows
+from ..services.nodes import node_registry
+from ..services.rules import rule_cache
+from ..services.stats import pipeline_stats
+from .client import client_id, subscriptions
+from .topics import is_status_topic
+
+try:
+    import aiomqtt  # type: ignore
+except Exception:  # dependência opcional
+    aiomqtt = None
+
+RECONNECT_SEC = 2.0
+
+_RECEIVED = {False: metrics.messages_received.labels("json"), True: metrics.messages_received.labels("msgpack")}
+_DECODE_FAILED = metrics.messages_failed.labels("decode")
+_PERSIST_FAILED = metrics.messages_failed.labels("persist")
+
+
+_LINGER_STEP = 0.005
+
+
+async def _get_batch(q: asyncio.Queue, max_size: int, linger: float) -> list:
+    """
+    Espera o primeiro item; junta mais até `max_size` ou `linger` segundos.
+    Sob carga a fila já tem os itens; senão dorme em passos curtos (sem
+    wait_for por item, que cria uma task e um timer a cada mensagem).
+    """
+    batch = [await q.get()]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + linger
+    while q.qsize() < max_size - 1:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        await asyncio.sleep(min(remaining, _LINGER_STEP))
+    while len(batch) < max_size and not q.empty():
+        batch.append(q.get_nowait())
+    return batch
+
+
+async def _put(q: asyncio.Queue, item) -> None:
+    # Caminho rápido sem await; cheia: espera (contrapressão)
+    if q.full():
+        await q.put(item)
+    else:
+        q.put_nowait(item)
+
+
+class AsyncMqttIngest:
+    def __init__(self, host: str, port: int, topic: str, keepalive: int = 30):
+        self.host = host
+        self.port = port
+        self.topic = topic
+        self.keepalive = keepalive
+        self.shared_group = settings.MQTT_SHARED_GROUP
+        self.v5 = bool(self.shared_group) or settings.MQTT_PROTOCOL == "5"
+        self.client_id = client_id()
+        self.connected = asyncio.Event()
+        self._persist_q: Optional[asyncio.Queue] = None
+        self._rules_q: Optional[asyncio.Queue] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._workers: list[asyncio.Task] = []
+        self._engine = None
+        self._sessions = None
+
+    # ---------- ciclo ----------
+    async def start(self) -> None:
+        if aiomqtt is None:
+            raise RuntimeError("INGEST_MODE=asyncio requer o pacote 'aiomqtt'")
+        # Engine assíncrona; persist_rows/evaluate_readings usam a sync_engine dela (em greenlet)
+        self._engine = get_async_engine().sync_engine
+        self._sessions = sessionmaker(bind=self._engine, expire_on_commit=False)
+        self._persist_q = asyncio.Queue(max(1, settings.PIPELINE_PERSIST_QUEUE_MAX))
+        self._rules_q = asyncio.Queue(max(1, settings.PIPELINE_RULES_QUEUE_MAX))
+        pipeline_stats.register_queue("persist", self._persist_q.qsize)
+        pipeline_stats.register_queue("rules", self._rules_q.qsize)
+        self._workers = [
+            asyncio.create_task(self._persist_loop(), name="ingest-persist"),
+            asyncio.create_task(self._rules_loop(), name="ingest-rules"),
+        ]
+        self._reader = asyncio.create_task(self._read_loop(), name="mqtt-reader")
+
+    async def join(self) -> None:
+        """Espera as filas esvaziarem (testes/benchmarks e desligamento)."""
+        await self._persist_q.join()
+        await self._rules_q.join()
+
+    async def stop(self, drain_timeout: Optional[float] = None) -> None:
+        if drain_timeout is None:
+            drain_timeout = settings.INGEST_DRAIN_TIMEOUT_SEC
+        if self._reader is not None:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+            self._reader = None
+        if self._persist_q is not None:
+            try:
+                await asyncio.wait_for(self.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                print(f"[MQTT] Desligando com itens na fila (persist={self._persist_q.qsize()}, "
+                      f"rules={self._rules_q.qsize()})")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        pipeline_stats.unregister_queue("persist")
+        pipeline_stats.unregister_queue("rules")
+        await dispose_async_engine()
+
+    # ---------- MQTT ----------
+    def _client(self):
+        kwargs = {"identifier": self.client_id, "keepalive": self.keepalive}
+        if settings.PIPELINE_DECODE_POLICY != "block":
+            # O aiomqtt descarta (não bloqueia) quando a fila interna enche
+            kwargs["max_queued_incoming_messages"] = max(1, settings.PIPELINE_DECODE_QUEUE_MAX)
+        if self.v5:
+            kwargs["protocol"] = aiomqtt.ProtocolVersion.V5
+        else:
+            kwargs["protocol"] = aiomqtt.ProtocolVersion.V311
+            kwargs["clean_session"] = True
+        return aiomqtt.Client(self.host, self.port, **kwargs)
+
+    async def _read_loop(self) -> None:
+        subs = subscriptions(self.topic, self.shared_group)
+        while True:
+            try:
+                async with self._client() as client:
+                    await client.subscribe(subs)
+                    print(f"[MQTT] Connected (asyncio) client_id={self.client_id}")
+                    self.connected.set()
+                    async for msg in client.messages:
+                        await self._on_message(msg)
+            except aiomqtt.MqttError as e:
+                self.connected.clear()
+                print(f"[MQTT] Conexão perdida: {e}; reconectando em {RECONNECT_SEC:.0f}s")
+                await asyncio.sleep(RECONNECT_SEC)
+
+    async def _on_message(self, msg) -> None:
+        received = time.monotonic()
+        topic = msg.topic.value
+        if is_status_topic(topic):
+            node_registry.on_status(topic, bytes(msg.payload))
+            return
+        props = getattr(msg, "properties", None)
+        content_type = getattr(props, "ContentType", None) if props is not None else None
+        binary = codec.is_binary(topic, content_type)
+        _RECEIVED[binary].inc()
+        try:
+            row = decode_reading(topic, bytes(msg.payload), binary)
+        except Exception as e:
+            print("[MQTT] Bad payload:", e)
+            _DECODE_FAILED.inc()
+            return
+        metrics.messages_decoded.inc()
+        await _put(self._persist_q, (received, row))
+
+    # ---------- etapas ----------
+    async def _persist_loop(self) -> None:
+        batch_size = max(1, settings.INGEST_BATCH_SIZE)
+        linger = settings.INGEST_BATCH_LINGER_MS / 1000.0
+        while True:
+            batch = await _get_batch(self._persist_q, batch_size, linger)
+            try:
+                await self._persist(batch)
+            except Exception as e:
+                print("[PIPELINE] Etapa persist falhou:", e)
+            finally:
+                for _ in batch:
+                    self._persist_q.task_done()
+
+    async def _persist(self, batch: list) -> None:
+        rows = [row for _, row in batch]
+        try:
+            readings = await greenlet_spawn(persist_rows, rows, self._engine)
+        except Exception as e:
+            print("[INGEST] Lote falhou, reprocessando individualmente:", e)
+            # Isola a linha problemática sem perder o restante do lote
+            readings = []
+            for row in rows:
+                try:
+                    readings += await greenlet_spawn(persist_rows, [row], self._engine)
+                except Exception as e:
+                    print("[INGEST] Error:", e)
+                    _PERSIST_FAILED.inc()
+        pipeline_stats.record_lag(min(received for received, _ in batch))
+        if not readings:
+            return
+        broadcast_readings(readings, on_loop=True)
+        for r in readings:
+            await _put(self._rules_q, r)
+
+    async def _rules_loop(self) -> None:
+        batch_size = max(1, settings.INGEST_BATCH_SIZE)
+        while True:
+            batch = await _get_batch(self._rules_q, batch_size, 0.0)
+            try:
+                # Regras mudaram: recarrega numa thread (o rule_cache usa a engine síncrona)
+                index = rule_cache.peek() or await asyncio.to_thread(rule_cache.get)
+                await greenlet_spawn(evaluate_readings, batch, self._sessions, index)
+            except Exception as e:
+                print("[PIPELINE] Etapa rules falhou:", e)
+            finally:
+                for _ in batch:
+                    self._rules_q.task_done()
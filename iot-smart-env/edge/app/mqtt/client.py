@@ -1,70 +1,211 @@
 """
 Cliente/worker MQTT para consumir leituras e encaminhar para o pipeline (ingest + regras + WS).
+
+- O callback do paho só entrega os bytes recebidos ao pipeline (sem
+  json.loads), para o loop de rede nunca atrasar keepalives durante rajadas.
+- Decodificação, gravação, broadcast e regras são etapas separadas, com
+  filas limitadas e roteamento por node_id (ver services/pipeline.py).
+- Com MQTT_SHARED_GROUP, usa MQTT v5 e assina "$share/<grupo>/<tópico>" com
+  client id único por instância: o broker distribui as mensagens entre os
+  processos do grupo. Reentregas após reinício não duplicam leituras de nós
+  que mandam msg_id (índice único node_id + msg_id na ingestão).
+- Leituras em MessagePack: assina também <tópico><MQTT_BINARY_SUFFIX> (um
+  tópico terminado em '#' já o cobre) e respeita o content-type do MQTT v5 (ver services/codec.py).
+- Assina <tópico>/status (online/offline dos nós; um tópico terminado em
+  '#' já o cobre) e atualiza o registro dos
+  nós direto no callback (services/nodes.py), fora do pipeline.
+- Leituras em MQTT_QOS (padrão 1). Com INGEST_JOURNAL_DIR, cada mensagem vai
+  para o journal em disco antes do pipeline e o PUBACK é manual, enviado só
+  depois do fsync em grupo (services/journal.py); a sessão é persistente para
+  o broker reentregar o que não foi confirmado. Na partida, o que ficou no
+  journal sem chegar ao banco é reprocessado antes de assinar: entrega "pelo
+  menos uma vez", sem duplicar linhas de nós que mandam msg_id.
+- stop(): cancela as assinaturas, drena o pipeline por até
+  INGEST_DRAIN_TIMEOUT_SEC, fecha o journal (fsync e os últimos PUBACKs) e
+  só então desconecta; o que não der tempo fica no journal.
 """
 
 from __future__ import annotations
-import json
+import os
+import socket
 import threading
-import queue
-import time
+from typing import Optional
+
 import paho.mqtt.client as mqtt
+from paho.mqtt.client import MQTTv5, MQTTv311
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 
 from ..core.config import settings
-from ..services.ingest import process_incoming_payload
+from ..services.journal import IngestJournal
+from ..services.nodes import node_registry
+from ..services.pipeline import IngestPipeline
+from .topics import STATUS_SUFFIX, is_status_topic
+
+
+def client_id() -> str:
+    """Client id do MQTT: fixo sem grupo; único por processo com assinatura compartilhada."""
+    if not settings.MQTT_SHARED_GROUP:
+        return settings.MQTT_CLIENT_ID
+    instance = settings.MQTT_INSTANCE_ID or f"{socket.gethostname()}-{os.getpid()}"
+    return f"{settings.MQTT_CLIENT_ID}-{instance}"
+
+
+def subscription_topic(topic: str, group: str = "") -> str:
+    return f"$share/{group}/{topic}" if group else topic
+
+
+def multilevel(topic: str) -> bool:
+    """Filtro terminado em '#': nada pode vir depois dele."""
+    return topic == "#" or topic.endswith("/#")
+
+
+def reading_topics(topic: str) -> list[str]:
+    """
+    Filtros das leituras: o tópico e <tópico><MQTT_BINARY_SUFFIX>. Um tópico
+    terminado em '#' já cobre o sufixo (e "iot/#/mp" seria filtro inválido).
+    """
+    topics = [topic]
+    if settings.MQTT_BINARY_SUFFIX and not multilevel(topic):
+        topics.append(topic + settings.MQTT_BINARY_SUFFIX)
+    return topics
+
+
+def status_topic(topic: str) -> Optional[str]:
+    """
+    Presença dos nós (<tópico>/status, retained + LWT). Nunca compartilhada:
+    cada instância acompanha todos os nós e o broker não entrega mensagens
+    retidas a assinaturas $share. None com tópico terminado em '#': ele já
+    cobre os status (e "iot/#/status" seria filtro inválido).
+    """
+    if multilevel(topic):
+        return None
+    return f"{topic}/{STATUS_SUFFIX}"
+
+
+def subscriptions(topic: str, group: str = "") -> list[tuple[str, int]]:
+    """(filtro, QoS) assinados ao conectar: leituras (com grupo, compartilhadas) e status."""
+    subs = [(subscription_topic(t, group), settings.MQTT_QOS) for t in reading_topics(topic)]
+    status = status_topic(topic)
+    if status is not None:
+        subs.append((status, 1))
+    elif group:
+        print("[MQTT] Tópico com '#' e grupo: os status chegam só pela assinatura compartilhada "
+              "(divididos entre as instâncias, sem mensagens retidas)")
+    return subs
 
 
 class MqttWorker:
-    def __init__(self, host: str, port: int, topic: str, keepalive: int = 30):
+    def __init__(self, host: str, port: int, topic: str, keepalive: int = 30, workers: int | None = None):
         self.host = host
         self.port = port
         self.topic = topic
         self.keepalive = keepalive
         self._stop = threading.Event()
-        self._q: "queue.Queue[dict]" = queue.Queue()
+        self._subscribed: list[str] = []
+        # Journal: PUBACK manual depois do fsync; sessão persistente
+        self.journal = None
+        if settings.INGEST_JOURNAL_DIR:
+            self.journal = IngestJournal(settings.INGEST_JOURNAL_DIR, on_durable=self._ack)
+        self.manual_ack = self.journal is not None
+        # `workers`: threads da etapa decode (padrão: INGEST_WORKERS)
+        self.pipeline = IngestPipeline(decode_workers=workers, journal=self.journal)
 
-        # paho API v2
-        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=settings.MQTT_CLIENT_ID, clean_session=True)
+        self.shared_group = settings.MQTT_SHARED_GROUP
+        self.protocol = MQTTv5 if (self.shared_group or settings.MQTT_PROTOCOL == "5") else MQTTv311
+        self.client_id = client_id()
+
+        # paho API v2 (clean_session só existe até o MQTT 3.1.1; no v5 é clean_start no connect)
+        if self.protocol == MQTTv5:
+            self.client = mqtt.Client(
+                mqtt.CallbackAPIVersion.VERSION2, client_id=self.client_id, protocol=MQTTv5,
+                manual_ack=self.manual_ack,
+            )
+        else:
+            self.client = mqtt.Client(
+                mqtt.CallbackAPIVersion.VERSION2, client_id=self.client_id, clean_session=not self.manual_ack,
+                protocol=MQTTv311, manual_ack=self.manual_ack,
+            )
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
 
     # paho callbacks
     def _on_connect(self, client, userdata, flags, rc, properties=None):
-        print(f"[MQTT] Connected rc={rc}")
-        client.subscribe(self.topic, qos=0)
+        print(f"[MQTT] Connected rc={rc} client_id={self.client_id}")
+        subs = subscriptions(self.topic, self.shared_group)
+        self._subscribed = [t for t, _ in subs]
+        client.subscribe(subs)
 
     def _on_message(self, client, userdata, msg):
-        try:
-            payload = json.loads(msg.payload.decode("utf-8"))
-            payload["_topic"] = msg.topic
-            self._q.put(payload)
-        except Exception as e:
-            print("[MQTT] Bad payload:", e)
+        if self._stop.is_set() and self.manual_ack:
+            # Desligando: sem journal/PUBACK; o broker reentrega na próxima sessão
+            return
+        qos = getattr(msg, "qos", 0)
+        if is_status_topic(msg.topic):
+            node_registry.on_status(msg.topic, bytes(msg.payload))
+            if self.manual_ack and qos:
+                self.client.ack(msg.mid, qos)
+            return
+        # Só roteia e enfileira: a decodificação acontece na etapa decode
+        props = getattr(msg, "properties", None)
+        content_type = getattr(props, "ContentType", None) if props is not None else None
+        ack = (msg.mid, qos) if self.manual_ack and qos else None
+        self.pipeline.submit(msg.topic, bytes(msg.payload), content_type=content_type, ack=ack)
+
+    def _ack(self, tokens: list) -> None:
+        # Thread do journal, depois do fsync
+        for mid, qos in tokens:
+            self.client.ack(mid, qos)
 
     # threads
-    def _db_worker(self):
-        while not self._stop.is_set():
-            try:
-                payload = self._q.get(timeout=0.25)
-            except queue.Empty:
-                continue
-            try:
-                process_incoming_payload(payload)
-            except Exception as e:
-                print("[INGEST] Error:", e)
-            finally:
-                self._q.task_done()
+    def start_workers(self):
+        self.pipeline.start()
+        if self.journal is not None:
+            # Antes de assinar: o que ficou da execução anterior, em lote
+            self.pipeline.recover()
+            self.journal.start()
+
+    def join(self, timeout: float | None = None) -> bool:
+        """Espera o pipeline esvaziar (testes/benchmarks e desligamento)."""
+        return self.pipeline.join(timeout)
 
     def run_forever(self):
-        t = threading.Thread(target=self._db_worker, daemon=True)
-        t.start()
-        self.client.connect(self.host, self.port, keepalive=self.keepalive)
+        self.start_workers()
+        if self.protocol == MQTTv5:
+            props = None
+            if self.manual_ack:
+                props = Properties(PacketTypes.CONNECT)
+                props.SessionExpiryInterval = settings.MQTT_SESSION_EXPIRY_SEC
+            self.client.connect(
+                self.host, self.port, keepalive=self.keepalive, clean_start=not self.manual_ack, properties=props
+            )
+        else:
+            self.client.connect(self.host, self.port, keepalive=self.keepalive)
         try:
             self.client.loop_forever()
         except KeyboardInterrupt:
             pass
 
-    def stop(self):
+    def stop(self, drain_timeout: float | None = None):
+        """
+        Cancela as assinaturas (nada novo entra; sem PUBACK, o broker
+        reentrega), drena o pipeline por até `drain_timeout` (padrão:
+        INGEST_DRAIN_TIMEOUT_SEC), fecha o journal (fsync e PUBACK do que
+        chegou) e só então desconecta.
+        """
         self._stop.set()
+        if self._subscribed:
+            try:
+                self.client.unsubscribe(self._subscribed)
+            except Exception:
+                pass
+        timeout = settings.INGEST_DRAIN_TIMEOUT_SEC if drain_timeout is None else drain_timeout
+        if not self.pipeline.join(timeout):
+            depth = {stage.name: stage.depth() for stage in self.pipeline.stages if stage.depth()}
+            print(f"[MQTT] Desligando com itens na fila: {depth}")
+        self.pipeline.stop()
+        if self.journal is not None:
+            self.journal.close()
         try:
             self.client.disconnect()
         except Exception:
@@ -2,6 +2,19 @@
 Subpacote de serviços (ingestão, regras, notificações).
 - ingest.py
 - rules.py
-- notifier.py
+- notifier.py (webhooks HTTP com pool keep-alive)
+- actions.py (despachante assíncrono das ações: ActionLog em lote e outbox de webhooks)
+- rollups.py (agregados 1m/1h por nó)
+- readings.py (consultas paginadas/streaming de leituras)
+- archive.py / retention.py (arquivo frio comprimido e política de retenção)
+- rawpayload.py (payload bruto compacto)
+- stats.py (contadores do pipeline para o /health)
+- pipeline.py (ingestão MQTT em etapas com filas limitadas)
+- journal.py (journal de ingestão em disco: PUBACK após fsync e reprocessamento)
+- decoder.py (decodificação rápida/tolerante das mensagens)
+- codec.py (payload binário MessagePack com IDs curtos)
+- metrics.py (contadores/histogramas do /metrics, formato Prometheus)
+- recent.py (últimas leituras por nó em memória: GET /readings, replay do WS)
+- nodes.py (registro dos nós: última leitura, presença e firmware para o /nodes)
 """
 __all__ = []
\ No newline at end of file
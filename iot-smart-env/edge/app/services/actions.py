@@ -0,0 +1,431 @@
+"""
+Despachante assíncrono das ações das regras (fora do caminho da ingestão).
+
+    regras -> dispatch(eventos) -> [lote] ActionLog + outbox (um commit)
+                                        -> webhooks por endpoint (HTTP, em lote)
+
+- dispatch() só enfileira: a avaliação de regras não espera banco nem rede.
+  A thread "actions" roda um event loop próprio que agrupa os eventos
+  (ACTIONS_BATCH_SIZE / ACTIONS_BATCH_LINGER_MS) e grava ActionLog e as
+  entregas pendentes (ActionOutbox) numa única transação por lote.
+- Webhooks: cliente HTTP com pool keep-alive (services/notifier.py); por
+  endpoint, ACTIONS_HTTP_PER_ENDPOINT requisições simultâneas com até
+  ACTIONS_HTTP_BATCH eventos cada. Falha temporária: nova tentativa com
+  backoff exponencial (ACTIONS_RETRY_BASE_SEC .. ACTIONS_RETRY_MAX_SEC, com
+  jitter) até ACTIONS_RETRY_MAX_ATTEMPTS; a linha do outbox guarda tentativas
+  e último erro. Entregue, a linha sai do outbox.
+- ActionLog: um lote que falha é dividido ao meio até isolar as linhas que
+  não gravam; só elas voltam, com backoff, e são descartadas (log e
+  edge_messages_failed_total{stage="actions"}) depois de
+  ACTIONS_RETRY_MAX_ATTEMPTS tentativas.
+- Outbox persistente: na subida, start() retoma as entregas pendentes; no
+  desligamento, o que não foi entregue continua lá.
+- Sem o despachante rodando (API, testes, scripts), dispatch() grava na
+  hora, na thread chamadora, também num único commit por chamada; os
+  webhooks ficam no outbox até um despachante subir.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..db import models
+from ..db.db import engine
+from . import metrics
+from .notifier import WebhookError, WebhookSender
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+@dataclass(frozen=True)
+class ActionEvent:
+    """Uma ação disparada: vira uma linha de ActionLog e, com `url`, um webhook."""
+    action: str
+    payload: dict
+    rule_id: Optional[int] = None
+    rule_name: Optional[str] = None
+    reading_id: Optional[int] = None
+    node_id: Optional[str] = None
+    url: Optional[str] = None
+    created_at: datetime = field(default_factory=_now)
+
+    def body(self) -> dict:
+        """Item enviado no webhook."""
+        return {
+            "action": self.action,
+            "rule_id": self.rule_id,
+            "rule": self.rule_name,
+            "reading_id": self.reading_id,
+            "node_id": self.node_id,
+            "at": self.created_at.isoformat(),
+            "data": self.payload,
+        }
+
+
+class _Delivery:
+    __slots__ = ("id", "url", "body", "attempts")
+
+    def __init__(self, id: int, url: str, body: dict, attempts: int = 0) -> None:
+        self.id = id
+        self.url = url
+        self.body = body
+        self.attempts = attempts
+
+
+# ---------- banco (síncrono; no despachante roda via asyncio.to_thread) ----------
+_LOG = models.ActionLog.__table__
+_OUTBOX = models.ActionOutbox.__table__
+
+
+def write_actions(events: list[ActionEvent], session: Optional[Session] = None) -> list[_Delivery]:
+    """ActionLog + outbox num único commit. `session`: a do chamador (ex.: modo asyncio)."""
+    if not events:
+        return []
+    now = _now()
+    logs = [
+        {"rule_id": e.rule_id, "reading_id": e.reading_id, "action": e.action, "payload": e.payload,
+         "created_at": e.created_at}
+        for e in events
+    ]
+    outbox = [
+        {"url": e.url, "body": e.body(), "attempts": 0, "next_attempt_at": now, "created_at": now}
+        for e in events if e.url
+    ]
+
+    def run(execute) -> list[int]:
+        execute(insert(_LOG), logs)
+        if not outbox:
+            return []
+        stmt = insert(_OUTBOX).returning(_OUTBOX.c.id, sort_by_parameter_order=True)
+        return list(execute(stmt, outbox).scalars())
+
+    if session is not None:
+        ids = run(session.execute)
+        session.commit()
+    else:
+        with engine.begin() as conn:
+            ids = run(conn.execute)
+    return [_Delivery(rid, row["url"], row["body"]) for rid, row in zip(ids, outbox)]
+
+
+def _write_remaining(events: list[ActionEvent]) -> None:
+    """Desligamento: grava o que sobrou; se o lote falhar, um a um (só as linhas ruins se perdem)."""
+    try:
+        write_actions(events)
+        return
+    except Exception:
+        pass
+    for e in events:
+        try:
+            write_actions([e])
+        except Exception as err:
+            print(f"[ACTIONS] Ação não gravada no desligamento ({e.action}): {_brief(err)}")
+            _WRITE_FAILED.inc()
+
+
+def _load_pending() -> list[tuple[_Delivery, datetime]]:
+    q = (
+        select(_OUTBOX.c.id, _OUTBOX.c.url, _OUTBOX.c.body, _OUTBOX.c.attempts, _OUTBOX.c.next_attempt_at)
+        .where(_OUTBOX.c.next_attempt_at.is_not(None))
+        .order_by(_OUTBOX.c.id)
+    )
+    with engine.connect() as conn:
+        return [(_Delivery(r.id, r.url, r.body, r.attempts), r.next_attempt_at) for r in conn.execute(q)]
+
+
+def _delete(ids: list[int]) -> None:
+    with engine.begin() as conn:
+        conn.execute(delete(_OUTBOX).where(_OUTBOX.c.id.in_(ids)))
+
+
+def _record_failure(batch: list[_Delivery], retry_at: dict[int, Optional[datetime]], error: str) -> None:
+    stmt = (
+        update(_OUTBOX)
+        .where(_OUTBOX.c.id == bindparam("b_id"))
+        .values(attempts=bindparam("b_attempts"), next_attempt_at=bindparam("b_next"), last_error=error[:300])
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt, [{"b_id": d.id, "b_attempts": d.attempts, "b_next": retry_at[d.id]} for d in batch])
+
+
+def _brief(error: Optional[Exception]) -> str:
+    # Só a primeira linha (o SQLAlchemy anexa o SQL e os parâmetros)
+    return str(error).split("\n", 1)[0]
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(settings.ACTIONS_RETRY_MAX_SEC, settings.ACTIONS_RETRY_BASE_SEC * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+# ---------- despachante ----------
+_DELIVERED = metrics.webhook_deliveries.labels("ok")
+_RETRIED = metrics.webhook_deliveries.labels("retry")
+_DEAD = metrics.webhook_deliveries.labels("dead")
+_WRITE_FAILED = metrics.messages_failed.labels("actions")
+
+
+class _Endpoint:
+    __slots__ = ("url", "queue", "workers")
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.workers: list[asyncio.Task] = []
+
+
+class ActionDispatcher:
+    def __init__(self) -> None:
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._incoming: list[ActionEvent] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._sender: Optional[WebhookSender] = None
+        self._endpoints: dict[str, _Endpoint] = {}
+        self._writing = 0  # eventos retirados de _incoming e ainda não gravados
+        # Gravações que falharam: (evento, tentativas), de novo após _retry_at (loop.time())
+        self._retry: list[tuple[ActionEvent, int]] = []
+        self._retry_at = 0.0
+        self._inflight = 0  # entregas na fila, em andamento ou aguardando retry
+
+    # ---------- ciclo ----------
+    @property
+    def running(self) -> bool:
+        return self._loop is not None
+
+    def start(self) -> None:
+        if self._loop is not None:
+            return
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(loop, ready), name="actions", daemon=True)
+        self._thread.start()
+        ready.wait(10)
+        self._loop = loop
+
+    def _run(self, loop: asyncio.AbstractEventLoop, ready: threading.Event) -> None:
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._setup())
+        finally:
+            ready.set()
+        loop.run_forever()
+        loop.close()
+
+    async def _setup(self) -> None:
+        self._wake = asyncio.Event()
+        try:
+            self._sender = WebhookSender()
+        except RuntimeError as e:
+            print(f"[ACTIONS] {e}: webhooks ficam no outbox")
+        self._writer = asyncio.create_task(self._write_loop(), name="actions-writer")
+        pending = await asyncio.to_thread(_load_pending)
+        now = _now()
+        for d, next_at in pending:
+            self._schedule(d, max(0.0, (next_at - now).total_seconds()))
+        if pending:
+            print(f"[ACTIONS] {len(pending)} entregas pendentes retomadas do outbox")
+
+    def stop(self, drain_timeout: float = 10.0) -> None:
+        """Grava tudo que foi despachado; entregas não concluídas ficam no outbox."""
+        loop = self._loop
+        if loop is None:
+            return
+        self.flush(drain_timeout)
+        # A partir daqui dispatch() grava na thread chamadora
+        self._loop = None
+        asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(drain_timeout + 5)
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(5)
+        self._thread = None
+
+    async def _shutdown(self) -> None:
+        tasks = [self._writer] + [t for ep in self._endpoints.values() for t in ep.workers]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        batch = self._incoming + [ev for ev, _ in self._retry]
+        self._incoming, self._retry = [], []
+        if batch:
+            await asyncio.to_thread(_write_remaining, batch)
+        if self._sender is not None:
+            await self._sender.aclose()
+        self._endpoints = {}
+        self._writing = self._inflight = 0
+
+    def pending(self) -> int:
+        return len(self._incoming) + len(self._retry) + self._writing + self._inflight
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Espera gravar e entregar o que já foi despachado (testes e desligamento)."""
+        deadline = time.monotonic() + timeout
+        loop = self._loop
+        if loop is not None:
+            # Barreira: os dispatch() anteriores (call_soon_threadsafe) já estão em _incoming
+            asyncio.run_coroutine_threadsafe(asyncio.sleep(0), loop).result(timeout)
+        while self.pending():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    # ---------- entrada ----------
+    def dispatch(self, events: list[ActionEvent], session: Optional[Session] = None) -> None:
+        """
+        Enfileira os eventos (não bloqueia). Sem despachante rodando, grava
+        agora com `session` (ou o engine de escrita).
+        """
+        if not events:
+            return
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._enqueue, events)
+                return
+            except RuntimeError:
+                pass  # loop encerrado durante o desligamento
+        write_actions(events, session)
+
+    def _enqueue(self, events: list[ActionEvent]) -> None:
+        self._incoming.extend(events)
+        self._wake.set()
+
+    # ---------- gravação em lote ----------
+    async def _write_loop(self) -> None:
+        batch_size = max(1, settings.ACTIONS_BATCH_SIZE)
+        linger = settings.ACTIONS_BATCH_LINGER_MS / 1000.0
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wake.wait()
+            if linger and len(self._incoming) < batch_size:
+                await asyncio.sleep(linger)
+            self._wake.clear()
+            while self._incoming:
+                batch = self._incoming[:batch_size]
+                del self._incoming[:batch_size]
+                await self._write_batch([(ev, 0) for ev in batch])
+            if self._retry and loop.time() >= self._retry_at:
+                entries, self._retry = self._retry, []
+                for i in range(0, len(entries), batch_size):
+                    await self._write_batch(entries[i:i + batch_size])
+
+    async def _write_batch(self, entries: list[tuple[ActionEvent, int]]) -> None:
+        """
+        Grava um lote; as linhas que falharem voltam com backoff
+        (ACTIONS_RETRY_*) e, esgotadas as tentativas, são descartadas com log.
+        Uma linha ruim não segura as demais nem os lotes seguintes.
+        """
+        self._writing = len(entries)
+        try:
+            failed, error = await self._write(entries)
+        finally:
+            self._writing = 0
+        if not failed:
+            return
+        again, dead = [], []
+        for ev, attempts in failed:
+            (dead if attempts + 1 >= settings.ACTIONS_RETRY_MAX_ATTEMPTS else again).append((ev, attempts + 1))
+        if dead:
+            print(f"[ACTIONS] {len(dead)} ação(ões) descartada(s) após {dead[0][1]} tentativa(s): {_brief(error)}")
+            for ev, _ in dead:
+                print(f"[ACTIONS]   descartada: {ev.action} regra={ev.rule_id} leitura={ev.reading_id}")
+            _WRITE_FAILED.inc(len(dead))
+        if again:
+            loop = asyncio.get_running_loop()
+            delay = _backoff(min(a for _, a in again))
+            print(f"[ACTIONS] Gravação de {len(again)} ação(ões) falhou; nova tentativa em {delay:.1f}s: {_brief(error)}")
+            self._retry += again
+            self._retry_at = loop.time() + delay
+            loop.call_later(delay, self._wake.set)
+
+    async def _write(self, entries: list[tuple[ActionEvent, int]]) -> tuple[list, Optional[Exception]]:
+        """Grava; se o lote falhar, divide ao meio até isolar as linhas ruins. Devolve (falhas, erro)."""
+        try:
+            deliveries = await asyncio.to_thread(write_actions, [ev for ev, _ in entries])
+        except Exception as e:
+            if len(entries) == 1:
+                return entries, e
+            mid = len(entries) // 2
+            left, e1 = await self._write(entries[:mid])
+            right, e2 = await self._write(entries[mid:])
+            return left + right, e1 or e2
+        for d in deliveries:
+            self._schedule(d, 0.0)
+        return [], None
+
+    # ---------- webhooks ----------
+    def _schedule(self, d: _Delivery, delay: float) -> None:
+        if self._sender is None:
+            return  # sem cliente HTTP: fica no outbox
+        ep = self._endpoints.get(d.url)
+        if ep is None:
+            ep = self._endpoints[d.url] = _Endpoint(d.url)
+            ep.workers = [
+                asyncio.create_task(self._deliver_loop(ep)) for _ in range(max(1, settings.ACTIONS_HTTP_PER_ENDPOINT))
+            ]
+        self._inflight += 1
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, ep.queue.put_nowait, d)
+        else:
+            ep.queue.put_nowait(d)
+
+    async def _deliver_loop(self, ep: _Endpoint) -> None:
+        max_batch = max(1, settings.ACTIONS_HTTP_BATCH)
+        while True:
+            batch = [await ep.queue.get()]
+            while len(batch) < max_batch and not ep.queue.empty():
+                batch.append(ep.queue.get_nowait())
+            try:
+                await self._send(ep, batch)
+            except Exception as e:
+                # Falha ao atualizar o outbox: as linhas continuam lá para a próxima subida
+                print("[ACTIONS] Erro no outbox:", e)
+                self._inflight -= len(batch)
+
+    async def _send(self, ep: _Endpoint, batch: list[_Delivery]) -> None:
+        try:
+            await self._sender.post(ep.url, [d.body for d in batch])
+        except WebhookError as e:
+            await self._failed(ep, batch, e)
+            return
+        await asyncio.to_thread(_delete, [d.id for d in batch])
+        _DELIVERED.inc(len(batch))
+        self._inflight -= len(batch)
+
+    async def _failed(self, ep: _Endpoint, batch: list[_Delivery], error: WebhookError) -> None:
+        now = _now()
+        retry_at: dict[int, Optional[datetime]] = {}
+        delays: dict[int, float] = {}
+        for d in batch:
+            d.attempts += 1
+            if error.permanent or d.attempts >= settings.ACTIONS_RETRY_MAX_ATTEMPTS:
+                retry_at[d.id] = None
+            else:
+                delays[d.id] = _backoff(d.attempts)
+                retry_at[d.id] = now + timedelta(seconds=delays[d.id])
+        await asyncio.to_thread(_record_failure, batch, retry_at, str(error))
+        dead = [d for d in batch if d.id not in delays]
+        if dead:
+            print(f"[ACTIONS] Webhook {ep.url} descartado após {dead[0].attempts} tentativa(s): {error}")
+            _DEAD.inc(len(dead))
+            self._inflight -= len(dead)
+        for d in batch:
+            if d.id in delays:
+                _RETRIED.inc()
+                asyncio.get_running_loop().call_later(delays[d.id], ep.queue.put_nowait, d)
+
+
+action_dispatcher = ActionDispatcher()
@@ -0,0 +1,284 @@
+"""
+Arquivo frio de leituras em segmentos colunares comprimidos.
+
+- Um arquivo por nó e por dia: ARCHIVE_DIR/<node_id>/<AAAA-MM-DD>.seg
+- Conteúdo: cabeçalho JSON + colunas (id e timestamp em deltas int64, métricas
+  em float64 com NaN para ausente, motion em int8, msg_id e raw_json como
+  listas JSON, raw_extra como tamanhos int32 + bytes concatenados),
+  tudo comprimido com zstd (pacote `zstandard`) ou, se ausente, zlib.
+- write_segment() mescla com o segmento existente (dedup por id) e grava de
+  forma atômica (arquivo temporário + os.replace).
+- read_range() devolve as leituras arquivadas de um intervalo, em ordem.
+- drop_archived() descarta redeliveries de leituras já arquivadas: fora da
+  base, o índice único (node_id, msg_id) não as pega mais.
+- O horizonte (`horizon()`) marca até onde os dados já foram arquivados; antes
+  dele as consultas também leem o arquivo.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import struct
+import sys
+import zlib
+from array import array
+from datetime import date, datetime, timedelta
+from typing import Iterator, Optional
+from urllib.parse import quote, unquote
+
+from ..core.config import settings
+
+try:
+    import zstandard  # type: ignore
+except Exception:  # dependência opcional
+    zstandard = None
+
+MAGIC = b"EDGESEG1"
+_FLOAT_COLS = ("temperature_c", "humidity_pct", "soil_moisture_pct")
+_EPOCH = datetime(1970, 1, 1)
+_STATE_FILE = "_state.json"
+
+
+# ---------- compressão ----------
+def _compress(data: bytes) -> bytes:
+    if zstandard is not None:
+        return b"Z" + zstandard.ZstdCompressor(level=9).compress(data)
+    return b"D" + zlib.compress(data, 9)
+
+
+def _decompress(blob: bytes) -> bytes:
+    codec, body = blob[:1], blob[1:]
+    if codec == b"Z":
+        if zstandard is None:
+            raise RuntimeError("segmento zstd requer o pacote 'zstandard'")
+        return zstandard.ZstdDecompressor().decompress(body)
+    if codec == b"D":
+        return zlib.decompress(body)
+    raise ValueError("codec de segmento desconhecido")
+
+
+# ---------- codificação colunar ----------
+def _micros(ts: datetime) -> int:
+    return (ts - _EPOCH) // timedelta(microseconds=1)
+
+
+def _deltas(values: list[int]) -> array:
+    out, prev = array("q"), 0
+    for v in values:
+        out.append(v - prev)
+        prev = v
+    return out
+
+
+def _undelta(arr: array) -> list[int]:
+    out, acc = [], 0
+    for d in arr:
+        acc += d
+        out.append(acc)
+    return out
+
+
+def encode_segment(rows: list[dict]) -> bytes:
+    """Linhas (ordenadas por timestamp/id) -> bytes do segmento."""
+    cols: dict[str, bytes] = {
+        "id": _deltas([r["id"] for r in rows]).tobytes(),
+        "timestamp": _deltas([_micros(r["timestamp"]) for r in rows]).tobytes(),
+    }
+    for c in _FLOAT_COLS:
+        cols[c] = array("d", [math.nan if r.get(c) is None else float(r[c]) for r in rows]).tobytes()
+    cols["motion"] = array("b", [-1 if r.get("motion") is None else int(bool(r["motion"])) for r in rows]).tobytes()
+    cols["msg_id"] = json.dumps([r.get("msg_id") for r in rows], ensure_ascii=False).encode()
+    cols["raw_json"] = json.dumps([r.get("raw_json") for r in rows], ensure_ascii=False).encode()
+    extras = [r.get("raw_extra") for r in rows]
+    cols["raw_extra_len"] = array("i", [-1 if b is None else len(b) for b in extras]).tobytes()
+    cols["raw_extra"] = b"".join(b for b in extras if b)
+
+    header = {
+        "rows": len(rows),
+        "byteorder": sys.byteorder,
+        "columns": [[name, len(data)] for name, data in cols.items()],
+    }
+    hdr = json.dumps(header).encode()
+    body = struct.pack("<I", len(hdr)) + hdr + b"".join(cols.values())
+    return MAGIC + _compress(body)
+
+
+def decode_segment(blob: bytes, node_id: str) -> list[dict]:
+    if not blob.startswith(MAGIC):
+        raise ValueError("arquivo não é um segmento")
+    body = _decompress(blob[len(MAGIC):])
+    (hlen,) = struct.unpack_from("<I", body)
+    header = json.loads(body[4:4 + hlen])
+    swap = header["byteorder"] != sys.byteorder
+    pos, raw = 4 + hlen, {}
+    for name, size in header["columns"]:
+        raw[name] = body[pos:pos + size]
+        pos += size
+
+    def arr(code: str, data: bytes) -> array:
+        a = array(code)
+        a.frombytes(data)
+        if swap:
+            a.byteswap()
+        return a
+
+    ids = _undelta(arr("q", raw["id"]))
+    stamps = [_EPOCH + timedelta(microseconds=us) for us in _undelta(arr("q", raw["timestamp"]))]
+    floats = {c: arr("d", raw[c]) for c in _FLOAT_COLS}
+    motion = arr("b", raw["motion"])
+    msg_ids = json.loads(raw["msg_id"]) if "msg_id" in raw else [None] * len(ids)
+    raw_json = json.loads(raw["raw_json"]) if "raw_json" in raw else [None] * len(ids)
+    extras: list = [None] * len(ids)
+    if "raw_extra_len" in raw:
+        pos = 0
+        for i, n in enumerate(arr("i", raw["raw_extra_len"])):
+            if n >= 0:
+                extras[i] = raw["raw_extra"][pos:pos + n]
+                pos += n
+    out = []
+    for i, rid in enumerate(ids):
+        row = {"id": rid, "node_id": node_id, "timestamp": stamps[i]}
+        for c in _FLOAT_COLS:
+            v = floats[c][i]
+            row[c] = None if math.isnan(v) else v
+        row["motion"] = None if motion[i] < 0 else bool(motion[i])
+        row["msg_id"] = msg_ids[i]
+        row["raw_json"] = raw_json[i]
+        row["raw_extra"] = extras[i]
+        out.append(row)
+    return out
+
+
+# ---------- arquivos ----------
+def _root() -> str:
+    return settings.ARCHIVE_DIR
+
+
+def _node_dir(node_id: str) -> str:
+    return os.path.join(_root(), quote(node_id, safe=""))
+
+
+def segment_path(node_id: str, day: date) -> str:
+    return os.path.join(_node_dir(node_id), f"{day.isoformat()}.seg")
+
+
+def read_segment(node_id: str, day: date) -> list[dict]:
+    try:
+        with open(segment_path(node_id, day), "rb") as f:
+            return decode_segment(f.read(), node_id)
+    except FileNotFoundError:
+        return []
+
+
+def write_segment(node_id: str, day: date, rows: list[dict]) -> int:
+    """Grava/mescla as linhas de um nó/dia. Retorna o total de linhas no segmento."""
+    merged = {r["id"]: r for r in read_segment(node_id, day)}
+    for r in rows:
+        merged[r["id"]] = r
+    ordered = sorted(merged.values(), key=lambda r: (r["timestamp"], r["id"]))
+    path = segment_path(node_id, day)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(encode_segment(ordered))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(ordered)
+
+
+def _nodes() -> list[str]:
+    try:
+        entries = os.listdir(_root())
+    except FileNotFoundError:
+        return []
+    return sorted(unquote(e) for e in entries if os.path.isdir(os.path.join(_root(), e)))
+
+
+def _days(node_id: str) -> list[date]:
+    try:
+        names = os.listdir(_node_dir(node_id))
+    except FileNotFoundError:
+        return []
+    return sorted(date.fromisoformat(n[:-4]) for n in names if n.endswith(".seg"))
+
+
+# ---------- horizonte ----------
+def horizon() -> Optional[datetime]:
+    """Instante até o qual (exclusivo) as leituras podem estar no arquivo."""
+    try:
+        with open(os.path.join(_root(), _STATE_FILE), encoding="utf-8") as f:
+            return datetime.fromisoformat(json.load(f)["horizon"])
+    except (FileNotFoundError, KeyError, ValueError):
+        return None
+
+
+def set_horizon(ts: datetime) -> None:
+    current = horizon()
+    if current is not None and current >= ts:
+        return
+    os.makedirs(_root(), exist_ok=True)
+    path = os.path.join(_root(), _STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"horizon": ts.isoformat()}, f)
+    os.replace(path + ".tmp", path)
+
+
+# ---------- deduplicação ----------
+def drop_archived(rows: list[dict]) -> list[dict]:
+    """
+    Remove de `rows` as leituras (node_id, msg_id) que já estão no arquivo.
+    Só abre segmentos de linhas com msg_id anteriores ao horizonte; o
+    horizonte é gravado antes de arquivar, então uma linha em migração ainda
+    está na base e o índice único a ignora.
+    """
+    h = horizon()
+    if h is None:
+        return rows
+    seen: dict[tuple[str, date], set] = {}
+    out = []
+    for r in rows:
+        if r.get("msg_id") is not None and r["timestamp"] < h:
+            key = (r["node_id"], r["timestamp"].date())
+            if key not in seen:
+                seen[key] = {a["msg_id"] for a in read_segment(*key) if a["msg_id"] is not None}
+            if r["msg_id"] in seen[key]:
+                continue
+        out.append(r)
+    return out
+
+
+# ---------- leitura de intervalos ----------
+def read_range(
+    node_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    descending: bool = False,
+) -> Iterator[dict]:
+    """
+    Leituras arquivadas em [since, until], dia a dia, ordenadas por
+    (timestamp, id) — ou ao contrário com descending=True.
+    """
+    nodes = [node_id] if node_id else _nodes()
+    by_day: dict[date, list[str]] = {}
+    for n in nodes:
+        for d in _days(n):
+            if since is not None and d < since.date():
+                continue
+            if until is not None and d > until.date():
+                continue
+            by_day.setdefault(d, []).append(n)
+
+    for d in sorted(by_day, reverse=descending):
+        rows = []
+        for n in by_day[d]:
+            for r in read_segment(n, d):
+                if since is not None and r["timestamp"] < since:
+                    continue
+                if until is not None and r["timestamp"] > until:
+                    continue
+                rows.append(r)
+        rows.sort(key=lambda r: (r["timestamp"], r["id"]), reverse=descending)
+        yield from rows
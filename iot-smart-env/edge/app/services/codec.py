@@ -0,0 +1,116 @@
+"""
+Codificação binária compacta das leituras (MessagePack).
+
+Formato: um mapa MessagePack com IDs curtos no lugar dos nomes dos campos e
+timestamp em milissegundos desde a época (UTC, inteiro):
+
+    0 node_id            (str)
+    1 timestamp          (int, epoch ms)
+    2 temperature_c      (float)
+    3 humidity_pct       (float)
+    4 soil_moisture_pct  (float)
+    5 motion             (bool)
+    6 firmware           (str)
+    7 rssi_dbm           (int)
+    8 msg_id             (str | int; id da mensagem, deduplicação)
+
+As chaves podem ser inteiros ou os mesmos números como string ("0", "1"...,
+que é o que o ArduinoJson consegue gerar). Outras chaves string passam como
+campos extras com o próprio nome.
+
+A mensagem é binária quando o tópico termina em MQTT_BINARY_SUFFIX (ex.:
+"iot/env/room1/reading/mp") ou quando a propriedade MQTT v5 content-type é
+CONTENT_TYPE. Requer o pacote `msgpack`.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from ..core.config import settings
+
+try:
+    import msgpack  # type: ignore
+except Exception:  # dependência opcional
+    msgpack = None
+
+CONTENT_TYPE = "application/msgpack"
+FIELDS = (
+    "node_id", "timestamp", "temperature_c", "humidity_pct", "soil_moisture_pct", "motion", "firmware", "rssi_dbm",
+    "msg_id",
+)
+FIELD_IDS = {name: i for i, name in enumerate(FIELDS)}
+_BY_KEY: dict = {**dict(enumerate(FIELDS)), **{str(i): name for i, name in enumerate(FIELDS)}}
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def is_binary(topic: str, content_type: Optional[str] = None) -> bool:
+    if content_type:
+        return content_type.split(";")[0].strip().lower() == CONTENT_TYPE
+    suffix = settings.MQTT_BINARY_SUFFIX
+    return bool(suffix) and topic.endswith(suffix)
+
+
+def _require() -> None:
+    if msgpack is None:
+        raise RuntimeError("payload binário requer o pacote 'msgpack'")
+
+
+def encode_reading(payload: dict) -> bytes:
+    """Payload (nomes longos, timestamp datetime/ISO) -> bytes MessagePack."""
+    _require()
+    out: dict = {}
+    for k, v in payload.items():
+        if k == "timestamp" and v is not None:
+            if isinstance(v, str):
+                v = datetime.fromisoformat(v.replace("Z", "+00:00"))
+            if v.tzinfo is None:
+                v = v.replace(tzinfo=timezone.utc)
+            v = (v - _EPOCH) // timedelta(milliseconds=1)
+        out[FIELD_IDS.get(k, k)] = v
+    return msgpack.packb(out, use_bin_type=True)
+
+
+def decode_reading(raw: bytes) -> dict:
+    """
+    bytes MessagePack -> payload com nomes longos. O timestamp (epoch ms)
+    volta como datetime UTC (com tzinfo).
+    """
+    _require()
+    data = msgpack.unpackb(raw, raw=False, strict_map_key=False)
+    if not isinstance(data, dict):
+        raise ValueError("payload binário não é um mapa")
+    payload = {}
+    for k, v in data.items():
+        name = _BY_KEY.get(k, k)
+        if name == "timestamp" and isinstance(v, int) and not isinstance(v, bool):
+            v = _EPOCH + timedelta(milliseconds=v)
+        payload[str(name)] = v
+    return payload
+
+
+def peek_node_id(raw: bytes) -> Optional[bytes]:
+    """
+    node_id (UTF-8) sem decodificar, quando é o primeiro campo do mapa (fixmap com
+    chave 0 ou "0" e valor fixstr/str8); senão None.
+    """
+    if len(raw) < 3 or not 0x80 <= raw[0] <= 0x8F:
+        return None
+    pos = 1
+    if raw[pos] == 0x00:
+        pos += 1
+    elif raw[pos:pos + 2] == b"\xa1\x30":  # "0"
+        pos += 2
+    else:
+        return None
+    if pos >= len(raw):
+        return None
+    head = raw[pos]
+    if 0xA0 <= head <= 0xBF:
+        n, pos = head - 0xA0, pos + 1
+    elif head == 0xD9 and pos + 1 < len(raw):
+        n, pos = raw[pos + 1], pos + 2
+    else:
+        return None
+    return raw[pos:pos + n]
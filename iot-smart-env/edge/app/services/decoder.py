@@ -0,0 +1,176 @@
+"""
+Decodificação das mensagens MQTT (bytes) em linhas normalizadas de leitura.
+
+INGEST_DECODER:
+- "fast" (padrão): valida e converte o esquema conhecido numa só passada.
+  Com o pacote `msgspec`, um Struct tipado decodifica direto dos bytes; sem
+  ele, json.loads + checagem de tipos exatos (sem as coerções tolerantes).
+  No modo RAW_PAYLOAD_MODE=json, raw_json reaproveita o texto recebido (sem
+  json.dumps). Payload fora do esquema (ex.: "55,5", motion "on", timestamp
+  inválido) cai no caminho tolerante.
+- "lenient": sempre o caminho tolerante (json.loads + _normalize_payload).
+
+As duas rotas produzem as mesmas colunas; raw_json pode diferir só na
+formatação do JSON (mesmo conteúdo).
+
+Mensagens binárias (MessagePack, ver services/codec.py) são expandidas para
+os nomes longos e passam pela mesma validação; o payload bruto é guardado
+como JSON, com o timestamp em ISO 8601.
+"""
+
+from __future__ import annotations
+
+import json
+from datetime import datetime, timezone
+from typing import Any, Optional, Union
+
+from ..core.config import settings
+from . import codec
+from .ingest import _msg_id, _naive_utc, _normalize_payload
+from .rawpayload import _canonical_ts, encode_extras
+
+try:
+    import msgspec  # type: ignore
+except Exception:  # dependência opcional
+    msgspec = None
+
+_METRICS = ("temperature_c", "humidity_pct", "soil_moisture_pct")
+
+if msgspec is not None:
+    class ReadingMsg(msgspec.Struct):
+        node_id: str
+        temperature_c: Optional[float] = None
+        humidity_pct: Optional[float] = None
+        soil_moisture_pct: Optional[float] = None
+        motion: Optional[bool] = None
+        timestamp: Optional[datetime] = None
+        msg_id: Optional[Union[str, int]] = None
+
+    _typed_decoder = msgspec.json.Decoder(ReadingMsg)
+    _json_decode = msgspec.json.decode
+    _json_dumps = lambda obj: msgspec.json.encode(obj).decode()  # noqa: E731
+    _SchemaError = (msgspec.ValidationError, msgspec.DecodeError)
+else:
+    ReadingMsg = None
+    _typed_decoder = None
+    _json_decode = json.loads
+    _json_dumps = lambda obj: json.dumps(obj, ensure_ascii=False)  # noqa: E731
+    _SchemaError = ()
+
+
+def lenient_decode(topic: str, raw: bytes, received_at: Optional[datetime] = None) -> dict:
+    """Caminho original: aceita qualquer JSON de objeto e coage os tipos."""
+    payload = json.loads(raw)
+    payload["_topic"] = topic
+    return _normalize_payload(payload, received_at)
+
+
+def _raw_json_with_topic(raw: bytes, topic: str) -> str:
+    # Texto original + "_topic" no fim (mesmo conteúdo que json.dumps(payload))
+    text = raw.decode("utf-8").rstrip()
+    return text[:-1].rstrip() + ', "_topic": ' + json.dumps(topic, ensure_ascii=False) + "}"
+
+
+def _stdlib_typed(payload: Any) -> Optional[tuple]:
+    """Tipos exatos do esquema (sem coerção) ou None."""
+    if not isinstance(payload, dict) or not isinstance(payload.get("node_id"), str):
+        return None
+    values = []
+    for m in _METRICS:
+        v = payload.get(m)
+        if v is None:
+            values.append(None)
+        elif type(v) is float or type(v) is int:
+            values.append(float(v))
+        else:
+            return None
+    motion = payload.get("motion")
+    if motion is not None and type(motion) is not bool:
+        return None
+    ts = payload.get("timestamp")
+    if ts is not None and not isinstance(ts, datetime):
+        if not isinstance(ts, str):
+            return None
+        try:
+            ts = datetime.fromisoformat(ts)
+        except ValueError:
+            return None
+    msg_id = payload.get("msg_id")
+    if msg_id is not None and type(msg_id) is not str and type(msg_id) is not int:
+        return None
+    return (payload["node_id"], *values, motion, ts, msg_id)
+
+
+def _row(
+    fields: tuple, topic: str, raw: Optional[bytes], payload: Optional[dict], received_at: Optional[datetime] = None
+) -> dict:
+    node_id, temperature_c, humidity_pct, soil_moisture_pct, motion, ts, msg_id = fields
+    if ts is None:
+        ts = received_at or datetime.now(timezone.utc).replace(tzinfo=None)
+    norm = {
+        "node_id": node_id,
+        "temperature_c": temperature_c,
+        "humidity_pct": humidity_pct,
+        "soil_moisture_pct": soil_moisture_pct,
+        "motion": motion,
+        "timestamp": _naive_utc(ts),
+        "msg_id": _msg_id(msg_id),
+    }
+    if settings.RAW_PAYLOAD_MODE == "compact":
+        if payload is None:
+            payload = _json_decode(raw)
+        payload["_topic"] = topic
+        norm["raw_json"] = ""
+        norm["raw_extra"] = encode_extras(payload, norm)
+    elif raw is None:
+        norm["raw_json"] = _json_dumps(dict(payload, _topic=topic))
+        norm["raw_extra"] = None
+    else:
+        norm["raw_json"] = _raw_json_with_topic(raw, topic)
+        norm["raw_extra"] = None
+    return norm
+
+
+def fast_decode(topic: str, raw: bytes, received_at: Optional[datetime] = None) -> dict:
+    """Esquema tipado numa passada; fora do esquema, cai no caminho tolerante."""
+    if _typed_decoder is not None:
+        try:
+            msg = _typed_decoder.decode(raw)
+        except _SchemaError:
+            return lenient_decode(topic, raw, received_at)
+        fields = (msg.node_id, msg.temperature_c, msg.humidity_pct, msg.soil_moisture_pct, msg.motion, msg.timestamp,
+                  msg.msg_id)
+        return _row(fields, topic, raw, None, received_at)
+
+    payload = json.loads(raw)
+    fields = _stdlib_typed(payload)
+    if fields is None:
+        payload["_topic"] = topic
+        return _normalize_payload(payload, received_at)
+    return _row(fields, topic, raw, payload, received_at)
+
+
+def binary_decode(topic: str, raw: bytes, received_at: Optional[datetime] = None) -> dict:
+    """MessagePack -> linha normalizada (tipos exatos ou, se não, caminho tolerante)."""
+    payload = codec.decode_reading(raw)
+    ts = payload.get("timestamp")
+    if isinstance(ts, datetime):
+        # Guardado como no JSON dos nós (o datetime não é serializável)
+        payload["timestamp"] = _canonical_ts(_naive_utc(ts))
+    fields = _stdlib_typed(dict(payload, timestamp=ts) if isinstance(ts, datetime) else payload)
+    if fields is None:
+        payload["_topic"] = topic
+        return _normalize_payload(payload, received_at)
+    return _row(fields, topic, None, payload, received_at)
+
+
+def decode_reading(topic: str, raw: bytes, binary: bool = False, received_at: Optional[datetime] = None) -> dict:
+    """
+    bytes recebidos no `topic` -> linha normalizada (ver ingest._normalize_payload).
+    `received_at` (UTC sem tzinfo): timestamp de quem não manda um; padrão: agora.
+    """
+    if binary:
+        return binary_decode(topic, raw, received_at)
+    if settings.INGEST_DECODER == "lenient":
+        return lenient_decode(topic, raw, received_at)
+    return fast_decode(topic, raw, received_at)
@@ -3,49 +3,73 @@ Pipeline de ingestão do EDGE.
 
 Responsabilidades:
 1) Normalizar payloads vindos do MQTT (tipos, timestamp).
-2) Persistir a leitura no banco (models.Reading).
+2) Persistir as leituras no banco (models.Reading), em lote: um único
+   INSERT/commit para várias mensagens (process_incoming_batch).
+   Na mesma transação, atualiza os agregados por nó de 1 minuto e 1 hora.
 3) Disparar broadcast via WebSocket para clientes em tempo real.
-4) Avaliar regras de automação após a persistência.
+4) Avaliar regras de automação após a persistência; as ações disparadas
+   vão para o despachante assíncrono (services/actions.py).
+
+Cada etapa é uma função própria (normalize_payloads, persist_rows,
+broadcast_readings, evaluate_readings); o MQTT as executa desacopladas em
+services/pipeline.py.
 
 Compatível com os demais arquivos enviados:
 - SessionLocal em ..db.db
 - models em ..db.models
 - ws_manager em ..ws.websocket
 - evaluate_rules em .rules
-- anyio listado em edge/requirements.txt
 """
 
 from __future__ import annotations
 
 import json
+import time
 from datetime import datetime, timezone
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 
+from sqlalchemy import insert
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
 
-from ..db.db import SessionLocal
-from ..db import models
+from ..core.config import settings
+from ..db.db import SessionLocal, engine
+from ..db import models, partitions
 from ..ws.websocket import ws_manager
+from . import archive, metrics, rollups
+from .actions import action_dispatcher
+from .nodes import node_registry
+from .rawpayload import encode_extras
+from .recent import recent_readings
 from .rules import evaluate_rules
+from .stats import pipeline_stats
+
 
+def _naive_utc(dt: datetime) -> datetime:
+    # O banco guarda DateTime sem fuso: padroniza tudo em UTC "naive"
+    if dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
 
-def _parse_timestamp(ts: Any) -> datetime:
+
+def _parse_timestamp(ts: Any, default: Optional[datetime] = None) -> datetime:
     """
     Aceita:
       - ISO 8601 (com ou sem 'Z'), ex: '2025-09-17T19:30:10.123Z'
-      - datetime (retorna como está)
-      - None / inválido -> agora (UTC)
+      - datetime (convertido para UTC)
+      - None / inválido -> `default` (hora de recebimento) ou agora (UTC)
+    Sempre retorna UTC sem tzinfo.
     """
     if isinstance(ts, datetime):
-        return ts
+        return _naive_utc(ts)
     if isinstance(ts, str):
         try:
             # Suporta 'Z' como UTC
-            return datetime.fromisoformat(ts.replace("Z", "+00:00"))
+            return _naive_utc(datetime.fromisoformat(ts.replace("Z", "+00:00")))
         except Exception:
             pass
-    # fallback: agora
-    return datetime.now(timezone.utc).replace(tzinfo=None)
+    # fallback: recebimento ou agora
+    return default if default is not None else datetime.now(timezone.utc).replace(tzinfo=None)
 
 
 def _coerce_float(v: Any) -> Optional[float]:
@@ -77,7 +101,14 @@ def _coerce_bool(v: Any) -> Optional[bool]:
     return None
 
 
-def _normalize_payload(payload: dict) -> dict:
+def _msg_id(v: Any) -> Optional[str]:
+    """Id da mensagem gerado pelo nó (str ou inteiro); ausente/vazio -> None."""
+    if v is None or isinstance(v, bool) or v == "":
+        return None
+    return str(v)[:64]
+
+
+def _normalize_payload(payload: dict, received_at: Optional[datetime] = None) -> dict:
     """
     Normaliza chaves esperadas:
     - node_id: str
@@ -85,75 +116,237 @@ def _normalize_payload(payload: dict) -> dict:
     - humidity_pct: float | None
     - soil_moisture_pct: float | None
     - motion: bool | None
-    - timestamp: datetime
-    Mantém o payload original em raw_json.
+    - timestamp: datetime (sem timestamp válido: `received_at` ou agora)
+    - msg_id: str | None (chave de deduplicação com o node_id)
+    Mantém o payload original em raw_json ou, com RAW_PAYLOAD_MODE=compact,
+    só os campos não mapeados em raw_extra (ver services/rawpayload.py).
     """
     node_id = str(payload.get("node_id", "unknown"))
     temperature_c = _coerce_float(payload.get("temperature_c"))
     humidity_pct = _coerce_float(payload.get("humidity_pct"))
     soil_moisture_pct = _coerce_float(payload.get("soil_moisture_pct"))
     motion = _coerce_bool(payload.get("motion"))
-    ts_dt = _parse_timestamp(payload.get("timestamp"))
+    ts_dt = _parse_timestamp(payload.get("timestamp"), received_at)
 
-    return {
+    norm = {
         "node_id": node_id,
         "temperature_c": temperature_c,
         "humidity_pct": humidity_pct,
         "soil_moisture_pct": soil_moisture_pct,
         "motion": motion,
         "timestamp": ts_dt,
-        "raw_json": json.dumps(payload, ensure_ascii=False),
+        "msg_id": _msg_id(payload.get("msg_id")),
     }
+    if settings.RAW_PAYLOAD_MODE == "compact":
+        norm["raw_json"] = ""
+        norm["raw_extra"] = encode_extras(payload, norm)
+    else:
+        norm["raw_json"] = json.dumps(payload, ensure_ascii=False)
+        norm["raw_extra"] = None
+    return norm
 
 
-def process_incoming_payload(payload: dict) -> None:
+def _reading_message(r: models.Reading) -> dict:
+    """Formato enviado aos clientes WebSocket."""
+    return {
+        "id": r.id,
+        "node_id": r.node_id,
+        "temperature_c": r.temperature_c,
+        "humidity_pct": r.humidity_pct,
+        "soil_moisture_pct": r.soil_moisture_pct,
+        "motion": r.motion,
+        "timestamp": r.timestamp.isoformat(),
+    }
+
+
+_DEDUP_STMTS: dict[tuple[str, str], object] = {}
+
+
+def _dedup_insert(conn, table):
     """
-    Entrada: dict vindo do callback do MQTT (já convertido de JSON).
-    Efeitos:
-      - Cria models.Reading
-      - Commit no DB
-      - Broadcast via WS
-      - Avalia regras ativas
+    INSERT que ignora leituras já gravadas (índice único node_id + msg_id):
+    redelivery do broker, reinício de instância ou consumidores concorrentes
+    não duplicam linhas de nós que mandam msg_id. Leituras sem msg_id são
+    sempre inseridas. Devolve (id, node_id, msg_id, timestamp) só das inseridas.
     """
-    norm = _normalize_payload(payload)
-
-    with SessionLocal() as s:
-        r = models.Reading(
-            node_id=norm["node_id"],
-            temperature_c=norm["temperature_c"],
-            humidity_pct=norm["humidity_pct"],
-            soil_moisture_pct=norm["soil_moisture_pct"],
-            motion=norm["motion"],
-            timestamp=norm["timestamp"],
-            raw_json=norm["raw_json"],
-        )
-        s.add(r)
-        s.commit()
-        s.refresh(r)
-
-        # Broadcast WebSocket (executado a partir de uma thread -> usar anyio.from_thread.run)
-        try:
-            import anyio
-
-            anyio.from_thread.run(
-                ws_manager.broadcast_json,
-                {
-                    "id": r.id,
-                    "node_id": r.node_id,
-                    "temperature_c": r.temperature_c,
-                    "humidity_pct": r.humidity_pct,
-                    "soil_moisture_pct": r.soil_moisture_pct,
-                    "motion": r.motion,
-                    "timestamp": r.timestamp.isoformat(),
-                },
-            )
-        except Exception as e:
-            # Não interrompe o pipeline se o WS falhar (ex.: app subindo)
-            print("[WS] Broadcast falhou:", e)
+    key = (conn.dialect.name, table.name)
+    stmt = _DEDUP_STMTS.get(key)
+    if stmt is None:
+        cols = (table.c.id, table.c.node_id, table.c.msg_id, table.c.timestamp)
+        if conn.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as pg_insert
+            stmt = pg_insert(table).on_conflict_do_nothing(index_elements=[table.c.node_id, table.c.msg_id])
+        else:
+            # "OR IGNORE" entra no cache de compilação (ON CONFLICT não)
+            stmt = insert(table).prefix_with("OR IGNORE", dialect="sqlite")
+        stmt = _DEDUP_STMTS[key] = stmt.returning(*cols)
+    return stmt
+
+
+def _inserted(rows: list[dict], returned) -> tuple[list[dict], list[int]]:
+    """Linhas efetivamente inseridas (na ordem de `rows`) e seus IDs."""
+    # Sem msg_id, várias linhas podem ter a mesma chave: IDs na ordem de retorno
+    by_key: dict = {}
+    for r in returned:
+        by_key.setdefault((r.node_id, r.msg_id, r.timestamp), []).append(r.id)
+    out_rows, ids = [], []
+    for row in rows:
+        found = by_key.get((row["node_id"], row["msg_id"], row["timestamp"]))
+        if found:
+            out_rows.append(row)
+            ids.append(found.pop(0))
+    return out_rows, ids
+
+
+def _insert_rows(rows: list[dict], eng: Optional[Engine] = None) -> tuple[list[dict], list[int]]:
+    """
+    INSERT em lote via Core (executemany + RETURNING), numa única transação.
+    Sem identity map do ORM e sem refresh(). Duplicatas (mesmo node_id e
+    msg_id) são ignoradas; retorna as linhas inseridas e seus IDs.
+    Com particionamento, os IDs são reservados antes e cada partição recebe
+    um executemany. `eng`: engine de escrita (padrão: db.engine).
+    """
+    eng = eng or engine
+    if partitions.enabled():
+        return _insert_partitioned(rows, eng)
+    with eng.begin() as conn:
+        returned = conn.execute(_dedup_insert(conn, models.Reading.__table__), rows).all()
+        rows, ids = _inserted(rows, returned)
+        # Agregados 1m/1h na mesma transação (ver services/rollups.py), só das inseridas
+        rollups.apply(conn, rows)
+        return rows, ids
+
 
-        # Avaliar regras (log de ações, etc.)
+def _insert_partitioned(rows: list[dict], eng: Engine) -> tuple[list[dict], list[int]]:
+    by_part: dict = {}
+    for row in rows:
+        by_part.setdefault(partitions.partition_start(row["timestamp"]), []).append(row)
+    partitions.ensure_partitions(eng, set(by_part))
+    with eng.begin() as conn:
+        for rid, row in zip(partitions.allocate_ids(conn, len(rows)), rows):
+            row["id"] = rid
+        returned = []
+        for start, part_rows in by_part.items():
+            returned += conn.execute(_dedup_insert(conn, partitions.partition_table(start)), part_rows).all()
+        for row in rows:
+            del row["id"]
+        rows, ids = _inserted(rows, returned)
+        rollups.apply(conn, rows)
+    return rows, ids
+
+
+def normalize_payloads(payloads: list[dict]) -> list[dict]:
+    return [_normalize_payload(p) for p in payloads]
+
+
+def persist_rows(rows: list[dict], eng: Optional[Engine] = None) -> list[models.Reading]:
+    """
+    Grava linhas já normalizadas (um commit) e atualiza os contadores.
+    Retorna objetos transitórios (fora de sessão) para WS e regras, só das
+    leituras novas: duplicatas não geram broadcast nem ações.
+    `eng`: engine de escrita (o modo asyncio passa a sync_engine da engine
+    assíncrona, dentro de greenlet_spawn).
+    """
+    if not rows:
+        return []
+    received = len(rows)
+    # Redelivery de leitura já arquivada: fora da base, o índice único não a pega
+    rows = archive.drop_archived(rows)
+    if not rows:
+        _record_metrics(rows, received)
+        return []
+    t0 = time.perf_counter()
+    rows, ids = _insert_rows(rows, eng)
+    metrics.db_insert_seconds.observe(time.perf_counter() - t0)
+    # Contadores do /health (total, nós, última ingestão) sem consultar o banco
+    pipeline_stats.record_ingest(rows)
+    recent_readings.record(rows, ids)
+    node_registry.record(rows, ids)
+    _record_metrics(rows, received)
+    return [models.Reading(id=rid, **row) for rid, row in zip(ids, rows)]
+
+
+def _record_metrics(rows: list[dict], received: int) -> None:
+    # /metrics: novas x duplicadas e atraso dispositivo -> edge pelo timestamp do payload
+    metrics.readings_persisted.inc(len(rows))
+    if received > len(rows):
+        metrics.readings_duplicate.inc(received - len(rows))
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    metrics.device_lag_seconds.observe_many([max(0.0, (now - row["timestamp"]).total_seconds()) for row in rows])
+
+
+def broadcast_readings(readings: list[models.Reading], on_loop: bool = False) -> None:
+    # Broadcast WebSocket: só agenda no event loop (não espera os clientes).
+    # on_loop=True: chamado no próprio event loop (modo asyncio), sem salto entre threads
+    t0 = time.perf_counter()
+    try:
+        messages = [_reading_message(r) for r in readings]
+        if on_loop:
+            ws_manager.broadcast_local(messages)
+        else:
+            ws_manager.broadcast_threadsafe(messages)
+    except Exception as e:
+        # Não interrompe o pipeline se o WS falhar (ex.: app subindo)
+        print("[WS] Broadcast falhou:", e)
+    metrics.broadcast_seconds.observe(time.perf_counter() - t0)
+
+
+def evaluate_readings(
+    readings: list[models.Reading], session_factory: Optional[Callable[[], Session]] = None, rules_index=None
+) -> None:
+    # Avaliar regras; as ações vão para o despachante (session_factory padrão: SessionLocal).
+    # rules_index: índice já carregado (modo asyncio: sem consulta no event loop)
+    elapsed = []
+    fired = []
+    clock = time.perf_counter
+    for r in readings:
+        t0 = clock()
         try:
-            evaluate_rules(s, r)
+            fired += evaluate_rules(r, rules_index)
         except Exception as e:
             # Não interromper ingestão por regra malformada
             print("[RULES] Avaliação falhou:", e)
+            metrics.messages_failed.labels("rules").inc()
+        elapsed.append(clock() - t0)
+    metrics.rule_eval_seconds.observe_many(elapsed)
+    if not fired:
+        return
+    # Ações do lote: enfileiradas no despachante ou, sem ele, gravadas num commit
+    if action_dispatcher.running:
+        action_dispatcher.dispatch(fired)
+        return
+    with (session_factory or SessionLocal)() as s:
+        action_dispatcher.dispatch(fired, s)
+
+
+def ingest_readings(payloads: list[dict]) -> list[models.Reading]:
+    """
+    Entrada: lista de dicts (já convertidos de JSON).
+    Executa todas as etapas em sequência, na thread chamadora (API, testes);
+    o MQTT usa as mesmas etapas desacopladas em services/pipeline.py.
+    Efeitos:
+      - INSERT de todas as leituras num único commit (group commit)
+      - Atualiza os contadores do pipeline (services/stats.py)
+      - Broadcast via WS (uma chamada para o lote)
+      - Avalia regras ativas para cada leitura
+    Retorna as leituras gravadas (objetos transitórios, fora de sessão).
+    """
+    if not payloads:
+        return []
+    readings = persist_rows(normalize_payloads(payloads))
+    broadcast_readings(readings)
+    evaluate_readings(readings)
+    return readings
+
+
+def process_incoming_batch(payloads: list[dict]) -> list[int]:
+    """Como ingest_readings; retorna os IDs das leituras novas, na ordem de `payloads`."""
+    return [r.id for r in ingest_readings(payloads)]
+
+
+def process_incoming_payload(payload: dict) -> None:
+    """
+    Entrada: dict vindo do callback do MQTT (já convertido de JSON).
+    Equivale a um lote de uma leitura (ver process_incoming_batch).
+    """
+    process_incoming_batch([payload])
@@ -0,0 +1,324 @@
+"""
+Journal de ingestão em disco (append-only), na frente da gravação no banco.
+
+    MQTT (_on_message) -> append -> pipeline -> persist (commit) -> done
+
+- Cada mensagem MQTT bruta (tópico, payload, binário, hora de recebimento)
+  vira um registro com número de sequência e CRC32, anexado ao segmento atual
+  (INGEST_JOURNAL_DIR/<seq inicial>.jnl). Ao passar de
+  INGEST_JOURNAL_SEGMENT_MB, o segmento é fechado e outro é aberto.
+- fsync em grupo: uma thread esvazia o buffer e faz um fsync a cada
+  INGEST_JOURNAL_FSYNC_MS; só então confirma as mensagens ao broker
+  (`on_durable`: PUBACK manual do QoS 1). O callback do MQTT nunca espera
+  pelo disco.
+- done(seqs): a etapa persist marca as mensagens já gravadas no banco (ou
+  descartadas: payload inválido, linha recusada); uma falha temporária do
+  banco ou um item fora das filas (desligamento) não libera nada. A marca d'água ("tudo até N
+  está no banco") vai para o arquivo `checkpoint`, e os segmentos inteiros
+  abaixo dela são apagados.
+- recover(): na partida, devolve em blocos os registros acima do checkpoint
+  (aceitos mas não gravados antes de uma queda); quem reprocessa marca com
+  done() o que gravou. Um bloco com mensagem não marcada segura o
+  checkpoint: ela volta na próxima partida. Um registro truncado ou
+  corrompido encerra a leitura do segmento; os novos registros vão sempre
+  para um segmento novo.
+- Reprocessar é idempotente para nós que mandam msg_id: o índice único
+  (node_id, msg_id) ignora as leituras que já estavam gravadas. Leituras sem
+  timestamp recebem a hora de recebimento guardada no registro.
+- O checkpoint só avança depois do commit no banco; com SQLite, o commit
+  precisa ser durável (synchronous FULL, forçado em db/db.py).
+"""
+
+from __future__ import annotations
+
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, Iterable, Iterator, Optional
+
+from ..core.config import settings
+from . import metrics
+
+# Cabeçalho: crc32 + (tamanho do payload, seq, flags, tamanho do tópico)
+# [+ hora de recebimento, epoch em segundos, com _RECEIVED];
+# o crc cobre tópico + payload + campos do cabeçalho
+_CRC = struct.Struct("<I")
+_FIELDS = struct.Struct("<IQBH")
+_TIME = struct.Struct("<d")
+_HEADER_SIZE = _CRC.size + _FIELDS.size
+_BINARY, _RECEIVED = 0x01, 0x02  # flags (registros antigos: só o bit binário)
+_SUFFIX = ".jnl"
+_CHECKPOINT = "checkpoint"
+_BUFFER = 1 << 20
+
+
+def _segment_name(first_seq: int) -> str:
+    return f"{first_seq:020d}{_SUFFIX}"
+
+
+def read_segment(path: str) -> Iterator[tuple[int, str, bytes, bool, Optional[float]]]:
+    """
+    (seq, tópico, payload, binário, recebido em) de um segmento, até o
+    primeiro registro inválido. `recebido em`: epoch em segundos (None em
+    registros do formato antigo).
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    pos, end = 0, len(data)
+    while pos + _HEADER_SIZE <= end:
+        (crc,) = _CRC.unpack_from(data, pos)
+        size, seq, flags, tlen = _FIELDS.unpack_from(data, pos + _CRC.size)
+        body_at = pos + _HEADER_SIZE + (_TIME.size if flags & _RECEIVED else 0)
+        stop = body_at + tlen + size
+        if stop > end:
+            return  # cauda truncada (queda no meio da escrita)
+        body = data[body_at:stop]
+        if zlib.crc32(data[pos + _CRC.size:body_at], zlib.crc32(body)) != crc:
+            print(f"[JOURNAL] Registro corrompido em {os.path.basename(path)} (seq {seq}); ignorando o resto")
+            return
+        received = _TIME.unpack_from(data, pos + _HEADER_SIZE)[0] if flags & _RECEIVED else None
+        yield seq, body[:tlen].decode("utf-8", "replace"), body[tlen:], bool(flags & _BINARY), received
+        pos = stop
+
+
+class IngestJournal:
+    def __init__(
+        self,
+        path: str,
+        on_durable: Optional[Callable[[list], None]] = None,
+        segment_bytes: Optional[int] = None,
+        fsync_ms: Optional[int] = None,
+    ):
+        self.path = path
+        self.on_durable = on_durable
+        self.segment_bytes = segment_bytes or max(1, settings.INGEST_JOURNAL_SEGMENT_MB) << 20
+        self.fsync_interval = (fsync_ms if fsync_ms is not None else settings.INGEST_JOURNAL_FSYNC_MS) / 1000.0
+        os.makedirs(path, exist_ok=True)
+
+        # Anexação (callback do MQTT) x fsync (thread própria)
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._tokens: list = []     # confirmações esperando o próximo fsync
+        self._retired: list = []    # segmentos fechados esperando fsync + close
+        self._dirty = False
+        self._new_entry = False     # arquivo novo no diretório (fsync do diretório)
+        self._segments: list[tuple[int, str]] = sorted(
+            (int(n[:-len(_SUFFIX)]), os.path.join(path, n))
+            for n in os.listdir(path) if n.endswith(_SUFFIX) and n[:-len(_SUFFIX)].isdigit()
+        )
+
+        # Confirmação da gravação no banco (etapa persist)
+        self._ack_lock = threading.Lock()
+        self._done: set[int] = set()
+        self.acked = self._read_checkpoint()
+        self._saved = self.acked
+        last = self.acked
+        if self._segments:
+            last = max(last, self._segments[-1][0] - 1)
+            for seq, *_ in read_segment(self._segments[-1][1]):
+                last = max(last, seq)
+        self._recovered_upto = last
+        self._next = last + 1
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- checkpoint ----------
+    def _read_checkpoint(self) -> int:
+        try:
+            with open(os.path.join(self.path, _CHECKPOINT), encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_checkpoint(self) -> None:
+        acked = self.acked
+        if acked == self._saved:
+            return
+        # Sem fsync: um checkpoint atrasado só aumenta o reprocessamento
+        path = os.path.join(self.path, _CHECKPOINT)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(str(acked))
+        os.replace(path + ".tmp", path)
+        self._saved = acked
+        with self._lock:
+            live = self._segments[:-1] if self._file is not None else self._segments
+            drop = [p for (_, p), (nxt, _) in zip(live, self._segments[1:]) if nxt - 1 <= acked]
+            self._segments = [s for s in self._segments if s[1] not in drop]
+        for p in drop:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+    # ---------- escrita ----------
+    def _rotate(self, first_seq: int) -> None:
+        if self._file is not None:
+            self._retired.append(self._file)
+        path = os.path.join(self.path, _segment_name(first_seq))
+        self._file = open(path, "ab", buffering=_BUFFER)
+        self._segments.append((first_seq, path))
+        self._size = 0
+        self._new_entry = True
+
+    def append(self, topic: str, raw: bytes, binary: bool = False, token=None) -> Optional[int]:
+        """
+        Anexa a mensagem com a hora atual (só no buffer; o fsync é da thread
+        do journal). `token` volta em on_durable depois do fsync. Retorna o seq.
+        """
+        t = topic.encode("utf-8")
+        body_crc = zlib.crc32(raw, zlib.crc32(t))
+        received = _TIME.pack(time.time())
+        with self._lock:
+            seq = self._next
+            fields = _FIELDS.pack(len(raw), seq, (_BINARY if binary else 0) | _RECEIVED, len(t)) + received
+            try:
+                if self._file is None or self._size >= self.segment_bytes:
+                    self._rotate(seq)
+                self._file.write(_CRC.pack(zlib.crc32(fields, body_crc)) + fields)
+                self._file.write(t)
+                self._file.write(raw)
+            except OSError as e:
+                # Disco cheio/indisponível: segue só em memória (sem garantia)
+                print("[JOURNAL] Falha ao anexar:", e)
+                seq = None
+            else:
+                self._next += 1
+                self._size += _HEADER_SIZE + _TIME.size + len(t) + len(raw)
+                self._dirty = True
+                if token is not None:
+                    self._tokens.append(token)
+                    token = None
+        if token is not None and self.on_durable is not None:
+            self.on_durable([token])
+        return seq
+
+    def sync(self) -> None:
+        """Esvazia o buffer, faz o fsync e confirma as mensagens ao broker."""
+        with self._lock:
+            f = self._file
+            try:
+                if self._dirty and f is not None:
+                    f.flush()
+            except OSError as e:
+                print("[JOURNAL] Falha ao gravar:", e)
+                return
+            dirty, self._dirty = self._dirty, False
+            retired, self._retired = self._retired, []
+            tokens, self._tokens = self._tokens, []
+            new_entry, self._new_entry = self._new_entry, False
+        t0 = time.perf_counter()
+        try:
+            for old in retired:
+                old.flush()
+                os.fsync(old.fileno())
+                old.close()
+            if dirty and f is not None:
+                os.fsync(f.fileno())
+            if new_entry:
+                fd = os.open(self.path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+        except OSError as e:
+            # Sem PUBACK: o broker reentrega essas mensagens
+            print("[JOURNAL] fsync falhou:", e)
+            return
+        if dirty or retired:
+            metrics.journal_fsync_seconds.observe(time.perf_counter() - t0)
+        if tokens and self.on_durable is not None:
+            try:
+                self.on_durable(tokens)
+            except Exception as e:
+                print("[JOURNAL] Confirmação falhou:", e)
+        self._write_checkpoint()
+
+    # ---------- confirmação da gravação ----------
+    def done(self, seqs: Iterable[Optional[int]]) -> None:
+        """Mensagens que já saíram do pipeline (gravadas ou descartadas)."""
+        with self._ack_lock:
+            acked, done = self.acked, self._done
+            for s in seqs:
+                if s is not None and s > acked:
+                    done.add(s)
+            while acked + 1 in done:
+                acked += 1
+                done.remove(acked)
+            self.acked = acked
+
+    def _advance(self, seq: int) -> None:
+        with self._ack_lock:
+            if seq > self.acked:
+                self.acked = seq
+                self._done = {s for s in self._done if s > seq}
+
+    def _settle(self, chunk: list) -> bool:
+        """Avança até o fim do bloco reprocessado se todas as mensagens dele saíram (done)."""
+        with self._ack_lock:
+            if not all(seq <= self.acked or seq in self._done for seq, *_ in chunk):
+                return False
+        self._advance(chunk[-1][0])
+        return True
+
+    def pending(self) -> int:
+        """Mensagens anexadas que ainda não chegaram ao banco."""
+        return self._next - 1 - self.acked
+
+    # ---------- recuperação ----------
+    def recover(self, batch_size: Optional[int] = None) -> Iterator[list[tuple]]:
+        """
+        Blocos de (seq, tópico, payload, binário, recebido em) acima do
+        checkpoint, na ordem de chegada. Quem chama marca com done() o que
+        gravou antes de pedir o próximo bloco; a partir do primeiro bloco com
+        mensagem não marcada o checkpoint não avança mais. Chamar antes de
+        começar a anexar.
+        """
+        size = max(1, batch_size or settings.INGEST_JOURNAL_REPLAY_BATCH)
+        upto = self._recovered_upto
+        held = False
+        chunk: list = []
+        for first, path in list(self._segments):
+            if first > upto:
+                break
+            for entry in read_segment(path):
+                if entry[0] <= self.acked:
+                    continue
+                chunk.append(entry)
+                if len(chunk) >= size:
+                    yield chunk
+                    held = held or not self._settle(chunk)
+                    chunk = []
+        if chunk:
+            yield chunk
+            held = held or not self._settle(chunk)
+        if held:
+            print(f"[JOURNAL] Reprocessamento incompleto; {self.pending()} mensagens ficam para a próxima partida")
+        else:
+            # Registros ilegíveis (cauda truncada) também ficam para trás
+            self._advance(upto)
+        self._write_checkpoint()
+
+    # ---------- ciclo ----------
+    def _run(self) -> None:
+        while not self._stop.wait(self.fsync_interval):
+            self.sync()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ingest-journal", daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.sync()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
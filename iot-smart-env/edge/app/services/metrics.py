@@ -0,0 +1,301 @@
+"""
+Métricas do edge no formato texto do Prometheus (GET /metrics).
+
+Sem dependência externa (prometheus_client não é necessário):
+- Counter / Histogram guardam os valores em células por thread
+  (threading.local): o incremento no caminho quente não usa lock nem
+  disputa com as outras threads do pipeline; o /metrics soma as células.
+- Histogramas têm buckets fixos (bisect sobre a tupla de limites).
+- Gauges são lidos na hora da coleta (callbacks: profundidade das filas,
+  clientes WebSocket...), sem custo na ingestão.
+
+Uso:
+    messages_received.inc()
+    db_insert_seconds.observe(elapsed)
+    registry.render()  ->  texto "text/plain; version=0.0.4"
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from bisect import bisect_left
+from typing import Callable, Iterable, Optional
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latências de operações locais (s): 100 µs .. 10 s
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Atraso dispositivo -> edge (s): inclui relógios pouco precisos e reentregas
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+class _Cells:
+    """Uma lista de números por thread; a coleta soma coluna a coluna."""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._local = threading.local()
+        self._all: list[list] = []
+        self._lock = threading.Lock()  # só na primeira escrita de cada thread
+
+    def get(self) -> list:
+        try:
+            return self._local.cells
+        except AttributeError:
+            cells = [0] * self.size
+            with self._lock:
+                self._all.append(cells)
+            self._local.cells = cells
+            return cells
+
+    def totals(self) -> list:
+        with self._lock:
+            rows = [list(c) for c in self._all]
+        return [sum(col) for col in zip(*rows)] if rows else [0] * self.size
+
+
+class Counter:
+    def __init__(self) -> None:
+        self._cells = _Cells(1)
+        self._local = self._cells._local
+
+    def inc(self, n: float = 1) -> None:
+        try:
+            self._local.cells[0] += n
+        except AttributeError:
+            self._cells.get()[0] += n
+
+    def value(self) -> float:
+        return self._cells.totals()[0]
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = tuple(sorted(buckets))
+        # [contagem por bucket..., +Inf, soma]
+        self._cells = _Cells(len(self.buckets) + 2)
+        self._local = self._cells._local
+
+    def observe(self, v: float) -> None:
+        try:
+            cells = self._local.cells
+        except AttributeError:
+            cells = self._cells.get()
+        cells[bisect_left(self.buckets, v)] += 1
+        cells[-1] += v
+
+    def observe_many(self, values: Iterable[float]) -> None:
+        """Várias observações com uma só busca da célula da thread (lotes)."""
+        try:
+            cells = self._local.cells
+        except AttributeError:
+            cells = self._cells.get()
+        buckets, total = self.buckets, 0.0
+        for v in values:
+            cells[bisect_left(buckets, v)] += 1
+            total += v
+        cells[-1] += total
+
+    def snapshot(self) -> tuple[list[int], int, float]:
+        """(contagens acumuladas por limite, total, soma)."""
+        totals = self._cells.totals()
+        cumulative, acc = [], 0
+        for n in totals[:-2]:
+            acc += n
+            cumulative.append(acc)
+        count = acc + totals[-2]
+        return cumulative, count, totals[-1]
+
+
+class _Family:
+    """Métrica com rótulos: um filho (Counter/Histogram) por combinação de valores."""
+
+    def __init__(self, name: str, help: str, kind: str, labelnames: tuple[str, ...], factory: Callable):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = labelnames
+        self._factory = factory
+        self._children: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        if not labelnames:
+            # Exposta desde o início (valor 0); inc/observe vão direto ao filho
+            child = self.labels()
+            self.inc = getattr(child, "inc", None)
+            self.observe = getattr(child, "observe", None)
+            self.observe_many = getattr(child, "observe_many", None)
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    def value(self) -> float:
+        return self.labels().value()
+
+    def samples(self) -> Iterable[tuple[str, dict, float]]:
+        for values, child in sorted(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            if self.kind == "counter":
+                yield self.name, labels, child.value()
+            else:
+                cumulative, count, total = child.snapshot()
+                for bound, n in zip(child.buckets, cumulative):
+                    yield self.name + "_bucket", {**labels, "le": _fmt(bound)}, n
+                yield self.name + "_bucket", {**labels, "le": "+Inf"}, count
+                yield self.name + "_sum", labels, total
+                yield self.name + "_count", labels, count
+
+
+class _GaugeFunc:
+    """
+    Valor lido na coleta: `fn()` devolve um número ou {valores_dos_rótulos: número}.
+    kind="counter" para totais mantidos em outro lugar (ex.: descartes das filas).
+    """
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...], fn: Callable, kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = labelnames
+        self.fn = fn
+
+    def samples(self) -> Iterable[tuple[str, dict, float]]:
+        try:
+            value = self.fn()
+        except Exception:
+            return
+        if isinstance(value, dict):
+            for values, v in sorted(value.items()):
+                if v is None:
+                    continue
+                values = values if isinstance(values, tuple) else (values,)
+                yield self.name, dict(zip(self.labelnames, values)), v
+        elif value is not None:
+            yield self.name, {}, value
+
+
+def _fmt(v: float) -> str:
+    if isinstance(v, float):
+        if math.isinf(v):
+            return "+Inf" if v > 0 else "-Inf"
+        if v.is_integer():
+            return str(int(v)) if abs(v) < 1e15 else repr(v)
+        return repr(v)
+    return str(v)
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, object] = {}
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> _Family:
+        return self._add(_Family(name, help, "counter", labelnames, Counter))
+
+    def histogram(
+        self, name: str, help: str, buckets: tuple[float, ...] = LATENCY_BUCKETS, labelnames: tuple[str, ...] = ()
+    ) -> _Family:
+        return self._add(_Family(name, help, "histogram", labelnames, lambda: Histogram(buckets)))
+
+    def gauge_func(
+        self, name: str, help: str, fn: Callable, labelnames: tuple[str, ...] = (), kind: str = "gauge"
+    ) -> _GaugeFunc:
+        return self._add(_GaugeFunc(name, help, labelnames, fn, kind))
+
+    def get(self, name: str) -> Optional[object]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    body = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                    lines.append(f"{name}{{{body}}} {_fmt(value)}")
+                else:
+                    lines.append(f"{name} {_fmt(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# ---------- métricas do pipeline ----------
+messages_received = registry.counter(
+    "edge_messages_received_total", "Mensagens MQTT recebidas, por formato do payload.", ("format",)
+)
+messages_decoded = registry.counter("edge_messages_decoded_total", "Mensagens decodificadas com sucesso.")
+messages_failed = registry.counter(
+    "edge_messages_failed_total", "Mensagens/leituras que falharam, por etapa.", ("stage",)
+)
+readings_persisted = registry.counter("edge_readings_persisted_total", "Leituras novas gravadas no banco.")
+readings_duplicate = registry.counter(
+    "edge_readings_duplicate_total", "Leituras ignoradas por já existirem (node_id + msg_id)."
+)
+db_insert_seconds = registry.histogram("edge_db_insert_seconds", "Duração do INSERT em lote (com commit e rollups).")
+broadcast_seconds = registry.histogram(
+    "edge_broadcast_seconds", "Duração do broadcast WebSocket de um lote (serialização + agendamento)."
+)
+rule_eval_seconds = registry.histogram("edge_rule_eval_seconds", "Duração da avaliação de regras por leitura.")
+actions_fired = registry.counter("edge_actions_fired_total", "Ações disparadas pelas regras.", ("action",))
+device_lag_seconds = registry.histogram(
+    "edge_device_lag_seconds", "Atraso entre o timestamp do payload e a gravação no edge.", LAG_BUCKETS
+)
+webhook_deliveries = registry.counter(
+    "edge_webhook_deliveries_total", "Eventos entregues por webhook, por resultado (ok, retry, dead).", ("result",)
+)
+webhook_seconds = registry.histogram("edge_webhook_request_seconds", "Duração de cada requisição de webhook (um lote).")
+journal_fsync_seconds = registry.histogram(
+    "edge_journal_fsync_seconds", "Duração de cada fsync em grupo do journal de ingestão."
+)
+journal_replayed = registry.counter("edge_journal_replayed_total", "Mensagens reprocessadas do journal na partida.")
+ws_dropped_frames = registry.counter(
+    "edge_ws_dropped_frames_total", "Frames WebSocket descartados (conflação ou fila cheia do cliente)."
+)
+
+
+def _queue_depth() -> dict:
+    from .stats import pipeline_stats
+
+    return pipeline_stats.snapshot_queues()[0]
+
+
+def _queue_dropped() -> dict:
+    from .stats import pipeline_stats
+
+    return pipeline_stats.snapshot_queues()[1]
+
+
+def _ws_clients() -> int:
+    from ..ws.websocket import ws_manager
+
+    return len(ws_manager.clients)
+
+
+registry.gauge_func("edge_queue_depth", "Itens aguardando em cada etapa do pipeline.", _queue_depth, ("stage",))
+registry.gauge_func(
+    "edge_queue_dropped_total", "Itens descartados pela política de fila de cada etapa.", _queue_dropped, ("stage",),
+    kind="counter",
+)
+registry.gauge_func("edge_ws_clients", "Clientes WebSocket conectados.", _ws_clients)
+
+
+def _actions_pending() -> int:
+    from .actions import action_dispatcher
+
+    return action_dispatcher.pending()
+
+
+registry.gauge_func("edge_actions_pending", "Ações aguardando gravação ou entrega no despachante.", _actions_pending)
@@ -0,0 +1,194 @@
+"""
+Registro dos nós em memória: estado atual de cada nó para o GET /nodes.
+
+- record(): chamado após cada commit de ingestão (leituras novas): última
+  leitura (a de maior timestamp) e último contato (hora de chegada no edge);
+- on_status(): mensagens de <tópico>/status (ver mqtt/topics.py), publicadas
+  com retain pelos nós ("online") e como LWT pelo broker ("offline"); também
+  aceita JSON {"node_id": ..., "status": "online"};
+- warm(): última leitura de cada nó a partir do banco (na subida);
+- snapshot(): todos os nós numa leitura O(nós), sem consultar o banco.
+
+O status chega pelo tópico, não pelo node_id: o tópico de cada nó vem do
+payload das leituras (campo _topic). Status de um tópico ainda sem leitura
+fica pendente até a primeira leitura daquele tópico.
+
+Firmware e tópico ficam no payload bruto (raw_json/raw_extra); só são
+decodificados no snapshot/status, uma vez por leitura nova, para não custar
+nada por mensagem na ingestão.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy.engine import Connection
+
+from ..core.config import settings
+from ..mqtt.topics import STATUS_SUFFIX, is_status_topic
+from . import readings as readings_q
+from .rawpayload import decode_extras
+
+_STATES = {"online": True, "offline": False}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _base_topic(topic: str) -> str:
+    """Tópico de leitura do nó (sem /status e sem o sufixo binário)."""
+    topic = topic.strip()
+    if is_status_topic(topic):
+        return topic[: -len("/" + STATUS_SUFFIX)]
+    suffix = settings.MQTT_BINARY_SUFFIX
+    if suffix and topic.endswith(suffix):
+        return topic[: -len(suffix)]
+    return topic
+
+
+def _parse_status(payload: bytes) -> tuple[Optional[bool], Optional[str]]:
+    """(online, node_id do payload) ou (None, None) se não for um status conhecido."""
+    text = payload.decode("utf-8", "replace").strip()
+    node_id = None
+    if text.startswith("{"):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return None, None
+        text = str(data.get("status", ""))
+        node_id = data.get("node_id")
+    return _STATES.get(text.lower()), (str(node_id) if node_id else None)
+
+
+class _Node:
+    __slots__ = ("node_id", "reading", "last_seen", "raw", "dirty", "firmware", "topic", "online", "status_at")
+
+    def __init__(self, node_id: str) -> None:
+        self.node_id = node_id
+        self.reading: Optional[tuple] = None  # na ordem de readings.COLUMNS
+        self.last_seen: Optional[datetime] = None
+        self.raw: tuple = (None, None)  # (raw_json, raw_extra) da última leitura
+        self.dirty = False  # raw ainda não decodificado
+        self.firmware: Optional[str] = None
+        self.topic: Optional[str] = None
+        self.online: Optional[bool] = None
+        self.status_at: Optional[datetime] = None
+
+
+class NodeRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._nodes: dict[str, _Node] = {}
+        self._by_topic: dict[str, str] = {}
+        self._pending: dict[str, tuple[bool, datetime]] = {}  # status de tópicos sem leitura
+
+    def _node(self, node_id: str) -> _Node:
+        n = self._nodes.get(node_id)
+        if n is None:
+            n = self._nodes[node_id] = _Node(node_id)
+        return n
+
+    # ---------- entrada ----------
+    def warm(self, conn: Connection) -> None:
+        """Última leitura de cada nó (na subida, antes da ingestão)."""
+        for node_id in readings_q.node_ids(conn):
+            rows = readings_q.latest(conn, 1, node_id=node_id)
+            if not rows:
+                continue
+            raw = readings_q.get_raw(conn, rows[0]["id"]) or {}
+            with self._lock:
+                n = self._node(node_id)
+                if n.reading is None:
+                    n.reading = tuple(rows[0][c] for c in readings_q.COLUMNS)
+                    # Hora de chegada não é guardada: usa o timestamp da leitura
+                    n.last_seen = rows[0]["timestamp"]
+                    n.raw = (raw.get("raw_json"), raw.get("raw_extra"))
+                    n.dirty = True
+
+    def record(self, rows: list[dict], ids: list[int]) -> None:
+        if not rows:
+            return
+        now = _now()
+        with self._lock:
+            for rid, row in zip(ids, rows):
+                n = self._node(row["node_id"])
+                n.last_seen = now
+                ts = row["timestamp"]
+                # Leitura atrasada (timestamp anterior) não substitui a atual
+                if n.reading is None or ts >= n.reading[2]:
+                    n.reading = (rid, row["node_id"], ts, row.get("temperature_c"), row.get("humidity_pct"),
+                                 row.get("soil_moisture_pct"), row.get("motion"))
+                    n.raw = (row.get("raw_json"), row.get("raw_extra"))
+                    n.dirty = True
+
+    def on_status(self, topic: str, payload: bytes) -> bool:
+        """Mensagem de <tópico>/status. Retorna False se o payload não for um status."""
+        online, node_id = _parse_status(payload)
+        if online is None:
+            return False
+        base = _base_topic(topic)
+        now = _now()
+        with self._lock:
+            if node_id is None:
+                node_id = self._by_topic.get(base)
+            if node_id is None:
+                self._resolve_all()
+                node_id = self._by_topic.get(base)
+            if node_id is None:
+                self._pending[base] = (online, now)
+                return True
+            n = self._node(node_id)
+            changed = n.online is not online
+            n.online, n.status_at, n.topic = online, now, base
+            self._by_topic[base] = node_id
+        if changed:
+            print(f"[NODES] {node_id} {'online' if online else 'offline'}")
+        return True
+
+    # ---------- decodificação sob demanda ----------
+    def _resolve(self, n: _Node) -> None:
+        n.dirty = False
+        raw_json, raw_extra = n.raw
+        try:
+            fields = json.loads(raw_json) if raw_json else decode_extras(raw_extra)
+        except Exception:
+            return
+        if fields.get("firmware") is not None:
+            n.firmware = str(fields["firmware"])
+        topic = fields.get("_topic")
+        if topic:
+            n.topic = _base_topic(str(topic))
+            self._by_topic[n.topic] = n.node_id
+            pending = self._pending.pop(n.topic, None)
+            if pending and (n.status_at is None or pending[1] > n.status_at):
+                n.online, n.status_at = pending
+
+    def _resolve_all(self) -> None:
+        for n in self._nodes.values():
+            if n.dirty:
+                self._resolve(n)
+
+    # ---------- leitura ----------
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            self._resolve_all()
+            nodes = sorted(self._nodes.values(), key=lambda n: n.node_id)
+            return [
+                {
+                    "node_id": n.node_id,
+                    "online": n.online,
+                    "status_at": n.status_at,
+                    "last_seen": n.last_seen,
+                    "firmware": n.firmware,
+                    "topic": n.topic,
+                    "last": dict(zip(readings_q.COLUMNS, n.reading)) if n.reading else None,
+                }
+                for n in nodes
+            ]
+
+
+node_registry = NodeRegistry()
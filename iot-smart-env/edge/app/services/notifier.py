@@ -1,12 +1,69 @@
 """
-Canal de notificações (placeholder).
-Poderia enviar webhook/discord/email. Aqui mantemos como stub para uso futuro.
+Canal de notificações: webhooks HTTP das ações das regras.
+
+- WebhookSender: cliente HTTP assíncrono com pool de conexões keep-alive
+  (ACTIONS_HTTP_MAX_CONNECTIONS), usado pelo despachante (services/actions.py)
+  no seu próprio event loop. Cada requisição leva um lote de eventos:
+      POST <url>  {"events": [{...}, ...]}
+- Resposta 2xx: entregue. 408/429/5xx e erros de rede: WebhookError
+  temporário (o despachante tenta de novo com backoff). Demais 4xx: erro
+  permanente (não adianta repetir).
+- send_webhook(): enfileira um evento avulso no outbox (entrega assíncrona).
+
+Requer o pacote `httpx`.
 """
 
 from __future__ import annotations
 
+import json
+import time
+
+from ..core.config import settings
+from . import metrics
+
+try:
+    import httpx  # type: ignore
+except Exception:  # dependência opcional
+    httpx = None
+
+
+class WebhookError(Exception):
+    def __init__(self, message: str, permanent: bool = False) -> None:
+        super().__init__(message)
+        self.permanent = permanent
+
+
+class WebhookSender:
+    def __init__(self) -> None:
+        if httpx is None:
+            raise RuntimeError("webhooks requerem o pacote 'httpx'")
+        limits = httpx.Limits(
+            max_connections=max(1, settings.ACTIONS_HTTP_MAX_CONNECTIONS),
+            max_keepalive_connections=max(1, settings.ACTIONS_HTTP_MAX_CONNECTIONS),
+            keepalive_expiry=30.0,
+        )
+        self._client = httpx.AsyncClient(timeout=settings.ACTIONS_HTTP_TIMEOUT_SEC, limits=limits)
+
+    async def post(self, url: str, events: list[dict]) -> None:
+        body = json.dumps({"events": events}, ensure_ascii=False, separators=(",", ":")).encode()
+        t0 = time.perf_counter()
+        try:
+            r = await self._client.post(url, content=body, headers={"Content-Type": "application/json"})
+        except httpx.HTTPError as e:
+            raise WebhookError(f"{type(e).__name__}: {e}") from e
+        finally:
+            metrics.webhook_seconds.observe(time.perf_counter() - t0)
+        if r.status_code >= 300:
+            code = r.status_code
+            raise WebhookError(f"HTTP {code}", permanent=400 <= code < 500 and code not in (408, 429))
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
 
 def send_webhook(url: str, payload: dict):
-    # Implementação futura: requests.post(url, json=payload, timeout=3)
-    # Mantido como stub para não adicionar dependências externas agora.
+    """Enfileira `payload` para `url` (outbox persistente; entrega pelo despachante)."""
+    from .actions import ActionEvent, action_dispatcher
+
+    action_dispatcher.dispatch([ActionEvent(action="webhook", payload=payload, url=url)])
     return {"status": "queued", "url": url, "payload": payload}
@@ -0,0 +1,433 @@
+"""
+Pipeline de ingestão em etapas, com filas limitadas e contrapressão explícita.
+
+    MQTT -> decode -> persist -> broadcast
+                              -> rules
+
+- decode:    bytes -> linha normalizada (services/decoder.py; INGEST_WORKERS threads)
+- persist:   INSERT em lote + rollups + contadores (um commit por lote)
+- broadcast: envio aos clientes WebSocket
+- rules:     avaliação de regras / registro de ações
+
+Cada etapa tem N "pistas" (uma thread e uma fila limitada cada); os itens
+são roteados por hash do node_id normalizado (shard_key), então a ordem por nó é preservada em todas
+as etapas. Quando uma fila enche, vale a política da etapa:
+- block:       o produtor espera (contrapressão; na etapa decode, prende o
+               loop de rede do paho e atrasa keepalives);
+- drop_oldest: descarta o item mais antigo da fila;
+- sample:      aceita 1 a cada PIPELINE_SAMPLE_EVERY itens excedentes
+               (descartando o mais antigo) e descarta os demais.
+Profundidade e descartes de cada etapa aparecem no /health e no /metrics.
+
+Com journal (services/journal.py), cada mensagem leva o seu seq pelas etapas
+decode e persist; o seq é liberado (journal.done) quando a leitura é gravada
+ou descartada (payload inválido, linha recusada pelo banco). As mensagens já
+foram confirmadas ao broker (PUBACK após o fsync), então decode e persist
+sempre usam "block" com journal; um item que não entra na fila (desligamento)
+não é liberado e volta no recover(). Falha temporária do banco (travado/ocupado, conexão perdida): a
+etapa persist tenta de novo com backoff (PIPELINE_PERSIST_RETRY_*) até dar
+certo ou o pipeline parar; o que não gravou não é liberado e continua no
+journal. recover() reprocessa na partida, em lotes grandes, o que ficou no
+journal sem chegar ao banco.
+"""
+
+from __future__ import annotations
+
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+from sqlalchemy import exc
+
+from ..core.config import settings
+from . import codec, metrics
+from .decoder import decode_reading
+from .ingest import broadcast_readings, evaluate_readings, persist_rows
+from .journal import IngestJournal
+from .stats import pipeline_stats
+
+POLICIES = ("block", "drop_oldest", "sample")
+
+# Filhos rotulados resolvidos uma vez (fora do caminho quente)
+_RECEIVED = {False: metrics.messages_received.labels("json"), True: metrics.messages_received.labels("msgpack")}
+_DECODE_FAILED = metrics.messages_failed.labels("decode")
+_PERSIST_FAILED = metrics.messages_failed.labels("persist")
+
+_NODE_ID_RE = re.compile(rb'"node_id"\s*:\s*("(?:[^"\\]|\\.)*"|[^\s,}\]]+)')
+_UNKNOWN = b"unknown"
+
+
+def shard_key(raw: bytes, binary: bool = False) -> bytes:
+    """
+    node_id como a decodificação o normaliza (str; "unknown" se ausente),
+    sem decodificar o payload: decode e persist roteiam cada nó pela mesma
+    chave. Só escapes JSON e MessagePack com node_id fora do início passam
+    por um decode.
+    """
+    if binary:
+        key = codec.peek_node_id(raw)
+        if key is not None:
+            return key
+        try:
+            return str(codec.decode_reading(raw).get("node_id", "unknown")).encode()
+        except Exception:
+            return _UNKNOWN
+    m = _NODE_ID_RE.search(raw)
+    if m is None:
+        return _UNKNOWN
+    token = m.group(1)
+    if token[:1] == b'"' and b"\\" not in token:
+        return token[1:-1]
+    try:
+        return str(json.loads(token)).encode()
+    except ValueError:
+        return _UNKNOWN
+
+
+_BUSY_CODES = (5, 6)  # SQLITE_BUSY, SQLITE_LOCKED (códigos primários)
+_BUSY_MESSAGES = ("database is locked", "database is busy", "database table is locked")
+
+
+def _transient(error: Exception) -> bool:
+    """
+    Banco travado/ocupado, espera pela conexão de escrita ou conexão perdida:
+    vale tentar de novo. Erros de esquema ("no such table"...) e os demais não.
+    """
+    if isinstance(error, exc.TimeoutError):
+        return True
+    if not isinstance(error, exc.DBAPIError):
+        return False
+    if error.connection_invalidated:
+        return True
+    if not isinstance(error, exc.OperationalError):
+        return False
+    code = getattr(error.orig, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in _BUSY_CODES
+    message = str(error.orig).lower()
+    return any(m in message for m in _BUSY_MESSAGES)
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(settings.PIPELINE_PERSIST_RETRY_MAX_SEC, settings.PIPELINE_PERSIST_RETRY_BASE_SEC * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def shard_index(key: bytes, n: int) -> int:
+    # crc32: estável entre execuções (hash() de bytes é aleatorizado)
+    return zlib.crc32(key) % n if n > 1 else 0
+
+
+class _Lane:
+    """Fila limitada de uma thread da etapa (deque + Condition)."""
+
+    def __init__(self, maxsize: int, policy: str, sample_every: int):
+        self.items: deque = deque()
+        self.cond = threading.Condition()
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.sample_every = max(1, sample_every)
+        self.unfinished = 0
+        self.dropped = 0
+        self._overflow = 0
+
+    def _drop_oldest(self) -> None:
+        self.items.popleft()
+        self.unfinished -= 1
+        self.dropped += 1
+
+    def put(self, item: Any, stop: threading.Event) -> bool:
+        with self.cond:
+            while len(self.items) >= self.maxsize:
+                if self.policy == "drop_oldest":
+                    self._drop_oldest()
+                elif self.policy == "sample":
+                    self._overflow += 1
+                    if self._overflow % self.sample_every:
+                        self.dropped += 1
+                        return False
+                    self._drop_oldest()
+                else:
+                    if stop.is_set():
+                        return False
+                    self.cond.wait(0.25)
+            self.items.append(item)
+            self.unfinished += 1
+            self.cond.notify_all()
+            return True
+
+    def get_batch(self, max_size: int, linger: float) -> list:
+        with self.cond:
+            if not self.items:
+                self.cond.wait(0.25)
+                if not self.items:
+                    return []
+            deadline = time.monotonic() + linger
+            while len(self.items) < max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch = [self.items.popleft() for _ in range(min(max_size, len(self.items)))]
+            self.cond.notify_all()  # acorda produtores bloqueados
+            return batch
+
+    def done(self, n: int) -> None:
+        with self.cond:
+            self.unfinished -= n
+            if self.unfinished <= 0:
+                self.cond.notify_all()
+
+    def join(self, deadline: Optional[float] = None) -> bool:
+        """Espera esvaziar; False se `deadline` (time.monotonic()) passou antes."""
+        with self.cond:
+            while self.unfinished > 0:
+                wait = 0.25
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                    if wait <= 0:
+                        return False
+                self.cond.wait(wait)
+        return True
+
+
+class Stage:
+    """Uma etapa: `workers` threads, cada uma consumindo lotes da sua pista."""
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[list], None],
+        workers: int = 1,
+        maxsize: int = 1000,
+        policy: str = "block",
+        batch_size: int = 1,
+        linger_ms: int = 0,
+    ):
+        if policy not in POLICIES:
+            print(f"[PIPELINE] Política desconhecida para {name}: {policy!r}; usando 'block'")
+            policy = "block"
+        self.name = name
+        self.handler = handler
+        self.policy = policy
+        self.batch_size = max(1, batch_size)
+        self.linger = linger_ms / 1000.0
+        self.lanes = [
+            _Lane(maxsize, policy, settings.PIPELINE_SAMPLE_EVERY) for _ in range(max(1, workers))
+        ]
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    def put(self, item: Any, key: bytes = b"") -> bool:
+        """Enfileira na pista do `key`; False se o item foi descartado."""
+        return self.lanes[shard_index(key, len(self.lanes))].put(item, self._stop)
+
+    def depth(self) -> int:
+        return sum(len(lane.items) for lane in self.lanes)
+
+    def dropped(self) -> int:
+        return sum(lane.dropped for lane in self.lanes)
+
+    def _run(self, lane: _Lane) -> None:
+        while not self._stop.is_set():
+            batch = lane.get_batch(self.batch_size, self.linger)
+            if not batch:
+                continue
+            try:
+                self.handler(batch)
+            except Exception as e:
+                print(f"[PIPELINE] Etapa {self.name} falhou:", e)
+            finally:
+                lane.done(len(batch))
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for i, lane in enumerate(self.lanes):
+            t = threading.Thread(target=self._run, args=(lane,), name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        pipeline_stats.register_queue(self.name, self.depth, self.dropped)
+
+    def stop(self) -> None:
+        self._stop.set()
+        pipeline_stats.unregister_queue(self.name)
+
+    def join(self, deadline: Optional[float] = None) -> bool:
+        return all(lane.join(deadline) for lane in self.lanes)
+
+
+class IngestPipeline:
+    def __init__(self, decode_workers: Optional[int] = None, journal: Optional[IngestJournal] = None):
+        self.journal = journal
+        batch = max(1, settings.INGEST_BATCH_SIZE)
+        decode_policy, persist_policy = settings.PIPELINE_DECODE_POLICY, settings.PIPELINE_PERSIST_POLICY
+        if journal is not None and (decode_policy, persist_policy) != ("block", "block"):
+            # Descartar perderia mensagens que o broker já considera entregues
+            print(f"[PIPELINE] Com journal, decode/persist usam 'block' (configurado: {decode_policy}/{persist_policy})")
+            decode_policy = persist_policy = "block"
+        self.decode = Stage(
+            "decode", self._decode,
+            workers=decode_workers if decode_workers is not None else settings.INGEST_WORKERS,
+            maxsize=settings.PIPELINE_DECODE_QUEUE_MAX, policy=decode_policy, batch_size=batch,
+        )
+        self.persist = Stage(
+            "persist", self._persist,
+            workers=settings.PIPELINE_PERSIST_WORKERS,
+            maxsize=settings.PIPELINE_PERSIST_QUEUE_MAX, policy=persist_policy,
+            batch_size=batch, linger_ms=settings.INGEST_BATCH_LINGER_MS,
+        )
+        self.broadcast = Stage(
+            "broadcast", broadcast_readings,
+            workers=settings.PIPELINE_BROADCAST_WORKERS,
+            maxsize=settings.PIPELINE_BROADCAST_QUEUE_MAX, policy=settings.PIPELINE_BROADCAST_POLICY,
+            batch_size=batch,
+        )
+        self.rules = Stage(
+            "rules", evaluate_readings,
+            workers=settings.PIPELINE_RULES_WORKERS,
+            maxsize=settings.PIPELINE_RULES_QUEUE_MAX, policy=settings.PIPELINE_RULES_POLICY,
+            batch_size=batch,
+        )
+        self.stages = [self.decode, self.persist, self.broadcast, self.rules]
+
+    # ---------- entrada ----------
+    def submit(
+        self,
+        topic: str,
+        raw: bytes,
+        received: Optional[float] = None,
+        content_type: Optional[str] = None,
+        ack: Any = None,
+    ) -> bool:
+        """
+        Mensagem MQTT bruta; não decodifica (roda no loop de rede do paho).
+        Com journal, anexa antes de enfileirar; `ack` volta no on_durable do
+        journal depois do fsync.
+        """
+        binary = codec.is_binary(topic, content_type)
+        _RECEIVED[binary].inc()
+        seq = self.journal.append(topic, raw, binary, ack) if self.journal is not None else None
+        item = (received if received is not None else time.monotonic(), topic, raw, binary, seq)
+        # Fora da fila (descarte ou desligamento): o seq não é liberado e a
+        # mensagem volta no recover()
+        return self.decode.put(item, shard_key(raw, binary))
+
+    def _release(self, *seqs: Optional[int]) -> None:
+        if self.journal is not None:
+            self.journal.done(seqs)
+
+    # ---------- etapas ----------
+    def _decode(self, batch: list) -> None:
+        decoded = 0
+        for received, topic, raw, binary, seq in batch:
+            try:
+                row = decode_reading(topic, raw, binary)
+            except Exception as e:
+                print("[MQTT] Bad payload:", e)
+                _DECODE_FAILED.inc()
+                self._release(seq)
+                continue
+            decoded += 1
+            self.persist.put((received, row, seq), row["node_id"].encode())
+        metrics.messages_decoded.inc(decoded)
+
+    def _persist(self, batch: list) -> None:
+        readings, settled = self._write(batch)
+        # Só o que gravou (ou nunca vai gravar) sai do journal
+        self._release(*(seq for _, _, seq in settled))
+        if settled:
+            pipeline_stats.record_lag(min(received for received, _, _ in settled))
+        for r in readings:
+            key = r.node_id.encode()
+            self.broadcast.put(r, key)
+            self.rules.put(r, key)
+
+    def _write(self, batch: list) -> tuple[list, list]:
+        """
+        Grava o lote; retorna (leituras novas, itens resolvidos). Falha
+        temporária: nova tentativa com backoff até o pipeline parar (os itens
+        não voltam como resolvidos). Outra falha: isola as linhas recusadas,
+        que são descartadas.
+        """
+        rows = [row for _, row, _ in batch]
+        attempts = 0
+        while True:
+            try:
+                return persist_rows(rows), batch
+            except Exception as e:
+                error = e
+            if not _transient(error):
+                break
+            attempts += 1
+            delay = _backoff(attempts)
+            print(f"[INGEST] Banco ocupado ({len(rows)} leituras); nova tentativa em {delay:.1f}s:",
+                  str(error).split("\n", 1)[0])
+            if self.persist._stop.wait(delay):
+                return [], []
+        if len(batch) == 1:
+            print("[INGEST] Error:", str(error).split("\n", 1)[0])
+            _PERSIST_FAILED.inc()
+            return [], batch
+        print("[INGEST] Lote falhou, reprocessando individualmente:", str(error).split("\n", 1)[0])
+        # Isola a linha problemática sem perder o restante do lote
+        readings, settled = [], []
+        for item in batch:
+            r, done = self._write([item])
+            readings += r
+            settled += done
+        return readings, settled
+
+    def recover(self) -> int:
+        """
+        Reprocessa o que ficou no journal sem chegar ao banco (queda ou
+        desligamento sem drenar): decode e um INSERT por bloco de
+        INGEST_JOURNAL_REPLAY_BATCH, sem passar pelas filas de entrada. As
+        leituras novas seguem para broadcast e regras; chamar com as etapas
+        rodando e antes de assinar o broker. Só o que gravou (ou é inválido)
+        sai do journal. Retorna as mensagens lidas.
+        """
+        if self.journal is None:
+            return 0
+        total = 0
+        for chunk in self.journal.recover():
+            received, batch = time.monotonic(), []
+            for seq, topic, raw, binary, at in chunk:
+                # Sem timestamp no payload: a hora em que a mensagem chegou, não a do reprocessamento
+                received_at = datetime.fromtimestamp(at, timezone.utc).replace(tzinfo=None) if at else None
+                try:
+                    batch.append((received, decode_reading(topic, raw, binary, received_at), seq))
+                except Exception as e:
+                    print("[JOURNAL] Payload inválido no reprocessamento:", e)
+                    _DECODE_FAILED.inc()
+                    self._release(seq)
+            if batch:
+                self._persist(batch)
+            total += len(chunk)
+        if total:
+            metrics.journal_replayed.inc(total)
+            print(f"[JOURNAL] {total} mensagens reprocessadas")
+        return total
+
+    # ---------- ciclo ----------
+    def start(self) -> None:
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self) -> None:
+        for stage in self.stages:
+            stage.stop()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        Espera todas as etapas esvaziarem, na ordem do fluxo (testes,
+        benchmarks e desligamento). False se `timeout` acabou antes.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        return all(stage.join(deadline) for stage in self.stages)
@@ -0,0 +1,116 @@
+"""
+Armazenamento compacto do payload bruto (RAW_PAYLOAD_MODE=compact).
+
+Em vez de `json.dumps(payload)` inteiro em Reading.raw_json, guardamos em
+Reading.raw_extra só o que não está nas colunas tipadas:
+- campos não mapeados (ex.: _topic, firmware, rssi_dbm);
+- campos mapeados cujo valor original difere do valor normalizado
+  (ex.: "55,5" -> 55.5), para a reconstrução ser fiel;
+- marcadores para timestamp/node_id ausentes ou em formato não canônico.
+
+O resultado é JSON compacto comprimido com deflate + dicionário pré-definido
+(zdict com os trechos mais comuns dos payloads). Sem extras, raw_extra = NULL.
+rebuild_payload() reconstrói o payload original a partir da linha.
+"""
+
+from __future__ import annotations
+
+import json
+import zlib
+from datetime import datetime
+from typing import Any, Optional
+
+_VERSION = 1
+# Trechos frequentes nos payloads dos nós (quanto mais ao fim, menor a distância)
+_ZDICT = (
+    b'"rssi_dbm":-"firmware":"esp32-fw-0.1.0"proto1-sim-0.1.0"'
+    b'{"_topic":"iot/env/room1/reading","firmware":"'
+)
+_METRICS = ("temperature_c", "humidity_pct", "soil_moisture_pct", "motion")
+_MISSING = "\x00missing"  # campos mapeados ausentes no payload original
+
+
+def _compress(data: bytes) -> bytes:
+    c = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=_ZDICT)
+    return bytes([_VERSION]) + c.compress(data) + c.flush()
+
+
+def _decompress(blob: bytes) -> bytes:
+    if blob[0] != _VERSION:
+        raise ValueError("versão de raw_extra desconhecida")
+    d = zlib.decompressobj(-15, zdict=_ZDICT)
+    return d.decompress(blob[1:]) + d.flush()
+
+
+def _canonical_ts(ts: datetime) -> str:
+    # Formato do simulador/Python: isoformat com milissegundos e "+00:00"
+    return ts.isoformat(timespec="milliseconds") + "+00:00"
+
+
+def _same(original: Any, normalized: Any) -> bool:
+    if isinstance(normalized, bool) or isinstance(original, bool):
+        return type(original) is type(normalized) and original == normalized
+    if isinstance(original, (int, float)) and isinstance(normalized, float):
+        return float(original) == normalized
+    return original == normalized
+
+
+def extract_extras(payload: dict, norm: dict) -> dict:
+    """Campos do payload que as colunas tipadas não reproduzem."""
+    extras: dict = {}
+    missing = []
+    for k, v in payload.items():
+        if k == "timestamp":
+            if not isinstance(v, str) or v != _canonical_ts(norm["timestamp"]):
+                extras[k] = v
+        elif k == "node_id" or k in _METRICS:
+            if not _same(v, norm[k]):
+                extras[k] = v
+        else:
+            extras[k] = v
+    for k in ("node_id", "timestamp"):
+        if k not in payload:
+            missing.append(k)
+    if missing:
+        extras[_MISSING] = missing
+    return extras
+
+
+def encode_extras(payload: dict, norm: dict) -> Optional[bytes]:
+    extras = extract_extras(payload, norm)
+    if not extras:
+        return None
+    return _compress(json.dumps(extras, ensure_ascii=False, separators=(",", ":")).encode())
+
+
+def decode_extras(blob: Optional[bytes]) -> dict:
+    if not blob:
+        return {}
+    return json.loads(_decompress(blob))
+
+
+def rebuild_payload(row: Any) -> dict:
+    """
+    Payload original a partir de uma linha de leitura (objeto ou dict com as
+    colunas). Usa raw_json quando presente (modo "json").
+    """
+    get = row.get if isinstance(row, dict) else lambda k, d=None: getattr(row, k, d)
+    raw_json = get("raw_json")
+    if raw_json:
+        return json.loads(raw_json)
+
+    extras = decode_extras(get("raw_extra"))
+    missing = set(extras.pop(_MISSING, ()))
+    out: dict = {}
+    if "node_id" not in missing:
+        out["node_id"] = get("node_id")
+    for m in _METRICS:
+        v = get(m)
+        if v is not None:
+            out[m] = v
+    if "timestamp" not in missing:
+        out["timestamp"] = _canonical_ts(get("timestamp"))
+    # Extras por último: valores originais substituem os normalizados
+    for k, v in extras.items():
+        out[k] = v
+    return out
@@ -0,0 +1,225 @@
+"""
+Consultas de leituras para a API:
+- latest(): últimas N leituras (GET /readings)
+- page(): paginação por chave (keyset) em (timestamp, id), ordem crescente
+- iter_rows(): percorre um intervalo arbitrário em blocos, memória constante
+- counts(): total de leituras e de nós distintos
+- node_ids()/max_timestamp(): conjunto de nós e leitura mais recente (carga dos contadores)
+- get_raw(): linha completa (com raw_json/raw_extra) de uma leitura pelo id
+- encode_cursor()/decode_cursor(): cursor opaco (base64 de [timestamp, id])
+
+Com STORAGE_PARTITIONING ativo, cada consulta só toca as partições que
+cruzam o intervalo pedido (ver db/partitions.py). Intervalos anteriores ao
+horizonte da retenção também são lidos dos segmentos arquivados
+(services/archive.py), de forma transparente.
+
+Cada bloco é uma consulta curta e independente: não mantém cursor aberto no
+SQLite (que bloquearia o escritor) durante uma exportação longa.
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+from datetime import datetime
+from typing import Iterator, Optional
+
+from sqlalchemy import and_, func, or_, select, union
+from sqlalchemy.engine import Connection, Engine
+
+from ..db import partitions
+from . import archive
+
+COLUMNS = ("id", "node_id", "timestamp", "temperature_c", "humidity_pct", "soil_moisture_pct", "motion")
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp: datetime, reading_id: int) -> str:
+    raw = json.dumps([timestamp.isoformat(), reading_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, rid = json.loads(raw)
+        return datetime.fromisoformat(ts), int(rid)
+    except Exception as e:
+        raise InvalidCursor("cursor inválido") from e
+
+
+def _select(t, node_id: Optional[str], since: Optional[datetime], until: Optional[datetime]):
+    q = select(*(t.c[c] for c in COLUMNS))
+    if node_id:
+        q = q.where(t.c.node_id == node_id)
+    if since:
+        q = q.where(t.c.timestamp >= since)
+    if until:
+        q = q.where(t.c.timestamp <= until)
+    return q
+
+
+def _key(row: dict) -> tuple:
+    return row["timestamp"], row["id"]
+
+
+def _archive_window(
+    since: Optional[datetime], until: Optional[datetime]
+) -> Optional[tuple[Optional[datetime], datetime]]:
+    """Parte de [since, until] que cai antes do horizonte do arquivo (ou None)."""
+    h = archive.horizon()
+    if h is None or (since is not None and since >= h):
+        return None
+    return since, (h if until is None else min(until, h))
+
+
+def _merge(rows: list[dict], extra: list[dict]) -> list[dict]:
+    # Durante a migração uma linha pode estar na base e no arquivo: dedup por id
+    seen = {r["id"] for r in rows}
+    rows += [{c: r[c] for c in COLUMNS} for r in extra if r["id"] not in seen]
+    rows.sort(key=_key)
+    return rows
+
+
+def page(
+    conn: Connection,
+    limit: int,
+    node_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[tuple[datetime, int]] = None,
+) -> tuple[list[dict], Optional[tuple[datetime, int]]]:
+    """
+    Retorna até `limit` leituras após `after` (exclusivo) e a chave da próxima
+    página (None quando não há mais linhas).
+    """
+    lo = since
+    if after and (lo is None or after[0] > lo):
+        lo = after[0]
+    rows: list[dict] = []
+    from_parts = 0
+    for p in partitions.partitions_for_range(conn, lo, until):
+        t = p.table
+        q = _select(t, node_id, since, until)
+        if after:
+            ts, rid = after
+            q = q.where(or_(t.c.timestamp > ts, and_(t.c.timestamp == ts, t.c.id > rid)))
+        # Uma linha a mais só para saber se existe próxima página
+        q = q.order_by(t.c.timestamp, t.c.id).limit(limit + 1)
+        got = [dict(r._mapping) for r in conn.execute(q)]
+        rows += got
+        if p.start is not None:
+            from_parts += len(got)
+            # Partições são disjuntas e crescentes: as seguintes só têm chaves maiores
+            if from_parts > limit:
+                break
+    window = _archive_window(lo, until)
+    if window:
+        extra = []
+        for r in archive.read_range(node_id, window[0], window[1]):
+            if after and _key(r) <= after:
+                continue
+            extra.append(r)
+            if len(extra) > limit:
+                break
+        rows = _merge(rows, extra)
+    rows.sort(key=_key)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, _key(rows[-1])
+
+
+def latest(
+    conn: Connection,
+    limit: int,
+    node_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> list[dict]:
+    """
+    Últimas `limit` leituras, em ordem crescente.
+    Sem particionamento: pelas maiores IDs (ordem de chegada), como sempre foi.
+    Com particionamento: pelo timestamp, da partição mais nova para a mais antiga.
+    """
+    parts = partitions.partitions_for_range(conn, since, until)
+    if len(parts) == 1 and parts[0].start is None:
+        t = parts[0].table
+        q = _select(t, node_id, since, until).order_by(t.c.id.desc()).limit(limit)
+        rows = [dict(r._mapping) for r in reversed(conn.execute(q).all())]
+    else:
+        rows = []
+        from_parts = 0
+        for p in [parts[0], *reversed(parts[1:])]:
+            t = p.table
+            q = _select(t, node_id, since, until).order_by(t.c.timestamp.desc(), t.c.id.desc()).limit(limit)
+            got = [dict(r._mapping) for r in conn.execute(q)]
+            rows += got
+            if p.start is not None:
+                from_parts += len(got)
+                if from_parts >= limit:
+                    break
+        rows.sort(key=_key)
+        rows = rows[-limit:]
+
+    # Faltaram linhas e o intervalo alcança o arquivo: completa com as mais novas de lá
+    window = _archive_window(since, until) if len(rows) < limit else None
+    if window:
+        extra = []
+        for r in archive.read_range(node_id, window[0], window[1], descending=True):
+            extra.append(r)
+            if len(extra) >= limit:
+                break
+        rows = _merge(rows, extra)[-limit:]
+    return rows
+
+
+def get_raw(conn: Connection, reading_id: int) -> Optional[dict]:
+    for p in partitions.partitions_for_range(conn):
+        row = conn.execute(select(p.table).where(p.table.c.id == reading_id)).first()
+        if row is not None:
+            return dict(row._mapping)
+    return None
+
+
+def counts(conn: Connection) -> tuple[int, int]:
+    """(total de leituras, nós distintos) somando todas as partições."""
+    parts = partitions.partitions_for_range(conn)
+    total = sum(conn.execute(select(func.count()).select_from(p.table)).scalar_one() for p in parts)
+    nodes_q = union(*(select(p.table.c.node_id) for p in parts)) if len(parts) > 1 \
+        else select(parts[0].table.c.node_id).distinct()
+    nodes = conn.execute(select(func.count()).select_from(nodes_q.subquery())).scalar_one()
+    return int(total or 0), int(nodes or 0)
+
+
+def node_ids(conn: Connection) -> set[str]:
+    out: set[str] = set()
+    for p in partitions.partitions_for_range(conn):
+        out.update(conn.execute(select(p.table.c.node_id).distinct()).scalars())
+    return out
+
+
+def max_timestamp(conn: Connection) -> Optional[datetime]:
+    found = [conn.execute(select(func.max(p.table.c.timestamp))).scalar() for p in partitions.partitions_for_range(conn)]
+    found = [ts for ts in found if ts is not None]
+    return max(found) if found else None
+
+
+def iter_rows(
+    engine: Engine,
+    node_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    chunk: int = 2000,
+) -> Iterator[dict]:
+    after = None
+    while True:
+        # Conexão por bloco: nenhuma leitura fica aberta entre um bloco e outro
+        with engine.connect() as conn:
+            rows, after = page(conn, chunk, node_id=node_id, since=since, until=until, after=after)
+        yield from rows
+        if after is None:
+            return
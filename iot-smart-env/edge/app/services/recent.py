@@ -0,0 +1,175 @@
+"""
+Leituras recentes em memória (buffer circular por nó + um global).
+
+- record(): chamado após cada commit de ingestão, só com as leituras novas;
+- warm(): carrega as últimas leituras de cada nó a partir do banco (na
+  subida, antes da ingestão começar);
+- latest(): últimas N leituras (de um nó ou de todos) para o GET /readings
+  sem intervalo. Retorna None quando o buffer não garante a mesma resposta do
+  banco (menos de N leituras guardadas): quem chama consulta o banco;
+- replay(): frames das últimas leituras para um cliente WebSocket recém-conectado;
+- drop_before(): descarta o que a retenção tirou da base.
+
+Cada buffer é uma lista de tamanho fixo com início e contagem (sem realocar
+nem deslocar itens); uma leitura é uma tupla na ordem de readings.COLUMNS.
+Memória: ~250 bytes por leitura, RECENT_PER_NODE por nó + RECENT_GLOBAL.
+No máximo RECENT_MAX_NODES nós têm buffer (LRU pela última gravação): node_ids
+malformados ou forjados não crescem a memória; um nó despejado volta a ser
+servido pelo banco.
+
+Desligado com RECENT_PER_NODE=0, com STORAGE_PARTITIONING (a ordem passa a
+ser por timestamp) e com MQTT_SHARED_GROUP (outras instâncias gravam na
+mesma base sem passar por este processo).
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.engine import Connection
+
+from ..core.config import settings
+from ..db import models, partitions
+from . import readings as readings_q
+
+COLUMNS = readings_q.COLUMNS
+_ID, _NODE, _TS = 0, 1, 2
+
+
+class _Ring:
+    __slots__ = ("items", "start", "count")
+
+    def __init__(self, capacity: int) -> None:
+        self.items: list = [None] * max(1, capacity)
+        self.start = 0
+        self.count = 0
+
+    def append(self, item: tuple) -> None:
+        cap = len(self.items)
+        if self.count < cap:
+            self.items[(self.start + self.count) % cap] = item
+            self.count += 1
+        else:
+            # Cheio: sobrescreve o mais antigo
+            self.items[self.start] = item
+            self.start = (self.start + 1) % cap
+
+    def last(self, n: int) -> list[tuple]:
+        """As `n` mais recentes, da mais antiga para a mais nova."""
+        cap = len(self.items)
+        n = min(n, self.count)
+        first = self.start + self.count - n
+        return [self.items[(first + i) % cap] for i in range(n)]
+
+    def retain(self, keep: Callable[[tuple], bool]) -> None:
+        kept = [t for t in self.last(self.count) if keep(t)]
+        self.items = [None] * len(self.items)
+        self.start = 0
+        self.count = 0
+        for t in kept:
+            self.append(t)
+
+
+def _as_row(t: tuple) -> dict:
+    return dict(zip(COLUMNS, t))
+
+
+class RecentReadings:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._nodes: "OrderedDict[str, _Ring]" = OrderedDict()
+        self._all = _Ring(settings.RECENT_GLOBAL)
+
+    @staticmethod
+    def enabled() -> bool:
+        return settings.RECENT_PER_NODE > 0 and not settings.MQTT_SHARED_GROUP and not partitions.enabled()
+
+    def _node_ring(self, node_id: str) -> _Ring:
+        ring = self._nodes.get(node_id)
+        if ring is None:
+            ring = self._nodes[node_id] = _Ring(settings.RECENT_PER_NODE)
+            while len(self._nodes) > max(1, settings.RECENT_MAX_NODES):
+                self._nodes.popitem(last=False)
+        else:
+            self._nodes.move_to_end(node_id)
+        return ring
+
+    def warm(self, conn: Connection) -> None:
+        """Últimas RECENT_PER_NODE leituras dos RECENT_MAX_NODES nós mais recentes e RECENT_GLOBAL no total."""
+        if not self.enabled():
+            return
+        t = models.Reading.__table__
+        cols = [t.c[c] for c in COLUMNS]
+        recent_nodes = (
+            select(t.c.node_id).group_by(t.c.node_id)
+            .order_by(func.max(t.c.id).desc()).limit(max(1, settings.RECENT_MAX_NODES))
+        )
+        nodes: "OrderedDict[str, _Ring]" = OrderedDict()
+        # Do menos para o mais recente: a ordem do LRU
+        for node_id in reversed(conn.execute(recent_nodes).scalars().all()):
+            q = select(*cols).where(t.c.node_id == node_id).order_by(t.c.id.desc()).limit(settings.RECENT_PER_NODE)
+            ring = nodes[node_id] = _Ring(settings.RECENT_PER_NODE)
+            for r in reversed(conn.execute(q).all()):
+                ring.append(tuple(r))
+        everything = _Ring(settings.RECENT_GLOBAL)
+        for r in reversed(conn.execute(select(*cols).order_by(t.c.id.desc()).limit(settings.RECENT_GLOBAL)).all()):
+            everything.append(tuple(r))
+        with self._lock:
+            self._nodes = nodes
+            self._all = everything
+
+    def record(self, rows: list[dict], ids: list[int]) -> None:
+        if not rows or not self.enabled():
+            return
+        items = [
+            (rid, row["node_id"], row["timestamp"], row.get("temperature_c"), row.get("humidity_pct"),
+             row.get("soil_moisture_pct"), row.get("motion"))
+            for rid, row in zip(ids, rows)
+        ]
+        with self._lock:
+            for t in items:
+                self._all.append(t)
+                self._node_ring(t[_NODE]).append(t)
+
+    def latest(self, limit: int, node_id: Optional[str] = None) -> Optional[list[dict]]:
+        """Mesma resposta de readings.latest() sem intervalo, ou None (consultar o banco)."""
+        if not self.enabled():
+            return None
+        with self._lock:
+            ring = self._nodes.get(node_id) if node_id else self._all
+            if ring is None or ring.count < limit:
+                return None
+            items = ring.last(limit)
+        # Com mais de um gravador os commits podem chegar fora de ordem
+        items.sort(key=lambda t: t[_ID])
+        return [_as_row(t) for t in items]
+
+    def replay(self, n: int) -> list[dict]:
+        """Últimas `n` leituras no formato do broadcast WebSocket."""
+        if n <= 0 or not self.enabled():
+            return []
+        with self._lock:
+            items = self._all.last(n)
+        items.sort(key=lambda t: t[_ID])
+        out = []
+        for t in items:
+            row = _as_row(t)
+            row["timestamp"] = row["timestamp"].isoformat()
+            out.append(row)
+        return out
+
+    def drop_before(self, cutoff: datetime) -> None:
+        with self._lock:
+            keep = lambda t: t[_TS] >= cutoff  # noqa: E731
+            self._all.retain(keep)
+            for node_id, ring in list(self._nodes.items()):
+                ring.retain(keep)
+                if not ring.count:
+                    del self._nodes[node_id]
+
+
+recent_readings = RecentReadings()
@@ -0,0 +1,154 @@
+"""
+Serviço de retenção: move leituras antigas para o arquivo frio (services/archive.py).
+
+Política: leituras com timestamp anterior a RETENTION_RAW_DAYS dias (alinhado
+ao início do dia, UTC) viram segmentos comprimidos por nó/dia e saem da base.
+
+Para não travar a ingestão:
+- leituras e gravação dos segmentos acontecem fora de transações de escrita;
+- as remoções são feitas em blocos pequenos (RETENTION_DELETE_CHUNK linhas),
+  cada um na sua transação curta, com pausa entre blocos;
+- partições inteiras antigas (STORAGE_PARTITIONING) são removidas com DROP TABLE.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.engine import Engine
+
+from ..core.config import settings
+from ..db import partitions
+from . import archive
+from .recent import recent_readings
+from .stats import pipeline_stats
+
+_ROW_COLS = (
+    "id", "node_id", "timestamp", "temperature_c", "humidity_pct", "soil_moisture_pct", "motion",
+    "msg_id", "raw_json", "raw_extra",
+)
+
+
+class RetentionService:
+    def __init__(self, engine: Engine, read_engine: Optional[Engine] = None) -> None:
+        self.engine = engine  # escritas (DELETE/DROP)
+        self.read_engine = read_engine or engine
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    # ---------- ciclo ----------
+    def cutoff(self, now: Optional[datetime] = None) -> datetime:
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        day = (now - timedelta(days=settings.RETENTION_RAW_DAYS)).date()
+        return datetime.combine(day, datetime.min.time())
+
+    def run_once(self, now: Optional[datetime] = None) -> dict:
+        """Arquiva e remove tudo que é anterior ao corte. Retorna um resumo."""
+        cutoff = self.cutoff(now)
+        stats = {"cutoff": cutoff.isoformat(), "archived": 0, "deleted": 0, "dropped": []}
+        # Horizonte primeiro: durante a migração a linha pode estar nos dois
+        # lugares (as consultas deduplicam por id), mas nunca em nenhum.
+        archive.set_horizon(cutoff)
+
+        with self.read_engine.connect() as conn:
+            parts = partitions.partitions_for_range(conn, None, cutoff - timedelta(microseconds=1))
+        for p in parts:
+            if self._stop.is_set():
+                break
+            if p.start is not None and p.end <= cutoff:
+                archived = self._archive_whole(p.table)
+                stats["archived"] += archived
+                if partitions.drop_partition(self.engine, p.start.date()):
+                    stats["dropped"].append(p.name)
+                    pipeline_stats.record_removed(archived)
+            else:
+                archived, deleted = self._archive_and_delete(p.table, cutoff)
+                stats["archived"] += archived
+                stats["deleted"] += deleted
+        if stats["deleted"] or stats["dropped"]:
+            recent_readings.drop_before(cutoff)
+        return stats
+
+    def _read_group(self, table, node_id: str, start: datetime, end: datetime) -> list[dict]:
+        q = (
+            select(*(table.c[c] for c in _ROW_COLS))
+            .where(table.c.node_id == node_id, table.c.timestamp >= start, table.c.timestamp < end)
+            .order_by(table.c.timestamp, table.c.id)
+        )
+        with self.read_engine.connect() as conn:
+            return [dict(r._mapping) for r in conn.execute(q)]
+
+    def _write_days(self, node_id: str, rows: list[dict]) -> None:
+        by_day: dict = {}
+        for r in rows:
+            by_day.setdefault(r["timestamp"].date(), []).append(r)
+        for day, day_rows in by_day.items():
+            archive.write_segment(node_id, day, day_rows)
+
+    def _archive_whole(self, table) -> int:
+        """Partição inteira antiga: arquiva nó a nó (a remoção é o DROP TABLE)."""
+        with self.read_engine.connect() as conn:
+            nodes = [r[0] for r in conn.execute(select(table.c.node_id).distinct())]
+        total = 0
+        for node_id in nodes:
+            rows = self._read_group(table, node_id, datetime.min, datetime.max)
+            self._write_days(node_id, rows)
+            total += len(rows)
+        return total
+
+    def _archive_and_delete(self, table, cutoff: datetime) -> tuple[int, int]:
+        archived = deleted = 0
+        while not self._stop.is_set():
+            with self.read_engine.connect() as conn:
+                first = conn.execute(
+                    select(table.c.node_id, table.c.timestamp)
+                    .where(table.c.timestamp < cutoff)
+                    .order_by(table.c.timestamp)
+                    .limit(1)
+                ).first()
+            if first is None:
+                break
+            node_id = first.node_id
+            start = datetime.combine(first.timestamp.date(), datetime.min.time())
+            rows = self._read_group(table, node_id, start, min(start + timedelta(days=1), cutoff))
+            self._write_days(node_id, rows)
+            archived += len(rows)
+            deleted += self._delete_ids(table, [r["id"] for r in rows])
+        return archived, deleted
+
+    def _delete_ids(self, table, ids: list[int]) -> int:
+        chunk = max(1, settings.RETENTION_DELETE_CHUNK)
+        pause = settings.RETENTION_PAUSE_MS / 1000.0
+        n = 0
+        for i in range(0, len(ids), chunk):
+            # Transação curta por bloco: a ingestão intercala seus commits
+            with self.engine.begin() as conn:
+                removed = conn.execute(delete(table).where(table.c.id.in_(ids[i:i + chunk]))).rowcount or 0
+            pipeline_stats.record_removed(removed)
+            n += removed
+            if pause:
+                time.sleep(pause)
+        return n
+
+    # ---------- thread ----------
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                stats = self.run_once()
+                if stats["archived"] or stats["dropped"]:
+                    print("[RETENTION]", stats)
+            except Exception as e:
+                print("[RETENTION] Falhou:", e)
+            self._stop.wait(settings.RETENTION_INTERVAL_SEC)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
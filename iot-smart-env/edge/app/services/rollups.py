@@ -0,0 +1,232 @@
+"""
+Agregados por nó em 1 minuto e 1 hora (reading_rollups_1m / reading_rollups_1h).
+
+- accumulate(): agrega um lote de leituras normalizadas em memória
+- apply(): aplica o lote com UPSERT (ON CONFLICT DO UPDATE), na mesma
+  transação do INSERT das leituras
+- query(): responde /readings/aggregate (1m, 1h e 1d = soma dos buckets de 1h)
+- backfill(): preenche as tabelas a partir de readings (uma vez, em bancos antigos)
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import bindparam, case, func, select, text
+from sqlalchemy.engine import Connection
+
+from ..db import models
+
+METRICS = ("temperature_c", "humidity_pct", "soil_moisture_pct")
+
+TABLES = {
+    "1m": (models.ReadingRollup1m.__table__, 60),
+    "1h": (models.ReadingRollup1h.__table__, 3600),
+}
+
+
+def bucket_start(ts: datetime, seconds: int) -> datetime:
+    if seconds == 60:
+        return ts.replace(second=0, microsecond=0)
+    if seconds == 3600:
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _new_agg(node_id: str, start: datetime) -> dict:
+    agg = {"node_id": node_id, "bucket_start": start, "count": 0, "last_ts": None,
+           "motion_samples": 0, "motion_count": 0}
+    for m in METRICS:
+        agg.update({f"{m}_count": 0, f"{m}_min": None, f"{m}_max": None, f"{m}_sum": 0.0, f"{m}_last": None})
+    return agg
+
+
+def _add(agg: dict, row: dict) -> None:
+    ts = row["timestamp"]
+    newest = agg["last_ts"] is None or ts >= agg["last_ts"]
+    agg["count"] += 1
+    if newest:
+        agg["last_ts"] = ts
+    for m in METRICS:
+        v = row.get(m)
+        if v is None:
+            continue
+        agg[f"{m}_count"] += 1
+        agg[f"{m}_sum"] += v
+        lo, hi = agg[f"{m}_min"], agg[f"{m}_max"]
+        agg[f"{m}_min"] = v if lo is None or v < lo else lo
+        agg[f"{m}_max"] = v if hi is None or v > hi else hi
+        if newest or agg[f"{m}_last"] is None:
+            agg[f"{m}_last"] = v
+    motion = row.get("motion")
+    if motion is not None:
+        agg["motion_samples"] += 1
+        agg["motion_count"] += int(bool(motion))
+
+
+def accumulate(rows: Iterable[dict]) -> dict[str, list[dict]]:
+    """Agrupa leituras normalizadas por (nó, bucket) para cada resolução."""
+    out: dict[str, dict[tuple, dict]] = {name: {} for name in TABLES}
+    for row in rows:
+        for name, (_, seconds) in TABLES.items():
+            start = bucket_start(row["timestamp"], seconds)
+            key = (row["node_id"], start)
+            agg = out[name].get(key)
+            if agg is None:
+                agg = out[name][key] = _new_agg(row["node_id"], start)
+            _add(agg, row)
+    return {name: list(aggs.values()) for name, aggs in out.items()}
+
+
+_STMTS: dict[tuple[str, str], object] = {}
+
+
+def _upsert_stmt(conn: Connection, table):
+    """
+    O INSERT ... ON CONFLICT do SQLAlchemy não entra no cache de compilação;
+    compilamos uma vez por dialeto/tabela e reutilizamos como text() tipado.
+    """
+    key = (conn.dialect.name, table.name)
+    if key not in _STMTS:
+        stmt = _build_upsert(conn.dialect.name, table)
+        if stmt is None:
+            _STMTS[key] = None
+        else:
+            named = type(conn.dialect)(paramstyle="named")
+            _STMTS[key] = text(stmt.compile(dialect=named).string).bindparams(
+                *(bindparam(c.key, type_=c.type) for c in table.c)
+            )
+    return _STMTS[key]
+
+
+def _build_upsert(dialect: str, table):
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+
+    stmt = dialect_insert(table)
+    cur, new = table.c, stmt.excluded
+    newest = (cur.last_ts.is_(None)) | (new.last_ts >= cur.last_ts)
+    values = {
+        "count": cur.count + new.count,
+        "last_ts": case((newest, new.last_ts), else_=cur.last_ts),
+        "motion_samples": cur.motion_samples + new.motion_samples,
+        "motion_count": cur.motion_count + new.motion_count,
+    }
+    for m in METRICS:
+        c_min, n_min = cur[f"{m}_min"], new[f"{m}_min"]
+        c_max, n_max = cur[f"{m}_max"], new[f"{m}_max"]
+        c_last, n_last = cur[f"{m}_last"], new[f"{m}_last"]
+        values[f"{m}_count"] = cur[f"{m}_count"] + new[f"{m}_count"]
+        values[f"{m}_sum"] = cur[f"{m}_sum"] + new[f"{m}_sum"]
+        values[f"{m}_min"] = case((n_min.is_(None), c_min), (c_min.is_(None) | (n_min < c_min), n_min), else_=c_min)
+        values[f"{m}_max"] = case((n_max.is_(None), c_max), (c_max.is_(None) | (n_max > c_max), n_max), else_=c_max)
+        values[f"{m}_last"] = case((n_last.is_(None), c_last), (newest | c_last.is_(None), n_last), else_=c_last)
+    return stmt.on_conflict_do_update(index_elements=[cur.node_id, cur.bucket_start], set_=values)
+
+
+def apply(conn: Connection, rows: list[dict]) -> None:
+    """Aplica um lote de leituras normalizadas nas tabelas de agregados."""
+    if not rows:
+        return
+    for name, aggs in accumulate(rows).items():
+        stmt = _upsert_stmt(conn, TABLES[name][0])
+        if stmt is None:
+            return  # dialeto sem UPSERT suportado: agregados desativados
+        conn.execute(stmt, aggs)
+
+
+def backfill(conn: Connection, chunk: int = 5000) -> int:
+    """Recalcula os agregados a partir de readings, se ainda estiverem vazios."""
+    if conn.execute(select(func.count()).select_from(models.ReadingRollup1h.__table__)).scalar_one():
+        return 0
+    t = models.Reading.__table__
+    cols = [t.c.id, t.c.node_id, t.c.timestamp, t.c.motion, *(t.c[m] for m in METRICS)]
+    last_id, total = 0, 0
+    while True:
+        batch = [dict(r._mapping) for r in conn.execute(
+            select(*cols).where(t.c.id > last_id).order_by(t.c.id).limit(chunk)
+        )]
+        if not batch:
+            return total
+        apply(conn, batch)
+        last_id = batch[-1]["id"]
+        total += len(batch)
+
+
+def _merge(dst: dict, src: dict) -> None:
+    newest = dst["last_ts"] is None or (src["last_ts"] is not None and src["last_ts"] >= dst["last_ts"])
+    dst["count"] += src["count"]
+    dst["motion_samples"] += src["motion_samples"]
+    dst["motion_count"] += src["motion_count"]
+    for m in METRICS:
+        dst[f"{m}_count"] += src[f"{m}_count"]
+        dst[f"{m}_sum"] += src[f"{m}_sum"]
+        for k, better in ((f"{m}_min", min), (f"{m}_max", max)):
+            vals = [v for v in (dst[k], src[k]) if v is not None]
+            dst[k] = better(vals) if vals else None
+        if src[f"{m}_last"] is not None and (newest or dst[f"{m}_last"] is None):
+            dst[f"{m}_last"] = src[f"{m}_last"]
+    if newest:
+        dst["last_ts"] = src["last_ts"]
+
+
+def _to_out(row: dict) -> dict:
+    metrics = {}
+    for m in METRICS:
+        n = row[f"{m}_count"]
+        if n:
+            metrics[m] = {
+                "count": n,
+                "min": row[f"{m}_min"],
+                "max": row[f"{m}_max"],
+                "avg": row[f"{m}_sum"] / n,
+                "last": row[f"{m}_last"],
+            }
+    return {
+        "node_id": row["node_id"],
+        "bucket_start": row["bucket_start"],
+        "count": row["count"],
+        "metrics": metrics,
+        "motion_samples": row["motion_samples"],
+        "motion_count": row["motion_count"],
+    }
+
+
+def query(
+    conn: Connection,
+    bucket: str,
+    node_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = 1000,
+) -> list[dict]:
+    """Lê agregados em ordem (nó, início do bucket). 1d é montado a partir de 1h."""
+    table = TABLES["1h" if bucket == "1d" else bucket][0]
+    q = select(table)
+    if node_id:
+        q = q.where(table.c.node_id == node_id)
+    if since:
+        q = q.where(table.c.bucket_start >= bucket_start(since, 86400 if bucket == "1d" else TABLES[bucket][1]))
+    if until:
+        q = q.where(table.c.bucket_start <= until)
+    q = q.order_by(table.c.node_id, table.c.bucket_start)
+    if bucket != "1d":
+        return [_to_out(dict(r._mapping)) for r in conn.execute(q.limit(limit))]
+
+    days: dict[tuple, dict] = {}
+    for r in conn.execute(q):
+        row = dict(r._mapping)
+        key = (row["node_id"], bucket_start(row["bucket_start"], 86400))
+        if key not in days:
+            if len(days) >= limit:
+                break
+            days[key] = dict(row, bucket_start=key[1])
+        else:
+            _merge(days[key], row)
+    return [_to_out(d) for d in days.values()]
+
@@ -1,13 +1,35 @@
 """
 Motor simples de regras:
 - Suporta regra de limiar (metric operator value)
-- Ações: "notify" (logar) e "irrigation_on" (simulada: loga ação + params)
+- Regras com janela: aggregate(metric) operator value, com aggregate em
+  avg/min/max/rate (variação por minuto) sobre os últimos `window_sec`
+  segundos (pelo timestamp da leitura) ou as últimas `window_samples`
+  amostras, por nó. Só disparam com a janela completa (ver _Window).
+- Ações: "notify" (logar; e webhook em NOTIFY_WEBHOOK_URL, se configurado),
+  "irrigation_on" (simulada: loga ação + params) e "webhook" (POST para
+  action_params.url). evaluate_rules() só monta os eventos: gravação do
+  ActionLog e entregas HTTP ficam com o despachante (services/actions.py).
+- Regras ativas ficam compiladas em memória (RuleCache): um índice por métrica
+  com limiares ordenados por operador, consultado com bisect. O banco só é
+  acessado quando uma regra dispara (ou após invalidação do cache).
+- Janelas mantidas incrementalmente em memória (RuleWindows): soma corrente
+  e deques monotônicas para min/max, custo O(1) amortizado por leitura,
+  qualquer que seja o tamanho da janela. Começam vazias na subida.
 """
 
 from __future__ import annotations
-from typing import Callable
-from sqlalchemy.orm import Session
+import math
+import threading
+from bisect import bisect_left, bisect_right
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Optional
+from ..core.config import settings
+from ..db.db import ReadSessionLocal
 from ..db import models
+from .actions import ActionEvent
+from .metrics import actions_fired
 
 
 _OPERATORS: dict[str, Callable[[float, float], bool]] = {
@@ -30,51 +52,397 @@ def _get_metric_value(reading: models.Reading, metric: str) -> float | None:
     return None
 
 
-def _log_action(s: Session, rule: models.Rule, reading: models.Reading, action: str, payload: dict | None = None):
-    log = models.ActionLog(
-        rule_id=rule.id if rule else None,
-        reading_id=reading.id if reading else None,
-        action=action,
-        payload=payload or {},
+@dataclass(frozen=True)
+class CompiledRule:
+    """Cópia imutável dos campos de models.Rule usados na avaliação/ações."""
+    id: int
+    name: str
+    metric: str
+    operator: str
+    value: float
+    action: str
+    action_params: dict | None
+    aggregate: str | None = None
+    window_sec: float | None = None
+    window_samples: int | None = None
+
+
+_AGGREGATES = ("avg", "min", "max", "rate")
+_EPOCH = datetime(1970, 1, 1)
+
+# Janela: (segundos, None) ou (None, amostras)
+WindowSpec = tuple[Optional[float], Optional[int]]
+
+
+def _window_spec(r) -> WindowSpec | None:
+    """Janela válida da regra, ou None (regra com janela malformada é ignorada)."""
+    sec, n = r.window_sec, r.window_samples
+    if (sec is None) == (n is None):
+        return None
+    if sec is not None:
+        return (float(sec), None) if float(sec) > 0 else None
+    min_n = 2 if r.aggregate == "rate" else 1
+    return (None, int(n)) if int(n) >= min_n else None
+
+
+class _Window:
+    """
+    Amostras de uma métrica de um nó dentro de uma janela.
+    - samples: (seq, ts, valor) em ordem de chegada; `total` = soma corrente;
+    - mins/maxs: deques monotônicas (seq, valor); a frente é o min/max atual.
+    Completa: N amostras (janela por contagem) ou, por duração, quando uma
+    amostra já descartada está a no máximo `window_sec` da primeira retida
+    (a janela cobre todo o intervalo, sem lacuna maior que ela mesma).
+    """
+
+    __slots__ = ("sec", "n", "samples", "mins", "maxs", "total", "seq", "evicted_ts")
+
+    def __init__(self, spec: WindowSpec) -> None:
+        self.sec, self.n = spec
+        self.samples: deque = deque()
+        self.mins: deque = deque()
+        self.maxs: deque = deque()
+        self.total = 0.0
+        self.seq = 0
+        self.evicted_ts: float | None = None
+
+    def add(self, ts: float, v: float) -> bool:
+        """Inclui a amostra; False se for atrasada (timestamp anterior à última)."""
+        samples = self.samples
+        if samples and ts < samples[-1][1]:
+            return False
+        self.seq += 1
+        seq = self.seq
+        samples.append((seq, ts, v))
+        self.total += v
+        mins, maxs = self.mins, self.maxs
+        while mins and mins[-1][1] >= v:
+            mins.pop()
+        mins.append((seq, v))
+        while maxs and maxs[-1][1] <= v:
+            maxs.pop()
+        maxs.append((seq, v))
+
+        limit = self.n if self.n is not None else max(1, settings.RULE_WINDOW_MAX_SAMPLES)
+        while len(samples) > limit:
+            self._evict()
+        if self.sec is not None:
+            start = ts - self.sec
+            while samples[0][1] < start:
+                self._evict()
+        return True
+
+    def _evict(self) -> None:
+        seq, ts, v = self.samples.popleft()
+        self.evicted_ts = ts
+        self.total -= v
+        if self.mins[0][0] <= seq:
+            self.mins.popleft()
+        if self.maxs[0][0] <= seq:
+            self.maxs.popleft()
+
+    def full(self) -> bool:
+        if self.n is not None:
+            return len(self.samples) >= self.n
+        return self.evicted_ts is not None and self.samples[0][1] - self.evicted_ts <= self.sec
+
+    def value(self, aggregate: str) -> float | None:
+        samples = self.samples
+        if aggregate == "avg":
+            return self.total / len(samples)
+        if aggregate == "min":
+            return self.mins[0][1]
+        if aggregate == "max":
+            return self.maxs[0][1]
+        # rate: variação por minuto entre a primeira e a última amostra da janela
+        first, last = samples[0], samples[-1]
+        dt = last[1] - first[1]
+        return (last[2] - first[2]) * 60.0 / dt if dt > 0 else None
+
+
+class RuleWindows:
+    """Janelas por (nó, métrica, janela), compartilhadas pelas regras iguais."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._windows: dict[tuple, _Window] = {}
+
+    def update(
+        self, node_id: str, metric: str, spec: WindowSpec, timestamp: datetime, v: float, aggregates: tuple[str, ...]
+    ) -> dict[str, float | None] | None:
+        """Inclui a amostra e retorna os agregados pedidos (None se incompleta/atrasada)."""
+        ts = (timestamp - _EPOCH).total_seconds()
+        key = (node_id, metric, spec)
+        with self._lock:
+            w = self._windows.get(key)
+            if w is None:
+                w = self._windows[key] = _Window(spec)
+            if not w.add(ts, v) or not w.full():
+                return None
+            return {a: w.value(a) for a in aggregates}
+
+    def retain(self, keys: set[tuple[str, WindowSpec]]) -> None:
+        """Descarta janelas de regras removidas/alteradas (chaves (métrica, janela))."""
+        with self._lock:
+            for key in [k for k in self._windows if (k[1], k[2]) not in keys]:
+                del self._windows[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._windows.clear()
+
+
+rule_windows = RuleWindows()
+
+
+@dataclass
+class _MetricIndex:
+    # Por operador: limiares ordenados + regras na mesma ordem
+    values: dict[str, list[float]] = field(default_factory=dict)
+    rules: dict[str, list[CompiledRule]] = field(default_factory=dict)
+    # "==" / "!=": busca direta por valor
+    eq: dict[float, list[CompiledRule]] = field(default_factory=dict)
+    ne: list[CompiledRule] = field(default_factory=list)
+
+    def match(self, v: float) -> list[CompiledRule]:
+        if math.isnan(v):
+            # NaN fica fora da ordem dos limiares (bisect): só "!=" é verdadeiro
+            return sorted(self.ne, key=lambda r: r.id)
+        out: list[CompiledRule] = []
+        # metric < value  <=> value > v
+        if "<" in self.values:
+            out += self.rules["<"][bisect_right(self.values["<"], v):]
+        # metric <= value <=> value >= v
+        if "<=" in self.values:
+            out += self.rules["<="][bisect_left(self.values["<="], v):]
+        # metric > value  <=> value < v
+        if ">" in self.values:
+            out += self.rules[">"][:bisect_left(self.values[">"], v)]
+        # metric >= value <=> value <= v
+        if ">=" in self.values:
+            out += self.rules[">="][:bisect_right(self.values[">="], v)]
+        out += self.eq.get(v, ())
+        out += [r for r in self.ne if r.value != v]
+        # Mantém a ordem de criação (id), como na consulta original
+        out.sort(key=lambda r: r.id)
+        return out
+
+
+@dataclass(frozen=True)
+class _WindowGroup:
+    spec: WindowSpec
+    aggregates: tuple[str, ...]
+    rules: list[CompiledRule]
+
+
+@dataclass(frozen=True)
+class _CompiledIndex:
+    version: int
+    metrics: dict[str, _MetricIndex]
+    # Regras com janela por métrica, agrupadas por janela
+    windows: dict[str, list[_WindowGroup]] = field(default_factory=dict)
+
+    def window_keys(self) -> set[tuple[str, WindowSpec]]:
+        return {(metric, g.spec) for metric, groups in self.windows.items() for g in groups}
+
+
+def _compile(version: int, rules: list[models.Rule]) -> _CompiledIndex:
+    by_metric: dict[str, dict[str, list[CompiledRule]]] = {}
+    by_window: dict[str, dict[WindowSpec, list[CompiledRule]]] = {}
+    for r in rules:
+        if r.operator not in _OPERATORS:
+            continue
+        try:
+            value = float(r.value)
+        except (TypeError, ValueError):
+            continue
+        aggregate = r.aggregate
+        if aggregate is not None:
+            if aggregate not in _AGGREGATES:
+                continue
+            try:
+                spec = _window_spec(r)
+            except (TypeError, ValueError):
+                continue
+            if spec is None:
+                continue
+            cr = CompiledRule(
+                id=r.id, name=r.name, metric=r.metric, operator=r.operator,
+                value=value, action=r.action, action_params=dict(r.action_params or {}),
+                aggregate=aggregate, window_sec=spec[0], window_samples=spec[1],
+            )
+            by_window.setdefault(r.metric, {}).setdefault(spec, []).append(cr)
+            continue
+        cr = CompiledRule(
+            id=r.id, name=r.name, metric=r.metric, operator=r.operator,
+            value=value, action=r.action, action_params=dict(r.action_params or {}),
+        )
+        by_metric.setdefault(r.metric, {}).setdefault(r.operator, []).append(cr)
+
+    metrics: dict[str, _MetricIndex] = {}
+    for metric, by_op in by_metric.items():
+        idx = _MetricIndex()
+        for op, lst in by_op.items():
+            if op == "==":
+                for cr in lst:
+                    idx.eq.setdefault(cr.value, []).append(cr)
+            elif op == "!=":
+                idx.ne = lst
+            else:
+                lst.sort(key=lambda cr: (cr.value, cr.id))
+                idx.values[op] = [cr.value for cr in lst]
+                idx.rules[op] = lst
+        metrics[metric] = idx
+    windows = {
+        metric: [
+            _WindowGroup(spec, tuple(sorted({cr.aggregate for cr in lst})), sorted(lst, key=lambda cr: cr.id))
+            for spec, lst in by_spec.items()
+        ]
+        for metric, by_spec in by_window.items()
+    }
+    return _CompiledIndex(version=version, metrics=metrics, windows=windows)
+
+
+class RuleCache:
+    """
+    Cache das regras ativas compiladas.
+    - invalidate(): incrementa a versão (chamado pelas rotas /rules após commit)
+    - get(): recompila sob demanda se a versão mudou; a troca do índice é atômica
+      (uma atribuição), então leitores nunca veem um índice parcial.
+    - peek(): só o índice já compilado (quem não pode fazer I/O, ex.: event loop).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._version = 0
+        self._index: _CompiledIndex | None = None
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def invalidate(self) -> int:
+        with self._lock:
+            self._version += 1
+            return self._version
+
+    def peek(self) -> _CompiledIndex | None:
+        """Índice atual sem tocar no banco; None se precisa recompilar (modo asyncio)."""
+        idx = self._index
+        return idx if idx is not None and idx.version == self._version else None
+
+    def get(self) -> _CompiledIndex:
+        idx = self.peek()
+        if idx is not None:
+            return idx
+        version = self._version
+        with ReadSessionLocal() as s:
+            rules = s.query(models.Rule).filter(models.Rule.enabled == True).all()  # noqa: E712
+        built = _compile(version, rules)
+        with self._lock:
+            # Se houve invalidação durante a carga, não instala um índice já velho
+            if self._version == version:
+                self._index = built
+                rule_windows.retain(built.window_keys())
+        return built
+
+    def match(self, metric: str, value: float) -> list[CompiledRule]:
+        idx = self.get().metrics.get(metric)
+        return idx.match(value) if idx else []
+
+
+rule_cache = RuleCache()
+
+
+def _event(rule: CompiledRule, reading: models.Reading, action: str, payload: dict, url: str | None = None):
+    return ActionEvent(
+        action=action, payload=payload, rule_id=rule.id, rule_name=rule.name,
+        reading_id=reading.id, node_id=reading.node_id, url=url or None,
     )
-    s.add(log)
-    s.commit()
 
 
-def _do_notify(s: Session, rule: models.Rule, reading: models.Reading):
-    _log_action(s, rule, reading, action="notify", payload={"msg": f"Rule '{rule.name}' matched"})
+def _do_notify(rule: CompiledRule, reading: models.Reading) -> ActionEvent:
+    return _event(rule, reading, "notify", {"msg": f"Rule '{rule.name}' matched"}, settings.NOTIFY_WEBHOOK_URL)
 
 
-def _do_irrigation_on(s: Session, rule: models.Rule, reading: models.Reading):
+def _do_irrigation_on(rule: CompiledRule, reading: models.Reading) -> ActionEvent:
     duration =  int((rule.action_params or {}).get("duration_sec", 15))
     zone =       (rule.action_params or {}).get("zone", "A")
-    _log_action(
-        s, rule, reading,
-        action="irrigation_on",
-        payload={"duration_sec": duration, "zone": zone, "node_id": reading.node_id}
+    return _event(
+        rule, reading, "irrigation_on",
+        {"duration_sec": duration, "zone": zone, "node_id": reading.node_id},
     )
 
 
+def _do_webhook(rule: CompiledRule, reading: models.Reading) -> ActionEvent:
+    params = rule.action_params or {}
+    payload = {
+        "node_id": reading.node_id,
+        "metric": rule.metric,
+        "timestamp": reading.timestamp.isoformat() if reading.timestamp else None,
+        "value": _get_metric_value(reading, rule.metric),
+    }
+    return _event(rule, reading, "webhook", payload, params["url"])
+
+
 _ACTIONS = {
     "notify": _do_notify,
     "irrigation_on": _do_irrigation_on,
+    "webhook": _do_webhook,
 }
 
 
-def evaluate_rules(s: Session, reading: models.Reading):
-    rules = s.query(models.Rule).filter(models.Rule.enabled == True).all()  # noqa: E712
-    for rule in rules:
-        metric_val = _get_metric_value(reading, rule.metric)
-        if metric_val is None:
+_METRICS = ("temperature_c", "humidity_pct", "soil_moisture_pct")
+
+
+def _window_matches(idx: _CompiledIndex, metric: str, reading: models.Reading, v: float) -> list[CompiledRule]:
+    out: list[CompiledRule] = []
+    for group in idx.windows.get(metric, ()):
+        values = rule_windows.update(reading.node_id, metric, group.spec, reading.timestamp, v, group.aggregates)
+        if values is None:
             continue
-        op = _OPERATORS.get(rule.operator)
-        if not op:
+        for rule in group.rules:
+            agg = values[rule.aggregate]
+            if agg is not None and _OPERATORS[rule.operator](agg, rule.value):
+                out.append(rule)
+    return out
+
+
+def _fire(rule: CompiledRule, reading: models.Reading, fired: list[ActionEvent]) -> None:
+    action_fn = _ACTIONS.get(rule.action)
+    if not action_fn:
+        return
+    try:
+        fired.append(action_fn(rule, reading))
+        actions_fired.labels(rule.action).inc()
+    except Exception as e:
+        # Não derruba o pipeline por causa de uma regra malformada
+        print(f"[RULES] Ação da regra '{rule.name}' inválida:", e)
+
+
+def evaluate_rules(reading: models.Reading, idx: _CompiledIndex | None = None) -> list[ActionEvent]:
+    """
+    Avalia as regras ativas (`idx` ou, sem ele, rule_cache) contra a leitura e
+    atualiza as janelas das regras que as usam. Não grava nada: retorna as
+    ações disparadas para o despachante (services/actions.py).
+    """
+    fired: list[ActionEvent] = []
+    if idx is None:
+        idx = rule_cache.get()
+    for metric in _METRICS:
+        metric_idx = idx.metrics.get(metric)
+        has_windows = metric in idx.windows
+        if metric_idx is None and not has_windows:
             continue
-        try:
-            if op(float(metric_val), float(rule.value)):
-                action_fn = _ACTIONS.get(rule.action)
-                if action_fn:
-                    action_fn(s, rule, reading)
-        except Exception:
-            # Não derruba o pipeline por causa de uma regra malformada
-            pass
+        metric_val = _get_metric_value(reading, metric)
+        if metric_val is None:
+            continue
+        v = float(metric_val)
+        if metric_idx is not None:
+            for rule in metric_idx.match(v):
+                _fire(rule, reading, fired)
+        if has_windows and not math.isnan(v):
+            # Leitura NaN (sensor com defeito) não entra nos agregados da janela
+            for rule in _window_matches(idx, metric, reading, v):
+                _fire(rule, reading, fired)
+    return fired
@@ -0,0 +1,111 @@
+"""
+Contadores do pipeline de ingestão, mantidos em memória para o /health.
+
+- seed(): carrega uma vez (na subida) o total de leituras, os nós e o
+  timestamp mais recente a partir do banco;
+- record_ingest(): chamado após cada commit de ingestão (lote);
+- record_removed(): leituras que saíram da base (retenção, DROP de partição);
+- record_lag(): atraso entre a chegada da mensagem e o commit;
+- register_queue(): profundidade (e descartes) das filas do pipeline.
+
+snapshot() é O(1) (não consulta o banco).
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from sqlalchemy.engine import Connection
+
+
+class PipelineStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.seeded = False
+        self.total = 0
+        self.nodes: set[str] = set()
+        self.last_ingest_at: Optional[datetime] = None
+        self.last_reading_ts: Optional[datetime] = None
+        self.last_lag_ms: Optional[float] = None
+        self._queues: dict[str, Callable[[], int]] = {}
+        self._dropped: dict[str, Callable[[], int]] = {}
+
+    def seed(self, conn: Connection) -> None:
+        """Estado inicial a partir do banco (varredura única, na subida)."""
+        from . import readings as readings_q
+
+        total = readings_q.counts(conn)[0]
+        nodes = readings_q.node_ids(conn)
+        last_ts = readings_q.max_timestamp(conn)
+        with self._lock:
+            self.total = total
+            self.nodes = nodes
+            self.last_reading_ts = last_ts
+            self.seeded = True
+
+    def record_ingest(self, rows: list[dict]) -> None:
+        if not rows:
+            return
+        newest = max(r["timestamp"] for r in rows)
+        with self._lock:
+            self.total += len(rows)
+            self.nodes.update(r["node_id"] for r in rows)
+            self.last_ingest_at = datetime.now(timezone.utc).replace(tzinfo=None)
+            if self.last_reading_ts is None or newest > self.last_reading_ts:
+                self.last_reading_ts = newest
+
+    def record_removed(self, n: int) -> None:
+        with self._lock:
+            self.total = max(0, self.total - n)
+
+    def record_lag(self, received_monotonic: float) -> None:
+        """`received_monotonic`: time.monotonic() da chegada da mensagem mais antiga do lote."""
+        self.last_lag_ms = (time.monotonic() - received_monotonic) * 1000.0
+
+    def register_queue(
+        self, name: str, depth: Callable[[], int], dropped: Optional[Callable[[], int]] = None
+    ) -> None:
+        self._queues[name] = depth
+        if dropped is not None:
+            self._dropped[name] = dropped
+
+    def unregister_queue(self, name: str) -> None:
+        self._queues.pop(name, None)
+        self._dropped.pop(name, None)
+
+    def snapshot(self) -> dict:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        with self._lock:
+            out = {
+                "readings": self.total,
+                "nodes": len(self.nodes),
+                "last_ingest_at": self.last_ingest_at.isoformat() if self.last_ingest_at else None,
+                "seconds_since_last_ingest": (
+                    round((now - self.last_ingest_at).total_seconds(), 3) if self.last_ingest_at else None
+                ),
+                "last_reading_ts": self.last_reading_ts.isoformat() if self.last_reading_ts else None,
+                "ingest_lag_ms": round(self.last_lag_ms, 3) if self.last_lag_ms is not None else None,
+            }
+        out["queue_depth"], out["dropped"] = self.snapshot_queues()
+        return out
+
+    def snapshot_queues(self) -> tuple[dict, dict]:
+        """(profundidade, descartes) de cada fila registrada."""
+        return self._poll(self._queues), self._poll(self._dropped)
+
+    @staticmethod
+    def _poll(sources: dict[str, Callable[[], int]]) -> dict:
+        values = {}
+        for name, fn in list(sources.items()):
+            try:
+                values[name] = int(fn())
+            except Exception:
+                values[name] = None
+        return values
+
+
+# Instância única usada pela ingestão, retenção e /health
+pipeline_stats = PipelineStats()
@@ -0,0 +1,12 @@
+"""
+Configuração comum dos testes: usa um SQLite temporário para não alterar
+o edge_readings.db do projeto.
+"""
+
+import os
+import tempfile
+
+os.environ.setdefault(
+    "DB_URL",
+    "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="edge-tests-"), "edge_test.db"),
+)
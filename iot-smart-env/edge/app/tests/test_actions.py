@@ -0,0 +1,126 @@
+"""
+Testes do despachante de ações (services/actions.py) contra um servidor HTTP
+local: lotes por requisição com keep-alive, retry com backoff, erro
+permanente e retomada do outbox.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.db import models
+from app.db.db import SessionLocal, engine
+from app.main import app
+from app.services.actions import ActionEvent, action_dispatcher
+from app.services.ingest import process_incoming_batch
+
+client = TestClient(app)
+ADMIN = {"X-Admin-Token": settings.ADMIN_TOKEN}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        srv = self.server
+        with srv.lock:
+            srv.requests.append((self.path, self.client_address[1], body["events"]))
+            script = srv.script.get(self.path, [])
+            status = script.pop(0) if script else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(settings, "ACTIONS_RETRY_BASE_SEC", 0.01)
+    monkeypatch.setattr(settings, "ACTIONS_BATCH_LINGER_MS", 20)
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    srv.lock = threading.Lock()
+    srv.requests = []
+    srv.script = {}
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    srv.url = f"http://127.0.0.1:{srv.server_address[1]}"
+    yield srv
+    action_dispatcher.stop()
+    srv.shutdown()
+    srv.server_close()
+
+
+def _outbox(url: str) -> list:
+    t = models.ActionOutbox.__table__
+    with engine.connect() as conn:
+        return conn.execute(select(t).where(t.c.url == url)).all()
+
+
+def test_webhook_rule_is_batched_over_keepalive_connections(server):
+    url = server.url + "/hook"
+    r = client.post("/rules", headers=ADMIN, json={
+        "name": "hook-hot", "metric": "temperature_c", "operator": ">", "value": 1000,
+        "action": "webhook", "action_params": {"url": url},
+    })
+    assert r.status_code == 200
+    action_dispatcher.start()
+    try:
+        process_incoming_batch([
+            {"node_id": "hook-node", "temperature_c": 2000.0 + i, "timestamp": f"2035-01-01T00:00:{i:02d}Z"}
+            for i in range(20)
+        ])
+        assert action_dispatcher.flush(10)
+    finally:
+        client.delete(f"/rules/{r.json()['id']}", headers=ADMIN)
+
+    events = [e for _, _, batch in server.requests for e in batch]
+    assert sorted(e["data"]["value"] for e in events) == [2000.0 + i for i in range(20)]
+    assert all(e["rule"] == "hook-hot" and e["node_id"] == "hook-node" for e in events)
+    # Lotes por requisição, no máximo ACTIONS_HTTP_PER_ENDPOINT conexões
+    assert len(server.requests) < 20
+    assert len({port for _, port, _ in server.requests}) <= settings.ACTIONS_HTTP_PER_ENDPOINT
+    assert _outbox(url) == []
+    with SessionLocal() as s:
+        logs = s.query(models.ActionLog).filter(models.ActionLog.action == "webhook").all()
+    assert sum(1 for log in logs if log.payload["node_id"] == "hook-node") == 20
+
+
+def test_outbox_survives_restart_with_retry_and_permanent_errors(server):
+    flaky, gone = server.url + "/flaky", server.url + "/gone"
+    server.script = {"/flaky": [503, 503], "/gone": [404]}
+    # Sem despachante: grava na hora e a entrega espera no outbox
+    action_dispatcher.dispatch([
+        ActionEvent(action="webhook", payload={"n": 1}, url=flaky),
+        ActionEvent(action="webhook", payload={"n": 2}, url=gone),
+    ])
+    assert len(_outbox(flaky)) == 1 and server.requests == []
+
+    action_dispatcher.start()
+    assert action_dispatcher.flush(10)
+    assert [path for path, _, _ in server.requests].count("/flaky") == 3
+    assert _outbox(flaky) == []
+    (dead,) = _outbox(gone)
+    assert dead.attempts == 1 and dead.next_attempt_at is None and dead.last_error == "HTTP 404"
+
+
+def test_bad_action_log_row_is_isolated_and_dropped(server, monkeypatch):
+    monkeypatch.setattr(settings, "ACTIONS_RETRY_MAX_ATTEMPTS", 2)
+    action_dispatcher.start()
+    # payload não serializável em JSON: a linha nunca grava
+    events = [ActionEvent(action="isolate", payload={"n": i}) for i in range(5)]
+    events.insert(2, ActionEvent(action="isolate", payload={"bad": object()}))
+    action_dispatcher.dispatch(events)
+    assert action_dispatcher.flush(10)
+    action_dispatcher.dispatch([ActionEvent(action="isolate", payload={"n": 5})])
+    assert action_dispatcher.flush(10)
+
+    with SessionLocal() as s:
+        logs = s.query(models.ActionLog).filter(models.ActionLog.action == "isolate").all()
+    assert sorted(log.payload["n"] for log in logs) == [0, 1, 2, 3, 4, 5]
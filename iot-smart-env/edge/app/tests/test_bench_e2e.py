@@ -0,0 +1,33 @@
+"""
+Testes do benchmark ponta a ponta (bench/): broker local e execução mínima.
+"""
+
+from bench.bench_e2e import E2EBench, regressions
+from bench.minibroker import topic_matches
+
+
+def test_topic_matches():
+    assert topic_matches("iot/+/+/reading", "iot/env/room1/reading")
+    assert not topic_matches("iot/+/+/reading", "iot/env/room1/reading/mp")
+    assert topic_matches("iot/+/+/reading/mp", "iot/env/room1/reading/mp")
+    assert topic_matches("iot/#", "iot/env/room1/reading")
+    assert not topic_matches("iot/+", "iot/env/room1")
+
+
+def test_small_run_delivers_everything():
+    # O esquema vem do próprio bench (init_db no DB_URL temporário do conftest)
+    result = E2EBench(nodes=20, rate=10, duration=1.5, warmup=0.3, publishers=1).run()
+    assert result["published"] == 300
+    assert result["persisted"] == 300
+    # Drenado antes de medir: cada leitura chegou ao WS ou foi conflacionada (contada)
+    assert result["undelivered"] == result["ws_dropped"]
+    assert result["latency_ms"]["samples"] > 0
+    assert result["latency_ms"]["p50"] <= result["latency_ms"]["p99"]
+    assert result["rss_mb"]["peak"] > 0
+
+
+def test_regressions():
+    base = {"throughput_msg_s": 1000.0, "latency_ms": {"p99": 100.0}}
+    assert regressions({"throughput_msg_s": 950.0, "latency_ms": {"p99": 110.0}}, base) == []
+    problems = regressions({"throughput_msg_s": 800.0, "latency_ms": {"p99": 200.0}}, base)
+    assert len(problems) == 2
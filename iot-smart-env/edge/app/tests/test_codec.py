@@ -0,0 +1,60 @@
+"""
+Testes do codec binário (MessagePack com IDs curtos e epoch ms).
+"""
+
+import json
+
+import pytest
+
+from app.core.config import settings
+from app.db.db import read_engine
+from app.services import codec, decoder
+from app.services import readings as readings_q
+from app.services.pipeline import IngestPipeline, shard_key
+from app.services.rawpayload import rebuild_payload
+
+pytestmark = pytest.mark.skipif(codec.msgpack is None, reason="msgpack não instalado")
+
+PAYLOAD = {
+    "node_id": "bin-node", "temperature_c": 24.7, "humidity_pct": 58.2, "soil_moisture_pct": 41.3,
+    "motion": False, "timestamp": "2025-09-17T19:30:10.123+00:00", "firmware": "proto1-sim-0.1.0",
+}
+
+
+def test_binary_is_smaller_and_matches_json_columns():
+    raw = codec.encode_reading(PAYLOAD)
+    assert len(raw) < len(json.dumps(PAYLOAD)) / 2
+    assert shard_key(raw, binary=True) == b"bin-node"
+
+    topic = "iot/env/room1/reading"
+    row = decoder.binary_decode(topic + "/mp", raw)
+    ref = decoder.lenient_decode(topic, json.dumps(PAYLOAD).encode())
+    cols = ("node_id", "temperature_c", "humidity_pct", "soil_moisture_pct", "motion", "timestamp")
+    assert {c: row[c] for c in cols} == {c: ref[c] for c in cols}
+    assert json.loads(row["raw_json"]) == dict(PAYLOAD, _topic=topic + "/mp")
+
+
+def test_string_ids_and_compact_rebuild(monkeypatch):
+    # Formato do ArduinoJson (chaves "0", "1"...) e sem timestamp
+    monkeypatch.setattr(settings, "RAW_PAYLOAD_MODE", "compact")
+    raw = codec.msgpack.packb({"0": "esp-bin", "2": 21.5, "5": True, "7": -61})
+    row = decoder.binary_decode("iot/a/b/reading/mp", raw)
+    assert (row["node_id"], row["temperature_c"], row["motion"]) == ("esp-bin", 21.5, True)
+    rebuilt = rebuild_payload(row)
+    assert rebuilt["rssi_dbm"] == -61 and "timestamp" not in rebuilt
+
+
+def test_pipeline_routes_by_suffix_and_content_type():
+    pipeline = IngestPipeline(decode_workers=2)
+    pipeline.start()
+    try:
+        for i in range(3):
+            p = dict(PAYLOAD, node_id="bin-pipe", timestamp=f"2035-01-01T00:00:0{i}+00:00")
+            pipeline.submit("iot/env/room1/reading/mp", codec.encode_reading(p))
+        p = dict(PAYLOAD, node_id="bin-pipe", timestamp="2035-01-01T00:00:05+00:00")
+        pipeline.submit("iot/env/room1/reading", codec.encode_reading(p), content_type=codec.CONTENT_TYPE)
+        pipeline.join()
+    finally:
+        pipeline.stop()
+    with read_engine.connect() as conn:
+        assert len(readings_q.latest(conn, 10, node_id="bin-pipe")) == 4
@@ -0,0 +1,53 @@
+"""
+Testes do decodificador rápido: mesmas colunas que o caminho tolerante,
+com e sem msgspec, e fallback para payloads fora do esquema.
+"""
+
+import json
+
+import pytest
+
+from app.core.config import settings
+from app.services import decoder
+from app.services.rawpayload import rebuild_payload
+
+TOPIC = "iot/env/room1/reading"
+PAYLOADS = [
+    {"node_id": "dec-1", "temperature_c": 24.7, "humidity_pct": 58, "motion": False,
+     "timestamp": "2025-09-17T19:30:10.123Z", "firmware": "proto1-sim-0.1.0"},
+    {"node_id": "dec-2", "soil_moisture_pct": 50.0, "timestamp": "2025-09-17T16:30:10-03:00"},
+    # Fora do esquema: coerções do caminho tolerante
+    {"node_id": "dec-3", "humidity_pct": "55,5", "motion": "on", "timestamp": "2025-09-17T19:30:10Z"},
+    {"node_id": 7, "temperature_c": True, "timestamp": "ontem"},
+]
+
+
+@pytest.fixture(params=["msgspec", "stdlib"])
+def typed(request, monkeypatch):
+    if request.param == "msgspec" and decoder.msgspec is None:
+        pytest.skip("msgspec não instalado")
+    if request.param == "stdlib":
+        monkeypatch.setattr(decoder, "_typed_decoder", None)
+    return request.param
+
+
+def _columns(row: dict) -> dict:
+    out = {k: v for k, v in row.items() if k not in ("raw_json", "raw_extra")}
+    if out["node_id"] == "7":
+        out.pop("timestamp")  # timestamp inválido vira "agora"
+    return out
+
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+@pytest.mark.parametrize("mode", ["json", "compact"])
+def test_fast_matches_lenient(typed, payload, mode, monkeypatch):
+    monkeypatch.setattr(settings, "RAW_PAYLOAD_MODE", mode)
+    raw = json.dumps(payload).encode()
+    fast = decoder.fast_decode(TOPIC, raw)
+    lenient = decoder.lenient_decode(TOPIC, raw)
+    assert _columns(fast) == _columns(lenient)
+    expected = dict(payload, _topic=TOPIC)
+    if mode == "json":
+        assert json.loads(fast["raw_json"]) == expected
+    elif payload["node_id"] != 7:
+        assert rebuild_payload(fast) == expected
@@ -0,0 +1,48 @@
+"""
+Testes dos contadores do /health mantidos pela ingestão.
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services.ingest import process_incoming_batch
+from app.services.stats import PipelineStats, pipeline_stats
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def isolated_stats():
+    """
+    O banco de teste é compartilhado: leituras mais recentes de outros testes
+    não podem mascarar o last_reading_ts deste. Zera antes do teste; a
+    ingestão seguinte volta a atualizá-lo.
+    """
+    with pipeline_stats._lock:
+        pipeline_stats.last_reading_ts = None
+
+
+def test_health_counts_follow_ingest(isolated_stats):
+    before = client.get("/health").json()
+    assert before["status"] == "ok"
+
+    process_incoming_batch([
+        {"node_id": "health-node-a", "temperature_c": 21, "timestamp": "2031-01-01T00:00:00Z"},
+        {"node_id": "health-node-b", "temperature_c": 22, "timestamp": "2031-01-01T00:00:01Z"},
+    ])
+    after = client.get("/health").json()
+    assert after["counts"]["readings"] == before["counts"]["readings"] + 2
+    assert after["counts"]["nodes"] == before["counts"]["nodes"] + 2
+    assert after["pipeline"]["last_reading_ts"] == "2031-01-01T00:00:01"
+    assert after["pipeline"]["last_ingest_at"] is not None
+
+
+def test_queue_depth_and_removed():
+    stats = PipelineStats()
+    stats.register_queue("mqtt", lambda: 7)
+    stats.record_ingest([{"node_id": "n", "timestamp": pipeline_stats.last_reading_ts}] * 3)
+    stats.record_removed(2)
+    snap = stats.snapshot()
+    assert snap["queue_depth"] == {"mqtt": 7}
+    assert snap["readings"] == 1 and snap["nodes"] == 1
@@ -0,0 +1,94 @@
+"""
+Teste da gravação em lote (group commit) do pipeline de ingestão.
+"""
+
+from app.db.db import SessionLocal
+from app.db import models
+from app.services.ingest import process_incoming_batch
+
+
+def _payload(i: int) -> dict:
+    return {
+        "node_id": f"batch-node-{i % 3}",
+        "temperature_c": 20 + i,
+        "humidity_pct": "55,5",
+        "motion": "on",
+        "timestamp": f"2025-09-17T19:30:{i:02d}.123Z",
+    }
+
+
+def test_batch_insert_returns_ids_in_order():
+    payloads = [_payload(i) for i in range(10)]
+    ids = process_incoming_batch(payloads)
+    assert len(ids) == 10
+    assert ids == sorted(ids)
+
+    with SessionLocal() as s:
+        rows = {r.id: r for r in s.query(models.Reading).filter(models.Reading.id.in_(ids))}
+    for i, rid in enumerate(ids):
+        r = rows[rid]
+        assert r.node_id == f"batch-node-{i % 3}"
+        assert r.temperature_c == 20 + i
+        assert r.humidity_pct == 55.5
+        assert r.motion is True
+
+
+def test_empty_batch_is_noop():
+    assert process_incoming_batch([]) == []
+
+
+def test_duplicates_are_ignored():
+    payload = {"node_id": "dedup-node", "temperature_c": 1, "timestamp": "2025-09-18T00:00:00Z", "msg_id": "b1-1"}
+    first = process_incoming_batch([dict(payload), dict(payload)])
+    assert len(first) == 1
+    # Reentrega (ex.: instância reiniciada): nada novo é gravado
+    again = process_incoming_batch([dict(payload), dict(payload, msg_id="b1-2")])
+    assert len(again) == 1 and again[0] > first[0]
+    with SessionLocal() as s:
+        assert s.query(models.Reading).filter(models.Reading.node_id == "dedup-node").count() == 2
+
+
+def test_readings_without_msg_id_are_never_merged():
+    # Mesmo nó e mesmo segundo, sem msg_id: leituras distintas
+    payload = {"node_id": "same-second-node", "timestamp": "2025-09-18T00:00:00Z"}
+    ids = process_incoming_batch([dict(payload, temperature_c=1), dict(payload, temperature_c=2)])
+    assert len(ids) == 2
+    with SessionLocal() as s:
+        rows = s.query(models.Reading).filter(models.Reading.id.in_(ids)).order_by(models.Reading.id).all()
+    assert [r.temperature_c for r in rows] == [1, 2]
+
+
+def test_unique_index_migration_is_opt_in_and_keeps_rows(monkeypatch):
+    from sqlalchemy import Column, Index, Integer, MetaData, String, Table, create_engine, inspect
+
+    from app.core.config import settings
+    from app.db.db import ensure_unique_indexes
+
+    eng = create_engine("sqlite://")
+    old = Table("r", MetaData(), Column("id", Integer, primary_key=True), Column("node_id", String),
+                Column("msg_id", String))
+    old.create(eng)
+    with eng.begin() as conn:
+        conn.execute(old.insert(), [{"node_id": "a", "msg_id": "m1"}] * 2
+                     + [{"node_id": "a", "msg_id": None}] * 2 + [{"node_id": "b", "msg_id": "m1"}])
+    new = Table("r", MetaData(), Column("id", Integer, primary_key=True), Column("node_id", String),
+                Column("msg_id", String), Index("ux_r", "node_id", "msg_id", unique=True))
+
+    def indexes():
+        with eng.connect() as conn:
+            return [ix["name"] for ix in inspect(conn).get_indexes("r")]
+
+    with eng.begin() as conn:
+        ensure_unique_indexes(conn, new)  # sem opt-in: nada muda
+    assert indexes() == []
+
+    monkeypatch.setattr(settings, "DB_MIGRATE_UNIQUE_INDEXES", True)
+    with eng.begin() as conn:
+        ensure_unique_indexes(conn, new)  # conflito (a, m1): só reporta
+        assert len(conn.execute(new.select()).all()) == 5
+    assert indexes() == []
+
+    with eng.begin() as conn:
+        conn.execute(new.delete().where(new.c.id == 2))  # resolvido pelo operador
+        ensure_unique_indexes(conn, new)
+    assert indexes() == ["ux_r"]
@@ -0,0 +1,173 @@
+"""
+Testes do journal de ingestão (services/journal.py): segmentos, cauda
+truncada, checkpoint, reprocessamento na partida, PUBACK só depois do fsync
+e drenagem no stop() do worker MQTT.
+"""
+
+import json
+import os
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from app.core.config import settings
+from app.db.db import init_db, read_engine
+from app.mqtt.client import MqttWorker
+from app.services import journal as journal_mod
+from app.services import readings as readings_q
+from app.services.journal import IngestJournal
+from app.services.pipeline import IngestPipeline
+
+
+def _payload(node: str, i: int) -> bytes:
+    return json.dumps({"node_id": node, "temperature_c": i, "timestamp": f"2036-01-01T00:00:{i:02d}Z"}).encode()
+
+
+def _segments(path) -> list[str]:
+    return sorted(n for n in os.listdir(path) if n.endswith(".jnl"))
+
+
+def test_journal_recovers_unacknowledged_entries(tmp_path):
+    acks = []
+    journal = IngestJournal(str(tmp_path), on_durable=acks.extend, segment_bytes=200, fsync_ms=60000)
+    seqs = [journal.append("iot/j/reading", _payload("j", i), token=i) for i in range(10)]
+    assert seqs == list(range(1, 11)) and acks == []
+    journal.sync()
+    assert acks == list(range(10))  # confirmados só depois do fsync
+    assert len(_segments(tmp_path)) > 1
+
+    journal.done([1, 2, 3, 4, 6])  # fora de ordem: a marca d'água para no 4
+    assert journal.acked == 4 and journal.pending() == 6
+    journal.close()
+    # Queda no meio de uma escrita: cauda truncada no último segmento
+    with open(tmp_path / _segments(tmp_path)[-1], "ab") as f:
+        f.write(b"\x01\x02\x03")
+
+    journal = IngestJournal(str(tmp_path), fsync_ms=60000)
+    chunks = []
+    for chunk in journal.recover(batch_size=4):
+        chunks.append(chunk)
+        journal.done(seq for seq, *_ in chunk)  # gravados no banco
+    assert [len(c) for c in chunks] == [4, 2]
+    assert [seq for c in chunks for seq, *_ in c] == [5, 6, 7, 8, 9, 10]
+    seq, topic, raw, binary, received = chunks[0][0]
+    assert topic == "iot/j/reading" and json.loads(raw)["temperature_c"] == 4 and binary is False
+    assert abs(received - time.time()) < 60
+    assert journal.acked == 10 and (tmp_path / "checkpoint").read_text() == "10"
+    assert len(_segments(tmp_path)) == 1  # segmentos já gravados no banco são apagados
+    assert journal.append("iot/j/reading", b"{}") == 11  # sempre num segmento novo
+    journal.close()
+
+
+def test_recover_keeps_unsaved_entries_for_next_start(tmp_path):
+    journal = IngestJournal(str(tmp_path), fsync_ms=60000)
+    for i in range(6):
+        journal.append("iot/j/reading", _payload("j", i))
+    journal.close()
+
+    journal = IngestJournal(str(tmp_path), fsync_ms=60000)
+    for chunk in journal.recover(batch_size=2):
+        # O segundo bloco não gravou (seq 4); os demais sim
+        journal.done(seq for seq, *_ in chunk if seq != 4)
+    assert journal.acked == 3 and (tmp_path / "checkpoint").read_text() == "3"
+    journal.close()
+    again = IngestJournal(str(tmp_path), fsync_ms=60000)
+    assert [seq for c in again.recover() for seq, *_ in c] == [4, 5, 6]
+    again.close()
+
+
+def test_worker_replays_journal_acks_after_fsync_and_drains_on_stop(tmp_path, monkeypatch):
+    init_db()
+    node = "journal-node"
+    monkeypatch.setattr(settings, "INGEST_JOURNAL_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "INGEST_JOURNAL_FSYNC_MS", 60000)  # fsync só no stop()
+
+    # Execução anterior caiu depois do fsync e antes da gravação no banco
+    crashed = IngestJournal(str(tmp_path))
+    for i in range(3):
+        crashed.append(f"iot/{node}/reading", _payload(node, i))
+    crashed.close()
+
+    worker = MqttWorker("localhost", 1883, "iot/#", workers=1)
+    acks = []
+    monkeypatch.setattr(worker.client, "ack", lambda mid, qos: acks.append(mid))
+    worker.start_workers()  # reprocessa antes de assinar
+    with read_engine.connect() as conn:
+        assert len(readings_q.latest(conn, 100, node_id=node)) == 3
+
+    worker._on_message(None, None, SimpleNamespace(topic=f"iot/{node}/reading/status", payload=b"online",
+                                                   qos=1, mid=99))
+    assert acks == [99]  # presença não passa pelo journal
+    for i in range(3, 6):
+        worker._on_message(None, None, SimpleNamespace(topic=f"iot/{node}/reading", payload=_payload(node, i),
+                                                       qos=1, mid=i))
+    worker._on_message(None, None, SimpleNamespace(topic=f"iot/{node}/reading", payload=b"{bad", qos=1, mid=6))
+    assert acks == [99]  # sem fsync, sem PUBACK
+    monkeypatch.setattr(worker.client, "disconnect", lambda: acks.append("disconnect"))
+    worker.stop(drain_timeout=10)  # drena o pipeline sem join() antes
+
+    assert acks == [99, 3, 4, 5, 6, "disconnect"]  # últimos PUBACKs antes de desconectar
+    with read_engine.connect() as conn:
+        rows = readings_q.latest(conn, 100, node_id=node)
+    assert sorted(r["temperature_c"] for r in rows) == [0, 1, 2, 3, 4, 5]
+    assert worker.journal.pending() == 0
+    # Próxima partida: nada a reprocessar
+    assert sum(len(c) for c in IngestJournal(str(tmp_path)).recover()) == 0
+
+
+def test_replay_uses_receive_time_for_readings_without_timestamp(tmp_path, monkeypatch):
+    init_db()
+    node = "journal-late"
+    received = datetime(2036, 2, 1, 12, 0, 0)
+    monkeypatch.setattr(journal_mod.time, "time", lambda: received.replace(tzinfo=timezone.utc).timestamp())
+    crashed = IngestJournal(str(tmp_path), fsync_ms=60000)
+    crashed.append(f"iot/{node}/reading", json.dumps({"node_id": node, "temperature_c": 1}).encode())
+    crashed.close()
+    monkeypatch.undo()
+
+    journal = IngestJournal(str(tmp_path), fsync_ms=60000)
+    pipe = IngestPipeline(decode_workers=1, journal=journal)
+    assert pipe.recover() == 1
+    with read_engine.connect() as conn:
+        rows = readings_q.latest(conn, 10, node_id=node)
+    assert [r["timestamp"] for r in rows] == [received]
+    assert journal.pending() == 0
+    journal.close()
+
+
+def test_journal_forces_durable_sqlite_commits(monkeypatch):
+    from app.db import db
+
+    monkeypatch.setattr(settings, "SQLITE_SYNCHRONOUS", "NORMAL")
+    assert db._synchronous() == "NORMAL"
+    monkeypatch.setattr(settings, "INGEST_JOURNAL_DIR", "/tmp/journal")
+    assert db._synchronous() == "FULL"
+
+
+def test_dropped_messages_stay_in_journal_and_are_recovered(tmp_path, monkeypatch):
+    init_db()
+    node = "journal-drop"
+    monkeypatch.setattr(settings, "PIPELINE_DECODE_POLICY", "drop_oldest")
+    monkeypatch.setattr(settings, "PIPELINE_DECODE_QUEUE_MAX", 2)
+    journal = IngestJournal(str(tmp_path), fsync_ms=60000)
+    pipe = IngestPipeline(decode_workers=1, journal=journal)
+    assert pipe.decode.policy == "block" and pipe.persist.policy == "block"
+
+    # Descarte mesmo assim (fila forçada) e, parado, fila cheia: nada é liberado
+    pipe.decode.lanes[0].policy = "drop_oldest"
+    for i in range(4):
+        assert pipe.submit(f"iot/{node}/reading", _payload(node, i))
+    pipe.decode.lanes[0].policy = "block"
+    pipe.decode.stop()
+    assert not pipe.submit(f"iot/{node}/reading", _payload(node, 4))
+    assert pipe.decode.dropped() == 2 and journal.pending() == 5
+    journal.close()
+
+    # Próxima partida: as 5 voltam e são gravadas
+    journal = IngestJournal(str(tmp_path), fsync_ms=60000)
+    assert IngestPipeline(decode_workers=1, journal=journal).recover() == 5
+    with read_engine.connect() as conn:
+        rows = readings_q.latest(conn, 10, node_id=node)
+    assert sorted(r["temperature_c"] for r in rows) == [0, 1, 2, 3, 4]
+    assert journal.pending() == 0
+    journal.close()
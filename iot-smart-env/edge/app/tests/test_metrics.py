@@ -0,0 +1,84 @@
+"""
+Testes do /metrics (formato texto do Prometheus) e dos contadores por thread.
+"""
+
+import json
+import threading
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services import metrics
+from app.services.pipeline import IngestPipeline
+
+client = TestClient(app)
+
+
+def _value(text: str, sample: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(sample + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"amostra ausente: {sample}")
+
+
+def test_counter_and_histogram_across_threads():
+    reg = metrics.Registry()
+    c = reg.counter("t_total", "teste", ("kind",))
+    h = reg.histogram("t_seconds", "teste", buckets=(0.1, 1.0))
+
+    def work():
+        for _ in range(1000):
+            c.labels("a").inc()
+            h.observe(0.5)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    h.observe(5.0)
+
+    text = reg.render()
+    assert "# TYPE t_total counter" in text and "# TYPE t_seconds histogram" in text
+    assert _value(text, 't_total{kind="a"}') == 4000
+    assert _value(text, 't_seconds_bucket{le="0.1"}') == 0
+    assert _value(text, 't_seconds_bucket{le="1"}') == 4000
+    assert _value(text, 't_seconds_bucket{le="+Inf"}') == 4001
+    assert _value(text, "t_seconds_count") == 4001
+    assert _value(text, "t_seconds_sum") == 2005.0
+
+
+def test_metrics_endpoint_follows_pipeline():
+    before = client.get("/metrics").text
+    pipeline = IngestPipeline(decode_workers=1)
+    pipeline.start()
+    try:
+        for i in range(5):
+            payload = {"node_id": "metrics-node", "temperature_c": 20 + i, "timestamp": f"2030-05-01T00:00:0{i}Z"}
+            pipeline.submit("iot/env/metrics/reading", json.dumps(payload).encode())
+        pipeline.submit("iot/env/metrics/reading", b"{not json")
+        pipeline.join()
+    finally:
+        pipeline.stop()
+
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    after = resp.text
+
+    def delta(sample):
+        try:
+            old = _value(before, sample)
+        except AssertionError:
+            old = 0.0
+        return _value(after, sample) - old
+
+    assert delta('edge_messages_received_total{format="json"}') == 6
+    assert delta("edge_messages_decoded_total") == 5
+    assert delta('edge_messages_failed_total{stage="decode"}') == 1
+    assert delta("edge_readings_persisted_total") == 5
+    assert delta("edge_db_insert_seconds_count") >= 1
+    assert delta("edge_rule_eval_seconds_count") == 5
+    assert delta('edge_device_lag_seconds_bucket{le="+Inf"}') == 5
+    assert "edge_ws_clients 0" in after
+    assert "# TYPE edge_queue_dropped_total counter" in after
@@ -0,0 +1,73 @@
+"""
+Testes dos shards de ingestão do worker MQTT (roteamento por node_id e ordem por nó).
+"""
+
+import json
+from types import SimpleNamespace
+
+from app.db.db import read_engine
+from app.mqtt.client import MqttWorker
+from app.services.decoder import decode_reading
+from app.services.pipeline import shard_index, shard_key
+from app.services import readings as readings_q
+
+
+def test_shard_key_extracts_node_id_without_decoding():
+    raw = b'{"temperature_c": 1, "node_id" : "room-7", "x": "y"}'
+    assert shard_key(raw) == b"room-7"
+    assert shard_index(b"room-7", 4) == shard_index(b"room-7", 4)
+    # Mesma chave que a etapa persist usa (node_id normalizado da linha)
+    for raw in (b'{"node_id": "sala-\\u00e9"}', b'{"node_id": 42}', b'{"temperature_c": 1}', b"not json"):
+        try:
+            expected = decode_reading("iot/a/b/reading", raw)["node_id"].encode()
+        except ValueError:
+            expected = b"unknown"
+        assert shard_key(raw) == expected
+
+
+def test_shards_preserve_per_node_order():
+    worker = MqttWorker("localhost", 1883, "iot/#", workers=3)
+    worker.start_workers()
+    try:
+        nodes = [f"shard-node-{i}" for i in range(5)]
+        for seq in range(30):
+            for node in nodes:
+                payload = {"node_id": node, "temperature_c": seq, "timestamp": f"2033-01-01T00:00:{seq:02d}Z"}
+                msg = SimpleNamespace(topic=f"iot/{node}/reading", payload=json.dumps(payload).encode())
+                worker._on_message(None, None, msg)
+        worker._on_message(None, None, SimpleNamespace(topic="iot/x/reading", payload=b"{bad"))
+        worker.join()
+    finally:
+        worker.stop()
+
+    with read_engine.connect() as conn:
+        for node in nodes:
+            rows = readings_q.latest(conn, 100, node_id=node)
+            assert len(rows) == 30
+            by_id = sorted(rows, key=lambda r: r["id"])
+            # Ordem de chegada (ids) == ordem de envio do nó
+            assert [r["temperature_c"] for r in by_id] == list(range(30))
+
+
+def test_shared_subscription_uses_unique_client_id(monkeypatch):
+    from app.core.config import settings
+    from app.mqtt.client import client_id, subscription_topic
+
+    assert subscription_topic("iot/+/+/reading") == "iot/+/+/reading"
+    assert subscription_topic("iot/+/+/reading", "edge") == "$share/edge/iot/+/+/reading"
+    monkeypatch.setattr(settings, "MQTT_SHARED_GROUP", "edge")
+    monkeypatch.setattr(settings, "MQTT_INSTANCE_ID", "box-2")
+    assert client_id() == f"{settings.MQTT_CLIENT_ID}-box-2"
+    worker = MqttWorker("localhost", 1883, "iot/#", workers=1)
+    assert worker.client_id.endswith("-box-2")
+
+
+def test_binary_filter_is_skipped_for_multilevel_wildcard(monkeypatch):
+    from app.core.config import settings
+    from app.mqtt.client import reading_topics
+
+    monkeypatch.setattr(settings, "MQTT_BINARY_SUFFIX", "/mp")
+    assert reading_topics("iot/+/+/reading") == ["iot/+/+/reading", "iot/+/+/reading/mp"]
+    # '#' já cobre <tópico>/mp; "iot/#/mp" derrubaria o subscribe inteiro
+    assert reading_topics("iot/#") == ["iot/#"]
+    assert reading_topics("#") == ["#"]
@@ -0,0 +1,77 @@
+"""
+Testes do registro dos nós (services/nodes.py) e do GET /nodes: última
+leitura, firmware e presença pelos tópicos <tópico>/status.
+"""
+
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.mqtt.client import MqttWorker
+from app.services.decoder import decode_reading
+from app.services.ingest import persist_rows
+from app.services.nodes import NodeRegistry, node_registry
+
+client = TestClient(app)
+
+
+def _node(node_id: str) -> dict:
+    return next(n for n in client.get("/nodes").json() if n["node_id"] == node_id)
+
+
+def test_nodes_snapshot_tracks_last_reading_and_status():
+    topic = "iot/env/nodes-room/reading"
+    # Status retido chega antes da primeira leitura: fica pendente pelo tópico
+    assert node_registry.on_status(topic + "/status", b"online")
+    rows = [
+        decode_reading(topic, b'{"node_id": "nodes-1", "temperature_c": 21.0, '
+                              b'"timestamp": "2033-01-01T00:00:02Z", "firmware": "fw-1.2.0"}'),
+        # Atrasada: não substitui a leitura mais recente
+        decode_reading(topic, b'{"node_id": "nodes-1", "temperature_c": 19.0, "timestamp": "2033-01-01T00:00:01Z"}'),
+    ]
+    persist_rows(rows)
+
+    node = _node("nodes-1")
+    assert node["online"] is True and node["firmware"] == "fw-1.2.0" and node["topic"] == topic
+    assert node["last"]["temperature_c"] == 21.0 and node["last_seen"] is not None
+
+    # LWT do broker
+    node_registry.on_status(topic + "/status", b"offline")
+    assert _node("nodes-1")["online"] is False
+    # Payload JSON com node_id explícito; payload desconhecido é ignorado
+    assert node_registry.on_status("iot/x/y/reading/status", b'{"node_id": "nodes-1", "status": "online"}')
+    assert not node_registry.on_status(topic + "/status", b"")
+    assert _node("nodes-1")["online"] is True
+
+
+def test_mqtt_worker_routes_status_to_registry(monkeypatch):
+    registry = NodeRegistry()
+    monkeypatch.setattr("app.mqtt.client.node_registry", registry)
+    worker = MqttWorker("localhost", 1883, "iot/+/+/reading")
+    submitted = []
+    monkeypatch.setattr(worker.pipeline, "submit", lambda *a, **kw: submitted.append(a))
+
+    worker._on_message(None, None, SimpleNamespace(topic="iot/env/r9/reading/status", payload=b"offline"))
+    assert submitted == []
+    assert registry._pending["iot/env/r9/reading"][0] is False
+
+
+def test_multilevel_topic_subscribes_valid_filters(monkeypatch):
+    worker = MqttWorker("localhost", 1883, "iot/#")
+    subscribed = []
+    real = worker.client.subscribe
+
+    def subscribe(topics, *args, **kwargs):
+        subscribed.extend(topics)
+        return real(topics, *args, **kwargs)  # o paho valida os filtros (ValueError)
+
+    monkeypatch.setattr(worker.client, "subscribe", subscribe)
+    worker._on_connect(worker.client, None, None, 0)
+    # '#' já cobre <tópico>/mp e <tópico>/status
+    assert [t for t, _ in subscribed] == ["iot/#"]
+
+    worker = MqttWorker("localhost", 1883, "iot/+/+/reading")
+    monkeypatch.setattr(worker.client, "subscribe", lambda topics: subscribed.extend(topics))
+    worker._on_connect(worker.client, None, None, 0)
+    assert ("iot/+/+/reading/status", 1) in subscribed
@@ -0,0 +1,72 @@
+"""
+Testes do armazenamento particionado por dia (STORAGE_PARTITIONING=day).
+"""
+
+from datetime import date, datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import inspect
+
+from app.main import app
+from app.core.config import settings
+from app.db import partitions
+from app.db.db import engine
+from app.services.ingest import process_incoming_batch
+from app.services.stats import pipeline_stats
+
+client = TestClient(app)
+ADMIN = {"X-Admin-Token": settings.ADMIN_TOKEN}
+NODE = "part-node"
+
+
+@pytest.fixture
+def daily(monkeypatch):
+    monkeypatch.setattr(settings, "STORAGE_PARTITIONING", "day")
+    partitions.reset_cache()
+    yield
+    partitions.reset_cache()
+
+
+def test_partitioned_ingest_query_and_drop(daily, monkeypatch):
+    ids = process_incoming_batch([
+        {"node_id": NODE, "temperature_c": float(i), "timestamp": f"2030-01-0{d}T12:00:0{i}Z"}
+        for d in (1, 2, 3) for i in range(3)
+    ])
+    assert ids == sorted(ids) and len(set(ids)) == 9
+
+    names = [p["name"] for p in client.get("/partitions").json()]
+    assert {"readings_p20300101", "readings_p20300102", "readings_p20300103"} <= set(names)
+    with engine.connect() as conn:
+        indexes = {ix["name"] for ix in inspect(conn).get_indexes("readings_p20300102")}
+    assert {"ix_readings_p20300102_node_id", "ix_readings_p20300102_timestamp"} <= indexes
+
+    with engine.connect() as conn:
+        pruned = partitions.partitions_for_range(conn, datetime(2030, 1, 2), datetime(2030, 1, 2, 23))
+    assert [p.name for p in pruned if p.start] == ["readings_p20300102"]
+
+    rows = client.get("/readings", params={"node_id": NODE, "limit": 4}).json()
+    assert [r["id"] for r in rows] == ids[-4:]
+
+    rows = client.get("/readings", params={"node_id": NODE, "since": "2030-01-02T00:00:00Z",
+                                           "until": "2030-01-02T23:59:59Z"}).json()
+    assert [r["id"] for r in rows] == ids[3:6]
+
+    seen, cursor = [], None
+    while True:
+        body = client.get("/readings/page", params={"node_id": NODE, "limit": 4, **({"cursor": cursor} if cursor else {})}).json()
+        seen += [r["id"] for r in body["items"]]
+        cursor = body["next"]
+        if not cursor:
+            break
+    assert seen == ids
+
+    removed = []
+    monkeypatch.setattr(pipeline_stats, "record_removed", removed.append)
+    assert client.delete("/partitions/2030-01-01", headers=ADMIN).status_code == 200
+    assert removed == [3]  # pelo rollup de 1h
+    assert client.delete("/partitions/2030-01-01", headers=ADMIN).status_code == 404
+    rows = client.get("/readings", params={"node_id": NODE, "limit": 100}).json()
+    assert [r["id"] for r in rows] == ids[3:]
+    with engine.connect() as conn:
+        assert date(2030, 1, 1) not in {p.start.date() for p in partitions.list_partitions(conn)}
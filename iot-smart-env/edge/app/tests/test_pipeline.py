@@ -0,0 +1,118 @@
+"""
+Testes do pipeline em etapas: políticas de fila cheia e isolamento da gravação
+em relação a etapas lentas.
+"""
+
+import json
+import threading
+import time
+
+from app.db.db import init_db, read_engine
+from app.services import readings as readings_q
+from app.services.pipeline import IngestPipeline, _Lane
+
+
+def test_lane_policies():
+    stop = threading.Event()
+    lane = _Lane(maxsize=3, policy="drop_oldest", sample_every=1)
+    for i in range(5):
+        assert lane.put(i, stop)
+    assert list(lane.items) == [2, 3, 4] and lane.dropped == 2
+
+    lane = _Lane(maxsize=2, policy="sample", sample_every=3)
+    accepted = [lane.put(i, stop) for i in range(8)]
+    # 6 excedentes: só o 3º e o 6º entram (descartando o mais antigo)
+    assert accepted == [True, True, False, False, True, False, False, True]
+    assert list(lane.items) == [4, 7] and lane.dropped == 6
+
+    lane = _Lane(maxsize=1, policy="block", sample_every=1)
+    lane.put(0, stop)
+    stop.set()
+    assert lane.put(1, stop) is False  # cheio e parando: não bloqueia para sempre
+
+
+def test_slow_rules_do_not_block_persist():
+    init_db()
+    pipeline = IngestPipeline(decode_workers=2)
+    release = threading.Event()
+    pipeline.rules.handler = lambda batch: release.wait(5)
+    pipeline.start()
+    try:
+        for i in range(50):
+            payload = {"node_id": "pipe-node", "temperature_c": i, "timestamp": f"2034-01-01T00:00:{i:02d}Z"}
+            pipeline.submit("iot/pipe-node/reading", json.dumps(payload).encode())
+        pipeline.decode.join()
+        pipeline.persist.join()
+        # Gravado mesmo com a etapa de regras travada
+        with read_engine.connect() as conn:
+            assert len(readings_q.latest(conn, 100, node_id="pipe-node")) == 50
+        assert pipeline.rules.depth() > 0 or pipeline.rules.lanes[0].unfinished > 0
+    finally:
+        release.set()
+        pipeline.join()
+        pipeline.stop()
+
+
+def test_persist_retries_db_outage_and_releases_only_saved(tmp_path, monkeypatch):
+    from sqlalchemy.exc import IntegrityError, OperationalError
+
+    from app.core.config import settings
+    from app.services import pipeline as pipeline_mod
+    from app.services.decoder import decode_reading
+    from app.services.journal import IngestJournal
+
+    monkeypatch.setattr(settings, "PIPELINE_PERSIST_RETRY_BASE_SEC", 0.001)
+    journal = IngestJournal(str(tmp_path), fsync_ms=60000)
+    pipe = IngestPipeline(decode_workers=1, journal=journal)
+    batch = []
+    for i in range(3):
+        raw = json.dumps({"node_id": "outage", "temperature_c": i}).encode()
+        batch.append((time.monotonic(), decode_reading("iot/outage/reading", raw), journal.append("t", raw)))
+
+    calls = []
+
+    def flaky(rows):
+        calls.append(len(rows))
+        if len(calls) <= 2:
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        if len(rows) > 1 or rows[0]["temperature_c"] == 1:
+            raise IntegrityError("INSERT", {}, Exception("bad row"))
+        return []
+
+    monkeypatch.setattr(pipeline_mod, "persist_rows", flaky)
+    pipe._persist(batch)
+    # 2 falhas temporárias, o lote recusado e depois linha a linha
+    assert calls == [3, 3, 3, 1, 1, 1]
+    assert journal.acked == 3  # gravadas + a linha recusada
+
+    # Banco travado até o pipeline parar: nada é liberado
+    def down(rows):
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(pipeline_mod, "persist_rows", down)
+    raw = b'{"node_id": "outage"}'
+    seq = journal.append("t", raw)
+    threading.Timer(0.05, pipe.persist.stop).start()
+    pipe._persist([(time.monotonic(), decode_reading("t", raw), seq)])
+    assert journal.acked == 3 and journal.pending() == 1
+    journal.close()
+
+
+def test_only_lock_errors_are_retried():
+    import sqlite3
+
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.exc import DBAPIError, OperationalError
+
+    from app.services.pipeline import _transient
+
+    eng = create_engine("sqlite://")
+    with eng.connect() as conn:
+        try:
+            conn.execute(text("INSERT INTO readings (node_id) VALUES ('x')"))
+        except DBAPIError as e:
+            schema_error = e
+    assert "no such table" in str(schema_error)
+    assert not _transient(schema_error)
+    assert _transient(OperationalError("INSERT", {}, sqlite3.OperationalError("database is locked")))
+    assert not _transient(OperationalError("INSERT", {}, sqlite3.OperationalError("no such column: msg_id")))
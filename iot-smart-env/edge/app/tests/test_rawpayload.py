@@ -0,0 +1,53 @@
+"""
+Testes do armazenamento compacto do payload bruto (RAW_PAYLOAD_MODE=compact).
+"""
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.core.config import settings
+from app.services.ingest import _normalize_payload, process_incoming_batch
+
+client = TestClient(app)
+
+PAYLOADS = [
+    # Formato do simulador: só _topic e firmware ficam fora das colunas
+    {"node_id": "raw-1", "temperature_c": 24.7, "humidity_pct": 58.2, "soil_moisture_pct": 41.3,
+     "motion": False, "timestamp": "2025-09-17T19:30:10.123+00:00", "firmware": "proto1-sim-0.1.0",
+     "_topic": "iot/env/room1/reading"},
+    # Formato do ESP32: sem timestamp, com rssi
+    {"node_id": "raw-2", "temperature_c": 22, "soil_moisture_pct": 50.0, "motion": True,
+     "firmware": "esp32-fw-0.1.0", "rssi_dbm": -61},
+    # Valores que a normalização altera precisam voltar como vieram
+    {"node_id": "raw-3", "humidity_pct": "55,5", "motion": "on", "timestamp": "2025-09-17T19:30:10Z"},
+    # Nada fora das colunas
+    {"node_id": "raw-4", "temperature_c": 20.5, "timestamp": "2025-09-17T19:30:10.000+00:00"},
+]
+
+
+@pytest.fixture
+def compact(monkeypatch):
+    monkeypatch.setattr(settings, "RAW_PAYLOAD_MODE", "compact")
+
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_compact_roundtrip(compact, payload):
+    rid = process_incoming_batch([dict(payload)])[0]
+    assert client.get(f"/readings/{rid}/raw").json() == payload
+
+
+def test_compact_is_smaller_and_empty_extras_are_skipped(compact):
+    full = len(json.dumps(PAYLOADS[0], ensure_ascii=False))
+    norm = _normalize_payload(dict(PAYLOADS[0]))
+    assert norm["raw_json"] == ""
+    assert len(norm["raw_extra"]) < full / 2
+    assert _normalize_payload(dict(PAYLOADS[3]))["raw_extra"] is None
+
+
+def test_json_mode_keeps_full_payload():
+    payload = dict(PAYLOADS[2], node_id="raw-3-json")
+    rid = process_incoming_batch([dict(payload)])[0]
+    assert client.get(f"/readings/{rid}/raw").json() == payload
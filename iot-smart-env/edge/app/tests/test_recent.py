@@ -0,0 +1,76 @@
+"""
+Testes do buffer de leituras recentes (services/recent.py): GET /readings sem
+intervalo servido da memória e replay para clientes WebSocket novos.
+"""
+
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.db.db import read_engine
+from app.main import app
+from app.services import readings as readings_q
+from app.services.ingest import process_incoming_batch
+from app.services.recent import RecentReadings, _Ring, recent_readings
+
+client = TestClient(app)
+NODE = "recent-node"
+
+
+def _ingest(n: int) -> list[int]:
+    return process_incoming_batch([
+        {"node_id": NODE, "temperature_c": float(i), "timestamp": f"2032-01-01T00:{i // 60:02d}:{i % 60:02d}Z"}
+        for i in range(n)
+    ])
+
+
+def test_ring_wraps_around():
+    ring = _Ring(3)
+    for i in range(5):
+        ring.append((i,))
+    assert ring.last(10) == [(2,), (3,), (4,)]
+    assert ring.last(2) == [(3,), (4,)]
+    ring.retain(lambda t: t[0] != 3)
+    assert ring.last(10) == [(2,), (4,)]
+
+
+def test_latest_from_memory_matches_database():
+    ids = _ingest(settings.RECENT_PER_NODE + 20)
+    mem = recent_readings.latest(10, NODE)
+    with read_engine.connect() as conn:
+        assert mem == readings_q.latest(conn, 10, node_id=NODE)
+        # Um buffer novo carregado do banco tem o mesmo conteúdo
+        warmed = RecentReadings()
+        warmed.warm(conn)
+    assert warmed.latest(settings.RECENT_PER_NODE, NODE) == recent_readings.latest(settings.RECENT_PER_NODE, NODE)
+    # Mais do que o buffer guarda: quem chama consulta o banco
+    assert recent_readings.latest(settings.RECENT_PER_NODE + 1, NODE) is None
+
+    rows = client.get("/readings", params={"node_id": NODE, "limit": settings.RECENT_PER_NODE + 20}).json()
+    assert [r["id"] for r in rows] == ids
+    rows = client.get("/readings", params={"node_id": NODE, "limit": 5}).json()
+    assert [r["id"] for r in rows] == ids[-5:]
+
+
+def test_node_buffers_are_capped_lru(monkeypatch):
+    monkeypatch.setattr(settings, "RECENT_MAX_NODES", 2)
+    buf = RecentReadings()
+    ts = datetime(2032, 1, 1)
+    for rid, node in enumerate(("a", "b", "a", "c"), start=1):
+        buf.record([{"node_id": node, "timestamp": ts}], [rid])
+    # "b" foi o menos recente: despejado, volta a ser servido pelo banco
+    assert list(buf._nodes) == ["a", "c"]
+    assert buf.latest(1, "b") is None
+    assert [r["id"] for r in buf.latest(2, "a")] == [1, 3]
+
+
+def test_new_ws_client_gets_recent_history(monkeypatch):
+    monkeypatch.setattr(settings, "WS_REPLAY", 3)
+    ids = process_incoming_batch([
+        {"node_id": f"replay-{i}", "temperature_c": 20.0 + i, "timestamp": "2032-02-01T00:00:00Z"} for i in range(4)
+    ])
+    with client.websocket_connect("/ws") as ws:
+        frames = [ws.receive_json() for _ in range(3)]
+    assert [f["id"] for f in frames] == ids[-3:]
+    assert frames[-1]["node_id"] == "replay-3" and frames[-1]["timestamp"] == "2032-02-01T00:00:00"
@@ -0,0 +1,119 @@
+"""
+Testes da retenção: leituras antigas viram segmentos comprimidos e continuam
+visíveis em /readings e /readings/page.
+"""
+
+import os
+from datetime import date, datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, insert, select
+
+from app.main import app
+from app.core.config import settings
+from app.db import models, partitions
+from app.db.db import engine
+from app.services import archive
+from app.services.ingest import process_incoming_batch
+from app.services.retention import _ROW_COLS, RetentionService
+
+client = TestClient(app)
+NOW = datetime(2001, 2, 1, 12, 0)  # corte = 2001-01-18
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "RETENTION_RAW_DAYS", 14)
+    monkeypatch.setattr(settings, "RETENTION_PAUSE_MS", 0)
+    monkeypatch.setattr(settings, "RETENTION_DELETE_CHUNK", 3)
+    return tmp_path
+
+
+def _live_count(node_id: str) -> int:
+    t = models.Reading.__table__
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).where(t.c.node_id == node_id)).scalar_one()
+
+
+def test_segment_roundtrip():
+    rows = [
+        {"id": 7, "timestamp": datetime(2001, 1, 1, 0, 0, 1), "temperature_c": 21.5,
+         "humidity_pct": None, "soil_moisture_pct": 40.0, "motion": None, "msg_id": "m-7", "raw_json": "{}", "raw_extra": None},
+        {"id": 9, "timestamp": datetime(2001, 1, 1, 0, 0, 3, 250), "temperature_c": None,
+         "humidity_pct": 55.0, "soil_moisture_pct": None, "motion": True, "msg_id": None, "raw_json": "", "raw_extra": b"\x01abc"},
+    ]
+    out = archive.decode_segment(archive.encode_segment(rows), "n")
+    assert out == [dict(r, node_id="n") for r in rows]
+
+
+def test_retention_archives_old_rows_and_reads_them_back(archive_dir):
+    node = "ret-node"
+    old = process_incoming_batch([
+        {"node_id": node, "temperature_c": float(i), "timestamp": f"2001-01-0{1 + i % 3}T10:00:0{i}Z"}
+        for i in range(7)
+    ])
+    recent = process_incoming_batch([
+        {"node_id": node, "temperature_c": 99.0, "timestamp": "2001-01-30T10:00:00Z"}
+    ])
+
+    stats = RetentionService(engine).run_once(now=NOW)
+    assert stats["archived"] == 7 and stats["deleted"] == 7
+    assert _live_count(node) == 1
+    assert os.path.exists(archive.segment_path(node, date(2001, 1, 1)))
+
+    rows = client.get("/readings", params={"node_id": node, "limit": 100}).json()
+    assert sorted(r["id"] for r in rows) == sorted(old + recent)
+    assert rows[-1]["temperature_c"] == 99.0
+
+    rows = client.get("/readings", params={"node_id": node, "limit": 3}).json()
+    assert [r["id"] for r in rows][-1] == recent[0]
+    assert len(rows) == 3
+
+    body = client.get("/readings/page", params={"node_id": node, "limit": 100}).json()
+    assert len(body["items"]) == 8 and body["next"] is None
+
+
+def test_archive_restores_rows_and_keeps_dedup(archive_dir):
+    node = "ret-restore"
+    payloads = [
+        {"node_id": node, "temperature_c": float(i), "msg_id": f"m{i}", "timestamp": f"2001-01-02T10:00:0{i}Z"}
+        for i in range(4)
+    ]
+    process_incoming_batch(payloads)
+    t = models.Reading.__table__
+    cols = [t.c[c] for c in _ROW_COLS]
+    with engine.connect() as conn:
+        before = [dict(r._mapping) for r in conn.execute(select(*cols).where(t.c.node_id == node).order_by(t.c.id))]
+
+    RetentionService(engine).run_once(now=NOW)
+    assert _live_count(node) == 0
+
+    # Redelivery tardia do broker: a leitura já arquivada não volta para a base
+    assert process_incoming_batch(payloads[:2]) == []
+    assert _live_count(node) == 0
+
+    # Restauração: o segmento devolve as linhas idênticas, msg_id incluso
+    archived = list(archive.read_range(node))
+    assert archived == before
+    with engine.begin() as conn:
+        conn.execute(insert(t), archived)
+    assert process_incoming_batch(payloads[:1]) == []
+    assert _live_count(node) == 4
+
+
+def test_retention_drops_old_partitions(archive_dir, monkeypatch):
+    monkeypatch.setattr(settings, "STORAGE_PARTITIONING", "day")
+    partitions.reset_cache()
+    try:
+        ids = process_incoming_batch([
+            {"node_id": "ret-part", "temperature_c": 1.0, "timestamp": "2001-01-05T08:00:00Z"},
+            {"node_id": "ret-part-2", "temperature_c": 2.0, "timestamp": "2001-01-05T09:00:00Z"},
+        ])
+        stats = RetentionService(engine).run_once(now=NOW)
+        assert "readings_p20010105" in stats["dropped"]
+        rows = client.get("/readings", params={"since": "2001-01-05T00:00:00Z", "until": "2001-01-05T23:00:00Z"}).json()
+        assert [r["id"] for r in rows] == ids
+    finally:
+        partitions.reset_cache()
@@ -0,0 +1,52 @@
+"""
+Testes dos agregados 1m/1h/1d mantidos pela ingestão e de /readings/aggregate.
+"""
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.core.config import settings
+from app.services.ingest import process_incoming_batch
+
+client = TestClient(app)
+
+
+def test_rollups_are_maintained_incrementally():
+    node = "rollup-node"
+    process_incoming_batch([
+        {"node_id": node, "temperature_c": 20, "motion": True, "timestamp": "2025-01-01T10:00:05Z"},
+        {"node_id": node, "temperature_c": 24, "motion": False, "timestamp": "2025-01-01T10:00:50Z"},
+    ])
+    # Segundo lote no mesmo minuto: precisa mesclar com o que já existe
+    process_incoming_batch([
+        {"node_id": node, "temperature_c": 22, "humidity_pct": 60, "timestamp": "2025-01-01T10:00:30Z"},
+        {"node_id": node, "temperature_c": 30, "timestamp": "2025-01-01T11:15:00Z"},
+    ])
+
+    r = client.get("/readings/aggregate", params={"bucket": "1m", "node_id": node})
+    assert r.status_code == 200
+    rows = r.json()
+    assert [row["count"] for row in rows] == [3, 1]
+    t = rows[0]["metrics"]["temperature_c"]
+    assert (t["min"], t["max"], t["avg"], t["last"]) == (20, 24, 22, 24)
+    assert rows[0]["metrics"]["humidity_pct"]["count"] == 1
+    assert (rows[0]["motion_samples"], rows[0]["motion_count"]) == (2, 1)
+
+    hours = client.get("/readings/aggregate", params={"bucket": "1h", "node_id": node}).json()
+    assert [h["count"] for h in hours] == [3, 1]
+
+    days = client.get("/readings/aggregate", params={"bucket": "1d", "node_id": node}).json()
+    assert len(days) == 1
+    t = days[0]["metrics"]["temperature_c"]
+    assert (days[0]["count"], t["min"], t["max"], t["last"]) == (4, 20, 30, 30)
+
+
+def test_post_reading_updates_rollups():
+    r = client.post(
+        "/readings",
+        headers={"X-Admin-Token": settings.ADMIN_TOKEN},
+        json={"node_id": "rollup-post", "temperature_c": 18.5, "timestamp": "2025-02-01T08:00:00Z"},
+    )
+    assert r.status_code == 200
+    rows = client.get("/readings/aggregate", params={"bucket": "1h", "node_id": "rollup-post"}).json()
+    assert rows[0]["metrics"]["temperature_c"]["last"] == 18.5
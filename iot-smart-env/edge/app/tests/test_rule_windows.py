@@ -0,0 +1,98 @@
+"""
+Testes das regras com janela (avg/min/max/rate sobre duração ou últimas N
+amostras): janelas incrementais x cálculo ingênuo e disparo via /rules.
+"""
+
+import random
+
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.db import models
+from app.db.db import SessionLocal
+from app.main import app
+from app.services import rules as rules_mod
+from app.services.ingest import process_incoming_batch
+
+client = TestClient(app)
+ADMIN = {"X-Admin-Token": settings.ADMIN_TOKEN}
+
+
+def _naive(samples: list[tuple[float, float]], aggregate: str):
+    values = [v for _, v in samples]
+    if aggregate == "avg":
+        return sum(values) / len(values)
+    if aggregate == "min":
+        return min(values)
+    if aggregate == "max":
+        return max(values)
+    (t0, v0), (t1, v1) = samples[0], samples[-1]
+    return (v1 - v0) * 60.0 / (t1 - t0) if t1 > t0 else None
+
+
+def test_windows_match_naive_computation():
+    rng = random.Random(7)
+    seen: list[tuple[float, float]] = []
+    by_time = rules_mod._Window((30.0, None))
+    by_count = rules_mod._Window((None, 5))
+    ts = 0.0
+    for i in range(500):
+        ts += rng.choice((1.0, 2.0, 5.0, 45.0))
+        v = round(rng.uniform(0, 100), 1)
+        seen.append((ts, v))
+        assert by_time.add(ts, v) and by_count.add(ts, v)
+
+        in_time = [(t, x) for t, x in seen if t >= ts - 30.0]
+        last_n = seen[-5:]
+        for agg in rules_mod._AGGREGATES:
+            expected = _naive(in_time, agg)
+            got = by_time.value(agg)
+            assert (got is None and expected is None) or abs(got - expected) < 1e-6
+            expected = _naive(last_n, agg)
+            got = by_count.value(agg)
+            assert (got is None and expected is None) or abs(got - expected) < 1e-6
+        assert by_count.full() == (i >= 4)
+        # Completa só se a amostra anterior à janela não deixa lacuna maior que ela
+        older = [t for t, _ in seen if t < ts - 30.0]
+        assert by_time.full() == bool(older and in_time[0][0] - older[-1] <= 30.0)
+
+    # Leitura atrasada não entra na janela
+    assert not by_time.add(ts - 1, 0.0)
+
+
+def _actions(node_id: str) -> int:
+    with SessionLocal() as s:
+        return sum(1 for log in s.query(models.ActionLog).all() if (log.payload or {}).get("node_id") == node_id)
+
+
+def test_windowed_rule_ignores_single_noisy_sample():
+    node = "window-node"
+    r = client.post("/rules", headers=ADMIN, json={
+        "name": "window-avg-irrigation", "metric": "soil_moisture_pct", "operator": "<", "value": 30,
+        "aggregate": "avg", "window_samples": 3, "action": "irrigation_on",
+    })
+    assert r.status_code == 200 and r.json()["window_samples"] == 3
+    try:
+        def send(i: int, soil: float):
+            process_incoming_batch([{"node_id": node, "soil_moisture_pct": soil,
+                                     "timestamp": f"2034-01-01T00:00:{i:02d}Z"}])
+
+        send(0, 10.0)  # janela incompleta: não dispara
+        send(1, 40.0)
+        send(2, 40.0)  # avg 30
+        send(3, 10.0)  # avg 30 (40, 40, 10)
+        assert _actions(node) == 0
+        send(4, 10.0)  # avg 20
+        assert _actions(node) == 1
+    finally:
+        client.delete(f"/rules/{r.json()['id']}", headers=ADMIN)
+
+
+def test_window_fields_are_validated():
+    base = {"name": "bad-window", "metric": "temperature_c", "operator": ">", "value": 1, "action": "notify"}
+    assert client.post("/rules", headers=ADMIN, json=dict(base, window_sec=60)).status_code == 422
+    assert client.post("/rules", headers=ADMIN, json=dict(base, aggregate="avg")).status_code == 422
+    assert client.post("/rules", headers=ADMIN,
+                       json=dict(base, aggregate="max", window_sec=60, window_samples=3)).status_code == 422
+    assert client.post("/rules", headers=ADMIN,
+                       json=dict(base, aggregate="rate", window_samples=1)).status_code == 422
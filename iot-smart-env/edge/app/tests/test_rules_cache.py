@@ -0,0 +1,83 @@
+"""
+Testes do índice compilado de regras (RuleCache) e da invalidação via /rules.
+"""
+
+import itertools
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.core.config import settings
+from app.db.db import SessionLocal
+from app.db import models
+from app.services import rules as rules_mod
+from app.services.ingest import process_incoming_batch
+
+client = TestClient(app)
+ADMIN = {"X-Admin-Token": settings.ADMIN_TOKEN}
+
+
+def test_index_matches_naive_evaluation():
+    thresholds = [10.0, 20.0, 20.0, 30.0]
+    fake = [
+        models.Rule(id=i, name=f"r{i}", enabled=True, metric="temperature_c",
+                    operator=op, value=v, action="notify", action_params={})
+        for i, (op, v) in enumerate(itertools.product(rules_mod._OPERATORS, thresholds))
+    ]
+    idx = rules_mod._compile(1, fake).metrics["temperature_c"]
+    for reading in [5.0, 10.0, 15.0, 20.0, 25.0, 30.0, 35.0, float("inf"), float("-inf")]:
+        expected = [r.id for r in fake if rules_mod._OPERATORS[r.operator](reading, r.value)]
+        assert [r.id for r in idx.match(reading)] == expected
+
+
+def test_index_nan_matches_only_not_equal():
+    fake = [
+        models.Rule(id=i, name=f"r{i}", enabled=True, metric="temperature_c",
+                    operator=op, value=20.0, action="notify", action_params={})
+        for i, op in enumerate(rules_mod._OPERATORS)
+    ]
+    idx = rules_mod._compile(1, fake).metrics["temperature_c"]
+    nan = float("nan")
+    expected = [r.id for r in fake if rules_mod._OPERATORS[r.operator](nan, r.value)]
+    assert [r.operator for r in idx.match(nan)] == ["!="]
+    assert [r.id for r in idx.match(nan)] == expected
+
+
+def _logs_for(node_id: str) -> list[models.ActionLog]:
+    with SessionLocal() as s:
+        return [
+            log for log in s.query(models.ActionLog).all()
+            if (log.payload or {}).get("node_id") == node_id
+        ]
+
+
+def test_rule_changes_invalidate_cache():
+    before = rules_mod.rule_cache.version
+    r = client.post("/rules", headers=ADMIN, json={
+        "name": "cache-irrigation", "metric": "soil_moisture_pct", "operator": "<",
+        "value": 30, "action": "irrigation_on", "action_params": {"zone": "B"},
+    })
+    assert r.status_code == 200
+    rule_id = r.json()["id"]
+    assert rules_mod.rule_cache.version > before
+
+    process_incoming_batch([{"node_id": "cache-node", "soil_moisture_pct": 25}])
+    assert len(_logs_for("cache-node")) == 1
+
+    body = dict(r.json(), enabled=False)
+    assert client.put(f"/rules/{rule_id}", headers=ADMIN, json=body).status_code == 200
+    process_incoming_batch([{"node_id": "cache-node", "soil_moisture_pct": 25}])
+    assert len(_logs_for("cache-node")) == 1
+
+    assert client.delete(f"/rules/{rule_id}", headers=ADMIN).status_code == 200
+    assert all(cr.id != rule_id for cr in rules_mod.rule_cache.match("soil_moisture_pct", 1.0))
+
+
+def test_peek_returns_none_only_when_stale():
+    # O consumidor asyncio usa peek() e só recompila (em thread) se estiver velho
+    index = rules_mod.rule_cache.get()
+    assert rules_mod.rule_cache.peek() is index
+    rules_mod.rule_cache.invalidate()
+    assert rules_mod.rule_cache.peek() is None
+    assert rules_mod.rule_cache.get() is not None
+    assert rules_mod.rule_cache.peek() is not None
@@ -0,0 +1,46 @@
+"""
+Testes do perfil SQLite (WAL, escritor dedicado, pool somente-leitura).
+"""
+
+import threading
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.db.db import engine, read_engine
+from app.services.ingest import process_incoming_batch
+from app.services import readings as readings_q
+
+
+def test_wal_and_read_only_pool():
+    assert read_engine is not engine
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+    with read_engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA query_only").scalar() == 1
+        with pytest.raises(OperationalError):
+            conn.execute(text("DELETE FROM readings"))
+
+
+def test_reads_do_not_block_ingest():
+    errors = []
+
+    def writer():
+        try:
+            for i in range(20):
+                process_incoming_batch([
+                    {"node_id": "profile-node", "temperature_c": i, "timestamp": f"2032-01-01T00:00:{i:02d}Z"}
+                ])
+        except Exception as e:  # pragma: no cover - só em falha
+            errors.append(e)
+
+    t = threading.Thread(target=writer)
+    t.start()
+    while t.is_alive():
+        with read_engine.connect() as conn:
+            readings_q.latest(conn, 50, node_id="profile-node")
+    t.join()
+    assert not errors
+    with read_engine.connect() as conn:
+        assert len(readings_q.latest(conn, 50, node_id="profile-node")) == 20
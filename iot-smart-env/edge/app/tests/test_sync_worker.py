@@ -0,0 +1,190 @@
+"""
+Testes do sync_worker contra um receptor HTTP local: lotes por tamanho e por
+tempo, retomada pelo checkpoint após queda e leitura sem a trava de escrita.
+
+O worker roda fora do edge (cloud/firebase_sync); é importado pelo caminho.
+"""
+
+import json
+import sqlite3
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[3] / "cloud" / "firebase_sync"))
+
+from sync_worker import DirectoryUploader, HttpUploader, Settings, SyncWorker, decompress, load_state  # noqa: E402
+
+SCHEMA = """
+CREATE TABLE readings (
+    id INTEGER NOT NULL PRIMARY KEY, node_id VARCHAR(64) NOT NULL, temperature_c FLOAT,
+    humidity_pct FLOAT, soil_moisture_pct FLOAT, motion BOOLEAN, timestamp DATETIME NOT NULL,
+    raw_json TEXT NOT NULL, raw_extra BLOB
+);
+CREATE TABLE readings_p20350101 AS SELECT * FROM readings WHERE 0;
+CREATE TABLE action_logs (
+    id INTEGER NOT NULL PRIMARY KEY, rule_id INTEGER, reading_id INTEGER, action VARCHAR(64),
+    payload JSON, created_at DATETIME
+);
+"""
+
+
+def _insert(db: str, first: int, n: int, table: str = "readings") -> None:
+    with sqlite3.connect(db) as conn:
+        conn.executemany(
+            f"INSERT INTO {table} VALUES (?, ?, ?, NULL, NULL, NULL, ?, ?, ?)",
+            [(i, f"n{i % 3}", 20.0 + i / 10, f"2035-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}.000000",
+              json.dumps({"i": i}), b"\x00\xff" if i % 7 == 0 else None)
+             for i in range(first, first + n)],
+        )
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "edge.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        conn.executemany(
+            "INSERT INTO action_logs VALUES (?, 1, ?, 'notify', ?, '2035-01-01 00:00:00.000000')",
+            [(i, i, json.dumps({"node_id": "n1"})) for i in range(1, 6)],
+        )
+    _insert(path, 1, 300)
+    _insert(path, 301, 10, "readings_p20350101")
+    return path
+
+
+class _Receiver(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        srv = self.server
+        status = srv.script.pop(0) if srv.script else 200
+        if status == 200:
+            raw = decompress(body, self.headers["Content-Encoding"])
+            srv.batches.append((self.headers["Idempotency-Key"], len(raw),
+                                [json.loads(line) for line in raw.splitlines()]))
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def receiver():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Receiver)
+    srv.script, srv.batches = [], []
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def _cfg(db: str, tmp_path, **kw) -> Settings:
+    base = dict(EDGE_DB_PATH=db, SYNC_STATE_FILE=str(tmp_path / "state.json"), SYNC_PAGE_ROWS=64,
+                SYNC_MAX_DUTY=1.0, SYNC_RETRY_BASE_SEC=0.01)
+    return Settings(**dict(base, **kw))
+
+
+def _ids(batches, table: str) -> list[int]:
+    return [r["id"] for _, _, records in batches for r in records if r["table"] == table]
+
+
+def test_uploads_everything_and_resumes_from_checkpoint(db, tmp_path, receiver):
+    cfg = _cfg(db, tmp_path, SYNC_BATCH_MAX_BYTES=8000)
+    url = f"http://127.0.0.1:{receiver.server_address[1]}/ingest"
+    receiver.script = [503, 503]  # destino fora do ar nas duas primeiras tentativas
+
+    worker = SyncWorker(HttpUploader(url), cfg)
+    assert worker.drain(10)
+    worker.close()
+    assert _ids(receiver.batches, "readings") == list(range(1, 311))
+    assert _ids(receiver.batches, "action_logs") == [1, 2, 3, 4, 5]
+    assert len(receiver.batches) > 1 and all(size <= 8000 for _, size, _ in receiver.batches)
+    first = receiver.batches[0][2][0]
+    assert first["timestamp"] == "2035-01-01T00:00:01.000000" and first["raw_json"] == '{"i": 1}'
+    assert receiver.batches[0][2][6]["raw_extra"] == "AP8="  # bytes em base64
+    assert load_state(cfg.SYNC_STATE_FILE, cfg.SYNC_TABLES) == {"readings": 310, "action_logs": 5}
+
+    # Reinício: só o que chegou depois do checkpoint
+    _insert(db, 311, 20)
+    sent = len(receiver.batches)
+    worker = SyncWorker(HttpUploader(url), cfg)
+    assert worker.drain(10)
+    worker.close()
+    assert _ids(receiver.batches[sent:], "readings") == list(range(311, 331))
+    assert _ids(receiver.batches[sent:], "action_logs") == []
+
+
+def test_partial_batch_waits_for_delay_and_ignores_write_lock(db, tmp_path):
+    now = [0.0]
+    out = tmp_path / "out"
+    cfg = _cfg(db, tmp_path, SYNC_TABLES=("action_logs",), SYNC_BATCH_MAX_DELAY_SEC=5.0)
+    worker = SyncWorker(DirectoryUploader(str(out)), cfg, clock=lambda: now[0])
+
+    # A ingestão segura a trava de escrita: a leitura (somente leitura, WAL) segue
+    writer = sqlite3.connect(db, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    writer.execute("INSERT INTO action_logs (id, action) VALUES (6, 'notify')")
+    try:
+        assert 0 < worker.step() <= 5.0
+        assert list(out.iterdir()) == []  # lote parcial espera o atraso máximo
+        now[0] = 5.0
+        assert worker.step() == 0.0
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()
+
+    (batch,) = out.iterdir()
+    assert batch.name.startswith("action_logs-1-5.ndjson.")
+    lines = decompress(batch.read_bytes(), batch.name.rsplit(".", 1)[1]).splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [1, 2, 3, 4, 5]
+    assert worker.state == {"action_logs": 5}
+
+
+class _CommitBetween:
+    """Conexão de leitura que deixa a ingestão commitar logo depois de ler `table`."""
+
+    def __init__(self, conn: sqlite3.Connection, table: str, commit):
+        self.conn, self.table, self.commit = conn, table, commit
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def execute(self, sql: str, *args):
+        cur = self.conn.execute(sql, *args)
+        if self.commit is None or f'FROM "{self.table}"' not in sql:
+            return cur
+        rows = cur.fetchall()
+        self.commit()
+        self.commit = None
+        return SimpleNamespace(fetchall=lambda: rows)
+
+
+def test_partitions_are_read_from_one_snapshot(db, tmp_path, receiver):
+    with sqlite3.connect(db) as conn:
+        conn.execute("CREATE TABLE readings_p20350102 AS SELECT * FROM readings WHERE 0")
+
+    def ingest_batch():
+        # Um lote com leituras de dois dias: ids globais, uma partição por dia
+        with sqlite3.connect(db) as writer:
+            writer.execute("INSERT INTO readings_p20350101 (id, node_id, timestamp, raw_json) "
+                           "VALUES (311, 'n1', '2035-01-01 23:59:59', '{}')")
+            writer.execute("INSERT INTO readings_p20350102 (id, node_id, timestamp, raw_json) "
+                           "VALUES (312, 'n1', '2035-01-02 00:00:00', '{}')")
+
+    cfg = _cfg(db, tmp_path, SYNC_PAGE_ROWS=1000, SYNC_TABLES=("readings",))
+    url = f"http://127.0.0.1:{receiver.server_address[1]}/ingest"
+    worker = SyncWorker(HttpUploader(url), cfg)
+    worker._conn = _CommitBetween(worker._connection(), "readings_p20350101", ingest_batch)
+    assert worker.drain(10)
+    assert worker.drain(10)  # o lote que commitou durante a leitura vem no ciclo seguinte
+    worker.close()
+    assert _ids(receiver.batches, "readings") == list(range(1, 313))
@@ -0,0 +1,112 @@
+"""
+Testes do WebSocket /ws: fan-out a partir da thread de ingestão e conflação
+da fila de saída de clientes atrasados.
+"""
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.main import app
+from app.services.ingest import process_incoming_batch
+from app.ws import websocket
+from app.ws.websocket import Subscription, _ClientSender, _frame_key, ws_manager
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def no_replay(monkeypatch):
+    # Estes testes esperam só o fluxo ao vivo; o replay tem teste próprio (test_recent.py)
+    monkeypatch.setattr(settings, "WS_REPLAY", 0)
+
+
+def test_ws_receives_ingested_reading():
+    with client.websocket_connect("/ws") as ws:
+        ids = process_incoming_batch([{"node_id": "ws-node", "temperature_c": 21.5}])
+        msg = ws.receive_json()
+        assert msg["id"] == ids[0]
+        assert msg["node_id"] == "ws-node"
+        assert msg["temperature_c"] == 21.5
+
+
+def test_slow_client_queue_conflates_per_node_and_is_bounded():
+    sender = _ClientSender(ws=None, maxsize=3, conflate_after=0)  # type: ignore[arg-type]
+    for i in range(5):
+        m = {"node_id": "a", "v": i}
+        sender.push(_frame_key(m), json.dumps(m))
+    assert [json.loads(f)["v"] for _, f in sender.pending.values()] == [4]
+
+    for n in ["b", "c", "d"]:
+        m = {"node_id": n, "v": 0}
+        sender.push(_frame_key(m), json.dumps(m))
+    assert len(sender.pending) == 3
+    assert [json.loads(f)["node_id"] for _, f in sender.pending.values()] == ["b", "c", "d"]
+    assert list(sender.latest) == [("node", n) for n in "bcd"]
+
+
+def test_queue_conflates_only_past_threshold():
+    sender = _ClientSender(ws=None, maxsize=10, conflate_after=3)  # type: ignore[arg-type]
+    for i in range(5):
+        m = {"node_id": "a", "v": i}
+        sender.push(_frame_key(m), json.dumps(m))
+    # Até 3 na fila, tudo entra; depois, o mais novo do nó substitui o anterior
+    assert [json.loads(f)["v"] for _, f in sender.pending.values()] == [0, 1, 4]
+
+
+def test_caught_up_client_gets_every_reading_of_a_batch():
+    with client.websocket_connect("/ws") as ws:
+        ids = process_incoming_batch([
+            {"node_id": "ws-burst", "temperature_c": t, "timestamp": f"2033-01-01T00:00:0{t}Z"} for t in range(3)
+        ])
+        assert [ws.receive_json()["id"] for _ in ids] == ids
+
+
+def test_disconnect_removes_client():
+    with client.websocket_connect("/ws"):
+        assert len(ws_manager.clients) == 1
+    process_incoming_batch([{"node_id": "ws-node"}])
+    assert len(ws_manager.clients) == 0
+
+
+def test_subscription_filters_nodes_and_metrics():
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"type": "subscribe", "node_id": ["green-*"], "metrics": ["humidity_pct"]})
+        assert ws.receive_json()["type"] == "subscribed"
+        process_incoming_batch([
+            {"node_id": "room-1", "temperature_c": 20, "humidity_pct": 50},
+            {"node_id": "green-1", "temperature_c": 21, "humidity_pct": 51},
+        ])
+        msg = ws.receive_json()
+        assert msg["node_id"] == "green-1"
+        assert msg["humidity_pct"] == 51
+        assert "temperature_c" not in msg
+
+
+def test_subscription_match_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(websocket, "_MATCH_CACHE_MAX", 3)
+    sub = Subscription(node_patterns=("green-*",))
+    assert sub.matches("green-1")
+    for i in range(10):
+        assert not sub.matches(f"spoof-{i}")
+    assert len(sub._match_cache) == 3
+    assert list(sub._match_cache) == ["spoof-7", "spoof-8", "spoof-9"]
+    assert sub.matches("green-1")
+
+
+def test_subscription_rate_limit_sends_summary():
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"type": "subscribe", "node_id": "rate-node", "max_rate_hz": 5})
+        assert ws.receive_json()["type"] == "subscribed"
+        process_incoming_batch([
+            {"node_id": "rate-node", "temperature_c": t} for t in (10, 20, 30, 40)
+        ])
+        first = ws.receive_json()
+        assert first["temperature_c"] == 10
+        summary = ws.receive_json()
+        assert summary["type"] == "summary"
+        assert summary["count"] == 3
+        t = summary["metrics"]["temperature_c"]
+        assert (t["min"], t["max"], t["avg"], t["last"]) == (20, 40, 30, 40)
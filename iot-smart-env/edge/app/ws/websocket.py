@@ -1,38 +1,341 @@
 """
 Gerencia conexões WebSocket e expõe a rota /ws
+
+- Cada conexão tem sua própria fila de saída (limitada) e uma task de envio;
+  um cliente lento não atrasa os demais nem a thread de ingestão.
+- O frame é serializado uma única vez por broadcast.
+- Cliente em dia recebe todas as leituras. Cliente atrasado (mais de
+  WS_CONFLATE_AFTER frames na fila): a fila conflaciona para o valor mais
+  recente por `node_id` e descarta o mais antigo se passar de WS_SEND_QUEUE_MAX.
+- Cliente travado (envio sem progresso por WS_SEND_TIMEOUT_SEC) é desconectado.
+- Ao conectar, o cliente recebe as últimas WS_REPLAY leituras (services/recent.py)
+  antes do fluxo ao vivo.
+- Assinaturas no servidor: o cliente envia
+    {"type": "subscribe", "node_id": ["room1*"], "metrics": ["temperature_c"], "max_rate_hz": 1}
+  e passa a receber só as leituras que casam (padrões fnmatch), apenas com as
+  métricas pedidas. Acima da taxa pedida, recebe um frame "summary" por
+  intervalo (min/max/avg/last) no lugar de cada leitura.
+  {"type": "unsubscribe"} volta ao fluxo completo.
 """
 
 from __future__ import annotations
-import threading
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from fnmatch import fnmatchcase
+from typing import Any, Hashable, Iterable
+
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
+from ..core.config import settings
+from ..services.metrics import ws_dropped_frames
+from ..services.recent import recent_readings
+
 ws_router = APIRouter()
 
 
+def _dumps(data: dict) -> str:
+    # Mesmo formato de WebSocket.send_json
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _frame_key(data: dict) -> Hashable:
+    node_id = data.get("node_id")
+    # Sem node_id não há o que conflacionar: chave única por frame
+    return ("node", node_id) if node_id is not None else object()
+
+
+_METRICS = ("temperature_c", "humidity_pct", "soil_moisture_pct", "motion")
+_BASE_FIELDS = ("id", "node_id", "timestamp")
+# Resultados de casamento guardados por assinatura (LRU): node_ids forjados não crescem a memória
+_MATCH_CACHE_MAX = 1024
+
+
+@dataclass
+class Subscription:
+    node_patterns: tuple[str, ...] = ()  # vazio = todos os nós
+    metrics: tuple[str, ...] = _METRICS
+    min_interval: float = 0.0  # segundos entre frames por nó (0 = sem limite)
+    _match_cache: "OrderedDict[str, bool]" = field(default_factory=OrderedDict, repr=False)
+
+    @classmethod
+    def from_message(cls, msg: dict) -> "Subscription":
+        nodes = msg.get("node_id") or ()
+        if isinstance(nodes, str):
+            nodes = (nodes,)
+        metrics = msg.get("metrics") or _METRICS
+        if isinstance(metrics, str):
+            metrics = (metrics,)
+        metrics = tuple(m for m in metrics if m in _METRICS)
+        rate = msg.get("max_rate_hz")
+        try:
+            min_interval = 1.0 / float(rate) if rate else 0.0
+        except (TypeError, ValueError, ZeroDivisionError):
+            min_interval = 0.0
+        return cls(node_patterns=tuple(str(n) for n in nodes), metrics=metrics, min_interval=max(0.0, min_interval))
+
+    def matches(self, node_id: Any) -> bool:
+        if not self.node_patterns:
+            return True
+        key = str(node_id)
+        cache = self._match_cache
+        hit = cache.get(key)
+        if hit is None:
+            hit = any(fnmatchcase(key, p) for p in self.node_patterns)
+            cache[key] = hit
+            if len(cache) > _MATCH_CACHE_MAX:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+        return hit
+
+    def describe(self) -> dict:
+        return {
+            "node_id": list(self.node_patterns),
+            "metrics": list(self.metrics),
+            "max_rate_hz": (1.0 / self.min_interval) if self.min_interval else None,
+        }
+
+
+class _Summary:
+    """Acumulado de um nó durante um intervalo (min/max/soma/último por métrica)."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.first_ts: Any = None
+        self.last: dict = {}
+        self.stats: dict[str, list] = {}  # métrica -> [n, min, max, soma, último]
+
+    def add(self, data: dict, metrics: tuple[str, ...]) -> None:
+        self.count += 1
+        if self.first_ts is None:
+            self.first_ts = data.get("timestamp")
+        self.last = data
+        for m in metrics:
+            v = data.get(m)
+            if v is None:
+                continue
+            st = self.stats.get(m)
+            if st is None:
+                self.stats[m] = [1, v, v, float(v), v]
+            else:
+                st[0] += 1
+                st[1] = min(st[1], v)
+                st[2] = max(st[2], v)
+                st[3] += float(v)
+                st[4] = v
+
+    def frame(self, interval: float) -> dict:
+        return {
+            "type": "summary",
+            "id": self.last.get("id"),
+            "node_id": self.last.get("node_id"),
+            "interval_sec": interval,
+            "count": self.count,
+            "from": self.first_ts,
+            "timestamp": self.last.get("timestamp"),
+            "metrics": {
+                m: {"min": st[1], "max": st[2], "avg": st[3] / st[0], "last": st[4], "count": st[0]}
+                for m, st in self.stats.items()
+            },
+        }
+
+
+@dataclass
+class _NodeRate:
+    last_sent: float = float("-inf")
+    summary: _Summary | None = None
+    timer: asyncio.TimerHandle | None = None
+
+
+class _ClientSender:
+    """Fila de saída de um cliente (conflação por chave) + task de envio."""
+
+    def __init__(self, ws: WebSocket, maxsize: int, conflate_after: int | None = None) -> None:
+        self.ws = ws
+        self.maxsize = max(1, maxsize)
+        self.conflate_after = settings.WS_CONFLATE_AFTER if conflate_after is None else conflate_after
+        # seq -> (chave, frame), na ordem de envio; `latest`: chave -> seq do frame mais novo na fila
+        self.pending: "OrderedDict[int, tuple[Hashable, str]]" = OrderedDict()
+        self.latest: dict[Hashable, int] = {}
+        self._seq = 0
+        self.wake = asyncio.Event()
+        self.dropped = 0
+        self.task: asyncio.Task | None = None
+        self.subscription: Subscription | None = None
+        self.rates: dict[Any, _NodeRate] = {}
+
+    def subscribe(self, sub: Subscription | None) -> None:
+        for st in self.rates.values():
+            if st.timer:
+                st.timer.cancel()
+        self.rates.clear()
+        self.subscription = sub
+
+    def offer(self, data: dict, key: Hashable, frame: str, projected: dict[tuple, str]) -> None:
+        """Entrega uma leitura respeitando a assinatura (filtro + taxa máxima)."""
+        sub = self.subscription
+        if sub is None:
+            self.push(key, frame)
+            return
+        node_id = data.get("node_id")
+        if not sub.matches(node_id):
+            return
+        if sub.min_interval <= 0:
+            self.push(key, _project(data, sub.metrics, projected))
+            return
+
+        st = self.rates.get(node_id)
+        if st is None:
+            st = self.rates[node_id] = _NodeRate()
+        now = time.monotonic()
+        if st.summary is None and now - st.last_sent >= sub.min_interval:
+            st.last_sent = now
+            self.push(key, _project(data, sub.metrics, projected))
+            return
+        # Acima da taxa: acumula e envia um resumo ao fim do intervalo
+        if st.summary is None:
+            st.summary = _Summary()
+        st.summary.add(data, sub.metrics)
+        if st.timer is None:
+            loop = asyncio.get_running_loop()
+            st.timer = loop.call_at(
+                loop.time() + max(0.0, st.last_sent + sub.min_interval - now),
+                self._flush_summary, node_id, key,
+            )
+
+    def _flush_summary(self, node_id: Any, key: Hashable) -> None:
+        st = self.rates.get(node_id)
+        sub = self.subscription
+        if st is None or sub is None:
+            return
+        st.timer = None
+        if st.summary is not None:
+            self.push(key, _dumps(st.summary.frame(sub.min_interval)))
+            st.summary = None
+            st.last_sent = time.monotonic()
+
+    def push(self, key: Hashable, frame: str) -> None:
+        if len(self.pending) >= self.conflate_after:
+            # Atrasado: substitui o frame ainda não enviado do mesmo nó
+            old = self.latest.get(key)
+            if old is not None and self.pending.pop(old, None) is not None:
+                self.dropped += 1
+                ws_dropped_frames.inc()
+        if len(self.pending) >= self.maxsize:
+            self._pop()
+            self.dropped += 1
+            ws_dropped_frames.inc()
+        self._seq += 1
+        self.pending[self._seq] = (key, frame)
+        self.latest[key] = self._seq
+        self.wake.set()
+
+    def _pop(self) -> str:
+        seq, (key, frame) = self.pending.popitem(last=False)
+        if self.latest.get(key) == seq:
+            del self.latest[key]
+        return frame
+
+    async def run(self, manager: "WSManager") -> None:
+        try:
+            while True:
+                if not self.pending:
+                    self.wake.clear()
+                    await self.wake.wait()
+                    continue
+                frame = self._pop()
+                await asyncio.wait_for(self.ws.send_text(frame), timeout=settings.WS_SEND_TIMEOUT_SEC)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Timeout (cliente travado) ou conexão encerrada: remove o cliente
+            await manager.evict(self.ws)
+
+
+def _project(data: dict, metrics: tuple[str, ...], cache: dict[tuple, str]) -> str:
+    """Serializa só as métricas pedidas; uma vez por combinação de métricas por broadcast."""
+    frame = cache.get(metrics)
+    if frame is None:
+        out = {k: data[k] for k in _BASE_FIELDS if k in data}
+        for m in metrics:
+            if m in data:
+                out[m] = data[m]
+        frame = cache[metrics] = _dumps(out)
+    return frame
+
+
 class WSManager:
     def __init__(self) -> None:
-        self.connections: list[WebSocket] = []
-        self.lock = threading.Lock()
+        # dict: inserção/remoção O(1); só é alterado no event loop
+        self.clients: dict[WebSocket, _ClientSender] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def connections(self) -> list[WebSocket]:
+        return list(self.clients)
 
     async def connect(self, ws: WebSocket):
         await ws.accept()
-        with self.lock:
-            self.connections.append(ws)
+        self._loop = asyncio.get_running_loop()
+        sender = _ClientSender(ws, settings.WS_SEND_QUEUE_MAX)
+        self.clients[ws] = sender
+        # Histórico recente de imediato (chave única: não conflaciona nem some da fila)
+        for m in recent_readings.replay(min(settings.WS_REPLAY, sender.maxsize)):
+            sender.push(object(), _dumps(m))
+        sender.task = asyncio.create_task(sender.run(self))
 
     def remove(self, ws: WebSocket):
-        with self.lock:
-            if ws in self.connections:
-                self.connections.remove(ws)
+        sender = self.clients.pop(ws, None)
+        if sender:
+            sender.subscribe(None)
+        if sender and sender.task and sender.task is not asyncio.current_task():
+            sender.task.cancel()
+
+    async def evict(self, ws: WebSocket):
+        self.remove(ws)
+        try:
+            await ws.close(code=1013)  # "try again later"
+        except Exception:
+            pass
+
+    def subscribe(self, ws: WebSocket, msg: dict) -> Subscription | None:
+        sender = self.clients.get(ws)
+        if sender is None:
+            return None
+        sub = Subscription.from_message(msg) if msg.get("type") == "subscribe" else None
+        sender.subscribe(sub)
+        ack = {"type": "subscribed", **sub.describe()} if sub else {"type": "unsubscribed"}
+        sender.push(object(), _dumps(ack))
+        return sub
+
+    def _fanout(self, frames: Iterable[tuple[dict, Hashable, str]]) -> None:
+        # Sempre no event loop
+        for data, key, frame in frames:
+            projected: dict[tuple, str] = {}
+            for sender in self.clients.values():
+                sender.offer(data, key, frame, projected)
 
     async def broadcast_json(self, data: dict):
-        to_remove = []
-        for ws in list(self.connections):
-            try:
-                await ws.send_json(data)
-            except Exception:
-                to_remove.append(ws)
-        for ws in to_remove:
-            self.remove(ws)
+        self._fanout([(data, _frame_key(data), _dumps(data))])
+
+    def broadcast_local(self, messages: list[dict]) -> None:
+        """No event loop (ex.: ingestão asyncio): fan-out imediato, sem agendar."""
+        if self.clients:
+            self._fanout([(m, _frame_key(m), _dumps(m)) for m in messages])
+
+    def broadcast_threadsafe(self, messages: list[dict]) -> None:
+        """
+        Chamado a partir de threads (ex.: ingestão MQTT). Serializa aqui,
+        agenda o fan-out no event loop e retorna sem esperar o envio.
+        """
+        loop = self._loop
+        if loop is None or not self.clients or loop.is_closed():
+            return
+        frames = [(m, _frame_key(m), _dumps(m)) for m in messages]
+        loop.call_soon_threadsafe(self._fanout, frames)
 
 
 ws_manager = WSManager()
@@ -43,7 +346,15 @@ async def ws_endpoint(websocket: WebSocket):
     await ws_manager.connect(websocket)
     try:
         while True:
-            # Mantém socket vivo (cliente pode enviar "ping")
-            await websocket.receive_text()
+            # Mantém socket vivo (cliente pode enviar "ping") e recebe assinaturas
+            text = await websocket.receive_text()
+            try:
+                msg = json.loads(text)
+            except ValueError:
+                continue
+            if isinstance(msg, dict) and msg.get("type") in ("subscribe", "unsubscribe"):
+                ws_manager.subscribe(websocket, msg)
     except WebSocketDisconnect:
+        pass
+    finally:
         ws_manager.remove(websocket)
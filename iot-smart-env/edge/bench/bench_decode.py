@@ -0,0 +1,81 @@
+"""
+Microbenchmark: decodificação das mensagens MQTT, caminho tolerante vs. rápido
+(e o formato binário MessagePack, se o pacote estiver instalado).
+
+Mede bytes -> linha normalizada (services/decoder.py), sem banco.
+
+Uso (a partir de edge/):
+    python -m bench.bench_decode --n 50000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def _messages(n: int) -> list[tuple[str, bytes]]:
+    base = datetime(2025, 9, 17, 19, 30)
+    out = []
+    for i in range(n):
+        payload = {
+            "node_id": f"envnode-{i % 300:03d}",
+            "temperature_c": round(random.uniform(18, 35), 2),
+            "humidity_pct": round(random.uniform(30, 90), 2),
+            "soil_moisture_pct": round(random.uniform(10, 90), 2),
+            "motion": random.random() < 0.1,
+            "timestamp": (base + timedelta(milliseconds=i)).isoformat(timespec="milliseconds") + "Z",
+            "firmware": "proto1-sim-0.1.0",
+        }
+        out.append(("iot/env/room1/reading", json.dumps(payload).encode()))
+    return out
+
+
+def _rate(fn, msgs) -> float:
+    t0 = time.perf_counter()
+    for topic, raw in msgs:
+        fn(topic, raw)
+    return len(msgs) / (time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do decodificador de mensagens")
+    parser.add_argument("--n", type=int, default=50000)
+    args = parser.parse_args()
+
+    # O app lê DB_URL ao importar: banco temporário (não é usado aqui)
+    os.environ["DB_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="edge-bench-"), "bench.db")
+    from app.core.config import settings
+    from app.services import decoder
+
+    msgs = _messages(args.n)
+    typed = "msgspec" if decoder.msgspec is not None else "stdlib"
+    for mode in ("json", "compact"):
+        settings.RAW_PAYLOAD_MODE = mode
+        lenient = _rate(decoder.lenient_decode, msgs)
+        fast = _rate(decoder.fast_decode, msgs)
+        print(f"[{mode:7}] tolerante : {lenient:10.0f} msg/s")
+        print(f"[{mode:7}] rápido ({typed}) : {fast:10.0f} msg/s  ({fast / lenient:.1f}x)")
+    if decoder.msgspec is not None:
+        # Mesmo caminho rápido sem msgspec (checagem de tipos em Python)
+        saved, decoder._typed_decoder = decoder._typed_decoder, None
+        settings.RAW_PAYLOAD_MODE = "json"
+        print(f"[json   ] rápido (stdlib) : {_rate(decoder.fast_decode, msgs):10.0f} msg/s")
+        decoder._typed_decoder = saved
+    from app.services import codec
+
+    if codec.msgpack is not None:
+        binary = [(t + "/mp", codec.encode_reading(json.loads(raw))) for t, raw in msgs]
+        size_json = sum(len(raw) for _, raw in msgs) / len(msgs)
+        size_bin = sum(len(raw) for _, raw in binary) / len(binary)
+        print(f"[json   ] msgpack : {_rate(decoder.binary_decode, binary):10.0f} msg/s"
+              f"  ({size_bin:.0f} vs {size_json:.0f} bytes/msg)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,467 @@
+"""
+Benchmark ponta a ponta da ingestão: muitos nós simulados -> broker local ->
+MqttWorker (paho) -> pipeline (decode/persist/broadcast/rules) -> WebSocket.
+
+- Nós: mesmo passeio aleatório do simulador (prototypes/proto1_device_mqtt_sim),
+  N nós a R leituras/s cada, distribuídos entre alguns processos publicadores.
+- Broker: bench/minibroker.py (MQTT 3.1.1 em processo, sem Mosquitto).
+- Edge: MqttWorker real, com um cliente WebSocket em memória no ws_manager.
+- Latência: do timestamp do payload (hora da publicação) até o frame WebSocket.
+
+Relata vazão sustentada, p50/p95/p99 de latência e memória (RSS), e acrescenta
+o resultado em bench/results/e2e.jsonl. Com --check, compara com a última
+execução com os mesmos parâmetros na mesma máquina e sai com código 1 se houver
+regressão (vazão -10% ou p99 +25%, ajustáveis).
+
+Uso (a partir de edge/):
+    python -m bench.bench_e2e --nodes 2000 --rate 1 --duration 20
+    python -m bench.bench_e2e --nodes 5000 --rate 2 --format msgpack --check
+    python -m bench.bench_e2e --nodes 2000 --rate 1 --mode asyncio
+    python -m bench.bench_e2e --nodes 2000 --rate 1 --qos 1 --journal
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+EDGE_DIR = Path(__file__).resolve().parents[1]
+SIM_PATH = EDGE_DIR.parent / "prototypes" / "proto1_device_mqtt_sim" / "device_sim.py"
+RESULTS = EDGE_DIR / "bench" / "results" / "e2e.jsonl"
+TOPIC = "iot/bench/{node}/reading"
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _load_sim():
+    """Módulo do simulador de dispositivo (rand_walk), carregado pelo caminho."""
+    spec = importlib.util.spec_from_file_location("device_sim", SIM_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        # Sem /proc: pico do processo (KiB no Linux, bytes no macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (2**20 if platform.system() == "Darwin" else 2**10)
+
+
+def _percentile(sorted_values: list[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[idx]
+
+
+def _git_rev() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=EDGE_DIR, capture_output=True, text=True, timeout=5
+        )
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+class _Node:
+    """Estado de um nó simulado (mesmos limites/passos do device_sim)."""
+
+    __slots__ = ("node_id", "topic", "temp", "hum", "soil")
+
+    def __init__(self, node_id: str, topic: str):
+        self.node_id = node_id
+        self.topic = topic
+        self.temp, self.hum, self.soil = 24.0, 55.0, 40.0
+
+    def payload(self, rand_walk, ts: datetime) -> dict:
+        self.temp = rand_walk(self.temp, 0.3, 18.0, 35.0)
+        self.hum = rand_walk(self.hum, 1.2, 30.0, 90.0)
+        self.soil = rand_walk(self.soil, 1.5, 10.0, 90.0)
+        return {
+            "node_id": self.node_id,
+            "temperature_c": round(self.temp, 2),
+            "humidity_pct": round(self.hum, 2),
+            "soil_moisture_pct": round(self.soil, 2),
+            "motion": random.random() < 0.1,
+            "timestamp": ts.isoformat(timespec="milliseconds"),
+            "firmware": "bench-sim-0.1.0",
+        }
+
+
+def _publish_nodes(
+    host: str, port: int, node_ids: list[str], rate: float, duration: float, start_at: float, fmt: str, done,
+    qos: int = 0,
+) -> None:
+    """
+    Processo publicador: os nós recebidos, cada um a `rate` leituras/s, de
+    `start_at` (time.time()) por `duration` segundos. Informa em `done` quantas
+    mensagens publicou.
+    """
+    import paho.mqtt.client as mqtt
+
+    sim = _load_sim()
+    nodes = [_Node(n, TOPIC.format(node=n.rsplit("-", 1)[-1][-2:])) for n in node_ids]
+    encode = None
+    if fmt == "msgpack":
+        from app.services.codec import encode_reading as encode
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"bench-pub-{node_ids[0]}")
+    client.connect(host, port, keepalive=60)
+    client.loop_start()
+    interval = 1.0 / (len(nodes) * rate)  # leituras desta conexão, espaçadas igualmente
+    t0 = time.perf_counter() + (start_at - time.time())
+    total = int(duration / interval)
+    rand_walk = sim.rand_walk
+    i = 0
+    try:
+        for i in range(total):
+            delay = t0 + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            node = nodes[i % len(nodes)]
+            payload = node.payload(rand_walk, datetime.now(timezone.utc))
+            if encode is not None:
+                client.publish(node.topic + "/mp", encode(payload), qos=qos)
+            else:
+                client.publish(node.topic, json.dumps(payload).encode(), qos=qos)
+        i = total
+    finally:
+        client.disconnect()  # a thread do loop esvazia a fila de saída antes de sair
+        client.loop_stop()
+        done.put(i)
+
+
+class _WsSink:
+    """WebSocket em memória: registra a chegada de cada frame (latência)."""
+
+    def __init__(self, on_frame):
+        self.on_frame = on_frame
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.on_frame(text)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+class E2EBench:
+    """
+    Uma execução do benchmark. Publicadores em processos separados (não
+    disputam o GIL com o edge); a latência vem do timestamp do payload
+    (relógio de parede, em ms: superestima em até 1 ms).
+    """
+
+    def __init__(
+        self,
+        nodes: int = 1000,
+        rate: float = 1.0,
+        duration: float = 10.0,
+        warmup: float = 2.0,
+        publishers: int = 2,
+        fmt: str = "json",
+        drain_timeout: float = 30.0,
+        mode: str = "threads",
+        qos: int = 0,
+        journal: bool = False,
+    ):
+        self.nodes = nodes
+        self.rate = rate
+        self.duration = duration
+        self.warmup = min(warmup, duration / 2)
+        self.publishers = max(1, min(publishers, nodes))
+        self.fmt = fmt
+        self.mode = mode
+        self.qos = qos
+        self.journal = journal  # journal em disco (modo threads) num diretório temporário
+        self.drain_timeout = drain_timeout
+        self.prefix = ""
+        self.latencies: list[float] = []
+        self.frames = 0
+        self.frames_in_window = 0
+        self._window: tuple[float, float] = (0.0, 0.0)
+        self._rss_peak = 0.0
+        self._stop_sampler = threading.Event()
+
+    # ---------- WebSocket ----------
+    def _on_frame(self, text: str) -> None:
+        now = time.time()
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return
+        if not str(data.get("node_id", "")).startswith(self.prefix):
+            return
+        sent = (datetime.fromisoformat(data["timestamp"]) - _EPOCH).total_seconds()
+        self.frames += 1
+        start, end = self._window
+        if start <= now < end:
+            self.frames_in_window += 1
+        if start <= sent < end:
+            self.latencies.append(now - sent)
+
+    def _sample_rss(self) -> None:
+        while not self._stop_sampler.wait(0.25):
+            self._rss_peak = max(self._rss_peak, _rss_mb())
+
+    # ---------- execução ----------
+    def run(self) -> dict:
+        from app.core.config import settings
+        from app.db.db import init_db
+        from app.mqtt.client import MqttWorker
+        from app.services import metrics
+        from app.services.stats import pipeline_stats
+        from app.ws.websocket import ws_manager
+
+        from .minibroker import MiniBroker
+
+        init_db()  # esquema no banco de DB_URL (idempotente)
+        rss_start = _rss_mb()
+        self._rss_peak = rss_start
+        sampler = threading.Thread(target=self._sample_rss, daemon=True)
+        sampler.start()
+
+        broker = MiniBroker().start()
+        loop = asyncio.new_event_loop()
+        loop_thread = threading.Thread(target=loop.run_forever, name="bench-ws-loop", daemon=True)
+        loop_thread.start()
+        sink = _WsSink(self._on_frame)
+        # Só o fluxo ao vivo: sem o replay das leituras recentes na conexão
+        replay, settings.WS_REPLAY = settings.WS_REPLAY, 0
+        try:
+            asyncio.run_coroutine_threadsafe(ws_manager.connect(sink), loop).result(5)
+        finally:
+            settings.WS_REPLAY = replay
+
+        persisted_before = metrics.readings_persisted.value()
+        ws_dropped_before = metrics.ws_dropped_frames.value()
+        on_loop = lambda coro: asyncio.run_coroutine_threadsafe(coro, loop)  # noqa: E731
+        if self.mode == "asyncio":
+            # Ingestão no mesmo event loop do WebSocket (como no lifespan do app)
+            from app.mqtt.aio_client import AsyncMqttIngest
+
+            aio = AsyncMqttIngest(broker.host, broker.port, settings.MQTT_TOPIC)
+            on_loop(aio.start()).result(10)
+        else:
+            journal_dir = settings.INGEST_JOURNAL_DIR
+            settings.INGEST_JOURNAL_DIR = tempfile.mkdtemp(prefix="edge-journal-") if self.journal else ""
+            try:
+                worker = MqttWorker(broker.host, broker.port, settings.MQTT_TOPIC)
+            finally:
+                settings.INGEST_JOURNAL_DIR = journal_dir
+            edge_thread = threading.Thread(target=worker.run_forever, name="bench-edge", daemon=True)
+            edge_thread.start()
+
+        self.prefix = f"bench-{random.randrange(16**6):06x}-"
+        node_ids = [f"{self.prefix}{i:05d}" for i in range(self.nodes)]
+        # spawn: o processo atual já tem threads (broker, edge, loop do WS)
+        ctx = multiprocessing.get_context("spawn")
+        done = ctx.Queue()
+        start_at = time.time() + 2.0  # tempo para subir os processos e o edge assinar
+        self._window = (start_at + self.warmup, start_at + self.duration)
+        procs = [
+            ctx.Process(
+                target=_publish_nodes,
+                args=(broker.host, broker.port, node_ids[k::self.publishers], self.rate, self.duration,
+                      start_at, self.fmt, done, self.qos),
+                daemon=True,
+            )
+            for k in range(self.publishers)
+        ]
+        for p in procs:
+            p.start()
+        published = sum(done.get(timeout=self.duration + 60) for _ in procs)
+        for p in procs:
+            p.join(10)
+        publish_end = time.time()
+
+        # Drena: espera o pipeline esvaziar e o WS entregar o que ficou
+        if self.mode == "asyncio":
+            try:
+                on_loop(aio.join()).result(self.drain_timeout)
+            except Exception:
+                pass
+        else:
+            drained = threading.Thread(target=worker.join, daemon=True)
+            drained.start()
+            drained.join(self.drain_timeout)
+
+        async def _ws_drained():
+            # Os fan-outs já agendados rodam antes; depois, a fila de envio do cliente
+            sender = ws_manager.clients.get(sink)
+            while sender is not None and sender.pending:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.01)  # último envio em andamento
+
+        try:
+            on_loop(_ws_drained()).result(self.drain_timeout)
+        except Exception:
+            pass
+        drain_sec = time.time() - publish_end
+
+        dropped = dict(pipeline_stats.snapshot_queues()[1])
+        unacked = broker.unacked()
+        if self.mode == "asyncio":
+            on_loop(aio.stop(drain_timeout=0)).result(10)
+        else:
+            worker.stop()
+            edge_thread.join(5)
+
+        async def _disconnect():
+            ws_manager.remove(sink)  # cancela a task de envio (precisa do loop)
+            await asyncio.sleep(0)
+
+        asyncio.run_coroutine_threadsafe(_disconnect(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join(5)
+        broker.stop()
+        self._stop_sampler.set()
+        sampler.join()
+
+        window = self._window[1] - self._window[0]
+        lat = sorted(self.latencies)
+        ms = lambda v: round(v * 1000.0, 3) if v is not None else None  # noqa: E731
+        return {
+            "at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git": _git_rev(),
+            "host": {"node": platform.node(), "python": platform.python_version(), "cpus": os.cpu_count()},
+            "params": {
+                "nodes": self.nodes, "rate": self.rate, "duration": self.duration, "warmup": self.warmup,
+                "publishers": self.publishers, "format": self.fmt, "mode": self.mode,
+                "qos": self.qos, "journal": self.journal,
+                "ingest_workers": settings.INGEST_WORKERS, "batch_size": settings.INGEST_BATCH_SIZE,
+                "raw_payload_mode": settings.RAW_PAYLOAD_MODE,
+            },
+            "offered_msg_s": round(self.nodes * self.rate, 1),
+            "published": published,
+            "publish_sec": round(publish_end - start_at, 3),
+            # Entregues no WS durante a janela medida (com os publicadores ativos)
+            "throughput_msg_s": round(self.frames_in_window / window, 1) if window > 0 else None,
+            # Todas as entregas, da primeira publicação ao fim da drenagem
+            "overall_msg_s": round(self.frames / max(publish_end + drain_sec - start_at, 1e-9), 1),
+            "persisted": int(metrics.readings_persisted.value() - persisted_before),
+            "ws_dropped": int(metrics.ws_dropped_frames.value() - ws_dropped_before),
+            "pipeline_dropped": {k: v for k, v in dropped.items() if v},
+            "undelivered": published - self.frames,
+            "unacked": unacked,
+            "drain_sec": round(drain_sec, 3),
+            "latency_ms": {
+                "p50": ms(_percentile(lat, 50)), "p95": ms(_percentile(lat, 95)),
+                "p99": ms(_percentile(lat, 99)), "max": ms(lat[-1] if lat else None),
+                "samples": len(lat),
+            },
+            "rss_mb": {"start": round(rss_start, 1), "peak": round(self._rss_peak, 1), "end": round(_rss_mb(), 1)},
+        }
+
+
+# ---------- histórico ----------
+def _same_setup(a: dict, b: dict) -> bool:
+    return a.get("params") == b.get("params") and a.get("host", {}).get("node") == b.get("host", {}).get("node")
+
+
+def previous_result(result: dict, path: Path = RESULTS) -> Optional[dict]:
+    """Última execução registrada com os mesmos parâmetros na mesma máquina."""
+    if not path.exists():
+        return None
+    last = None
+    for line in path.read_text().splitlines():
+        try:
+            old = json.loads(line)
+        except ValueError:
+            continue
+        if _same_setup(old, result):
+            last = old
+    return last
+
+
+def regressions(result: dict, baseline: dict, max_drop: float = 0.10, max_p99_rise: float = 0.25) -> list[str]:
+    problems = []
+    new_tp, old_tp = result.get("throughput_msg_s"), baseline.get("throughput_msg_s")
+    if new_tp is not None and old_tp and new_tp < old_tp * (1 - max_drop):
+        problems.append(f"vazão {new_tp:.0f} msg/s < {old_tp:.0f} msg/s (-{(1 - new_tp / old_tp) * 100:.0f}%)")
+    new_p99, old_p99 = result["latency_ms"].get("p99"), baseline.get("latency_ms", {}).get("p99")
+    if new_p99 is not None and old_p99 and new_p99 > old_p99 * (1 + max_p99_rise):
+        problems.append(f"p99 {new_p99:.1f} ms > {old_p99:.1f} ms (+{(new_p99 / old_p99 - 1) * 100:.0f}%)")
+    return problems
+
+
+def _report(r: dict) -> None:
+    lat, rss = r["latency_ms"], r["rss_mb"]
+    p = r["params"]
+    print(
+        f"[BENCH] nós={p['nodes']} taxa={p['rate']}/s formato={p['format']} modo={p.get('mode', 'threads')}"
+        f" qos={p.get('qos', 0)} journal={'sim' if p.get('journal') else 'não'}"
+    )
+    print(f"[BENCH] oferecido : {r['offered_msg_s']:10.0f} msg/s  (publicadas {r['published']})")
+    print(f"[BENCH] sustentado: {r['throughput_msg_s']:10.0f} msg/s  (gravadas {r['persisted']})")
+    print(f"[BENCH] com drenagem: {r['overall_msg_s']:8.0f} msg/s")
+    print(f"[BENCH] latência  : p50={lat['p50']} ms  p95={lat['p95']} ms  p99={lat['p99']} ms  max={lat['max']} ms")
+    print(f"[BENCH] memória   : {rss['start']} -> pico {rss['peak']} MB (fim {rss['end']} MB)")
+    print(
+        f"[BENCH] perdas    : ws={r['ws_dropped']} filas={r['pipeline_dropped'] or 0}"
+        f" não entregues={r['undelivered']} sem PUBACK={r.get('unacked', 0)}  drenagem {r['drain_sec']} s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ponta a ponta da ingestão MQTT -> WS")
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=1.0, help="leituras/s por nó")
+    parser.add_argument("--duration", type=float, default=10.0, help="segundos publicando")
+    parser.add_argument("--warmup", type=float, default=2.0, help="segundos iniciais fora das estatísticas")
+    parser.add_argument("--publishers", type=int, default=2, help="processos publicadores (uma conexão cada)")
+    parser.add_argument("--format", choices=("json", "msgpack"), default="json")
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads", help="INGEST_MODE do edge")
+    parser.add_argument("--qos", type=int, choices=(0, 1), default=0, help="QoS das publicações (e da entrega)")
+    parser.add_argument("--journal", action="store_true", help="journal de ingestão em disco (modo threads)")
+    parser.add_argument("--out", default=str(RESULTS), help="arquivo JSONL de resultados ('' = não grava)")
+    parser.add_argument("--check", action="store_true", help="sai com 1 se regrediu frente à última execução")
+    parser.add_argument("--max-drop", type=float, default=0.10, help="queda de vazão tolerada (fração)")
+    parser.add_argument("--max-p99-rise", type=float, default=0.25, help="alta de p99 tolerada (fração)")
+    args = parser.parse_args()
+
+    # O app lê DB_URL ao importar: banco temporário
+    os.environ["DB_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="edge-bench-"), "bench.db")
+    bench = E2EBench(
+        nodes=args.nodes, rate=args.rate, duration=args.duration, warmup=args.warmup,
+        publishers=args.publishers, fmt=args.format, mode=args.mode, qos=args.qos, journal=args.journal,
+    )
+    result = bench.run()
+    _report(result)
+
+    out = Path(args.out) if args.out else None
+    baseline = previous_result(result, out) if out else None
+    if out:
+        out.parent.mkdir(parents=True, exist_ok=True)
+        with out.open("a") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    if baseline:
+        problems = regressions(result, baseline, args.max_drop, args.max_p99_rise)
+        for p in problems:
+            print(f"[BENCH] REGRESSÃO frente a {baseline.get('git')} ({baseline.get('at')}): {p}")
+        if problems and args.check:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
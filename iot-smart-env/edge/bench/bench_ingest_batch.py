@@ -0,0 +1,70 @@
+"""
+Benchmark: leituras/s do pipeline de ingestão, um commit por leitura vs. lote.
+
+Uso (a partir de edge/):
+    python -m bench.bench_ingest_batch --n 5000 --batch 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def _payloads(n: int, day: int = 0) -> list[dict]:
+    # Sem msg_id: nenhuma leitura é descartada como duplicata
+    base = datetime(2025, 9, 17, 19, 30) + timedelta(days=day)
+    return [
+        {
+            "node_id": f"envnode-{i % 300:03d}",
+            "temperature_c": round(random.uniform(18, 35), 2),
+            "humidity_pct": round(random.uniform(30, 90), 2),
+            "soil_moisture_pct": round(random.uniform(10, 90), 2),
+            "motion": random.random() < 0.1,
+            "timestamp": (base + timedelta(milliseconds=i)).isoformat() + "Z",
+            "firmware": "proto1-sim-0.1.0",
+            "_topic": "iot/env/room1/reading",
+        }
+        for i in range(n)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de ingestão em lote")
+    parser.add_argument("--n", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=200)
+    args = parser.parse_args()
+
+    # Banco temporário: precisa ser definido antes de importar o app
+    os.environ["DB_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="edge-bench-"), "bench.db")
+    from app.db.db import init_db
+    from app.services.ingest import process_incoming_batch, process_incoming_payload
+
+    init_db()
+    data = _payloads(args.n)
+    data_batched = _payloads(args.n, day=1)
+
+    # Silencia os prints do pipeline (ex.: WS sem event loop) durante a medição
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        for p in data:
+            process_incoming_payload(dict(p))
+        single = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for i in range(0, len(data), args.batch):
+            process_incoming_batch([dict(p) for p in data_batched[i:i + args.batch]])
+        batched = time.perf_counter() - t0
+
+    print(f"por leitura : {args.n / single:10.0f} leituras/s")
+    print(f"lote ({args.batch:>4}) : {args.n / batched:10.0f} leituras/s  ({single / batched:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Broker MQTT 3.1.1 mínimo, em processo, para benchmarks e testes locais.
+
+Suporta o suficiente para o paho (edge e simuladores) conversarem sem um
+Mosquitto: CONNECT/CONNACK, SUBSCRIBE/SUBACK (filtros com + e #),
+UNSUBSCRIBE/UNSUBACK, PUBLISH (entrada QoS 0/1, com PUBACK), PINGREQ/PINGRESP
+e DISCONNECT. A entrega aos assinantes usa o menor QoS entre a publicação e a
+assinatura (no máximo 1); PUBACKs dos assinantes são contados (`unacked()`),
+sem reenvio. Sem retain, sessões persistentes ou will.
+
+Uso:
+    broker = MiniBroker()          # porta livre em 127.0.0.1
+    broker.start()
+    ... mqtt.Client().connect(broker.host, broker.port) ...
+    broker.stop()
+"""
+
+from __future__ import annotations
+
+import socket
+import struct
+import threading
+from typing import Optional
+
+
+def topic_matches(pattern: str, topic: str) -> bool:
+    """Filtro MQTT (+ = um nível, # = o resto) contra um tópico."""
+    p_parts = pattern.split("/")
+    t_parts = topic.split("/")
+    for i, p in enumerate(p_parts):
+        if p == "#":
+            return True
+        if i >= len(t_parts) or (p != "+" and p != t_parts[i]):
+            return False
+    return len(p_parts) == len(t_parts)
+
+
+def _remaining_length(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | 0x80 if n else byte)
+        if not n:
+            return bytes(out)
+
+
+def _utf8(data: bytes, pos: int) -> tuple[str, int]:
+    (n,) = struct.unpack_from("!H", data, pos)
+    return data[pos + 2:pos + 2 + n].decode("utf-8"), pos + 2 + n
+
+
+class _Conn:
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.lock = threading.Lock()  # várias threads publicando para o mesmo assinante
+        self.filters: dict[str, int] = {}  # filtro -> QoS concedido
+        self.inflight: set[int] = set()     # QoS 1 entregues sem PUBACK
+        self._pid = 0
+        self.alive = True
+
+    def send(self, data: bytes) -> None:
+        try:
+            with self.lock:
+                self.sock.sendall(data)
+        except OSError:
+            self.alive = False
+
+    def deliver(self, topic: bytes, payload: bytes, qos: int) -> None:
+        if not qos:
+            self.send(b"\x30" + _remaining_length(len(topic) + len(payload)) + topic + payload)
+            return
+        with self.lock:
+            self._pid = self._pid % 65535 + 1
+            pid = self._pid
+            self.inflight.add(pid)
+        body = topic + struct.pack("!H", pid) + payload
+        self.send(b"\x32" + _remaining_length(len(body)) + body)
+
+
+class MiniBroker:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self._server: Optional[socket.socket] = None
+        self._conns: list[_Conn] = []
+        self._routes: dict[str, list[tuple[_Conn, int]]] = {}  # tópico -> (assinante, QoS) (cache)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.published = 0
+
+    def unacked(self) -> int:
+        """Entregas QoS 1 ainda sem PUBACK do assinante."""
+        with self._lock:
+            return sum(len(c.inflight) for c in self._conns)
+
+    # ---------- ciclo ----------
+    def start(self) -> "MiniBroker":
+        self._server = socket.create_server((self.host, self.port))
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._accept_loop, name="minibroker-accept", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._server is not None:
+            self._server.close()
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for c in conns:
+            try:
+                c.sock.close()
+            except OSError:
+                pass
+
+    def _accept_loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = _Conn(sock)
+            with self._lock:
+                self._conns.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), name="minibroker-conn", daemon=True).start()
+
+    # ---------- protocolo ----------
+    def _serve(self, conn: _Conn) -> None:
+        reader = conn.sock.makefile("rb", buffering=65536)
+        try:
+            while not self._stop.is_set():
+                head = reader.read(1)
+                if not head:
+                    break
+                length, mult = 0, 1
+                while True:
+                    b = reader.read(1)
+                    if not b:
+                        return
+                    length += (b[0] & 0x7F) * mult
+                    if not b[0] & 0x80:
+                        break
+                    mult *= 128
+                body = reader.read(length) if length else b""
+                if not self._handle(conn, head[0], body):
+                    break
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._drop(conn)
+
+    def _handle(self, conn: _Conn, header: int, body: bytes) -> bool:
+        kind = header >> 4
+        if kind == 3:  # PUBLISH
+            self._publish(conn, header, body)
+        elif kind == 1:  # CONNECT
+            conn.send(b"\x20\x02\x00\x00")
+        elif kind == 8:  # SUBSCRIBE
+            pid, pos, codes = body[:2], 2, bytearray()
+            while pos < len(body):
+                topic, pos = _utf8(body, pos)
+                granted = min(1, body[pos] & 0x03)
+                pos += 1
+                conn.filters[topic] = granted
+                codes.append(granted)
+            self._invalidate()
+            conn.send(b"\x90" + _remaining_length(2 + len(codes)) + pid + bytes(codes))
+        elif kind == 10:  # UNSUBSCRIBE
+            pos = 2
+            while pos < len(body):
+                topic, pos = _utf8(body, pos)
+                conn.filters.pop(topic, None)
+            self._invalidate()
+            conn.send(b"\xb0\x02" + body[:2])
+        elif kind == 4:  # PUBACK de uma entrega QoS 1
+            with conn.lock:
+                conn.inflight.discard(struct.unpack("!H", body[:2])[0])
+        elif kind == 12:  # PINGREQ
+            conn.send(b"\xd0\x00")
+        elif kind == 14:  # DISCONNECT
+            return False
+        return True
+
+    def _publish(self, conn: _Conn, header: int, body: bytes) -> None:
+        qos = (header >> 1) & 0x03
+        topic, pos = _utf8(body, 0)
+        if qos:
+            conn.send(b"\x40\x02" + body[pos:pos + 2])  # PUBACK
+            pos += 2
+        name, payload = body[:2 + len(topic.encode("utf-8"))], body[pos:]
+        self.published += 1
+        for sub, sub_qos in self._subscribers(topic):
+            sub.deliver(name, payload, min(qos, sub_qos))
+
+    def _subscribers(self, topic: str) -> list[tuple[_Conn, int]]:
+        subs = self._routes.get(topic)
+        if subs is None:
+            with self._lock:
+                subs = []
+                for c in self._conns:
+                    granted = [q for f, q in c.filters.items() if topic_matches(f, topic)]
+                    if granted:
+                        subs.append((c, max(granted)))
+                self._routes[topic] = subs
+        return subs
+
+    def _invalidate(self) -> None:
+        with self._lock:
+            self._routes = {}
+
+    def _drop(self, conn: _Conn) -> None:
+        with self._lock:
+            if conn in self._conns:
+                self._conns.remove(conn)
+            self._routes = {}
+        try:
+            conn.sock.close()
+        except OSError:
+            pass
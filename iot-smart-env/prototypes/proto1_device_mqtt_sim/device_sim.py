@@ -18,6 +18,25 @@ def iso_now() -> str:
     """Retorna timestamp ISO8601 UTC com milissegundos."""
     return datetime.now(timezone.utc).isoformat(timespec="milliseconds")
 
+# Formato binário (--format msgpack): IDs curtos dos campos, timestamp em epoch ms.
+# Mesma tabela do edge (edge/app/services/codec.py).
+FIELD_IDS = {
+    "node_id": 0, "timestamp": 1, "temperature_c": 2, "humidity_pct": 3,
+    "soil_moisture_pct": 4, "motion": 5, "firmware": 6, "rssi_dbm": 7, "msg_id": 8,
+}
+BINARY_SUFFIX = "/mp"
+
+
+def encode_msgpack(payload: dict) -> bytes:
+    import msgpack  # só necessário com --format msgpack
+
+    out = {}
+    for k, v in payload.items():
+        if k == "timestamp":
+            v = round(datetime.fromisoformat(v).timestamp() * 1000)
+        out[FIELD_IDS.get(k, k)] = v
+    return msgpack.packb(out, use_bin_type=True)
+
 def rand_walk(value: float, step: float, min_v: float, max_v: float) -> float:
     """Passeio aleatório com limites."""
     v = value + random.uniform(-step, step)
@@ -30,6 +49,8 @@ def main():
     parser.add_argument("--topic", default=os.getenv("BASE_TOPIC", "iot/env/room1/reading"))
     parser.add_argument("--interval", type=float, default=float(os.getenv("PUBLISH_INTERVAL", "2")))
     parser.add_argument("--node", default=os.getenv("NODE_ID", "envnode-sim-01"))
+    parser.add_argument("--format", choices=("json", "msgpack"), default=os.getenv("PAYLOAD_FORMAT", "json"),
+                        help="json (padrão) ou msgpack (publica em <topic>/mp)")
     args = parser.parse_args()
 
     client = mqtt.Client(client_id=f"{args.node}-{random.randint(1000,9999)}", clean_session=True)
@@ -49,6 +70,9 @@ def main():
     hum = 55.0
     soil = 40.0
     fw = "proto1-sim-0.1.0"
+    # msg_id "<boot>-<contador>": o edge ignora reentregas com o mesmo id
+    boot = f"{random.getrandbits(32):08x}"
+    seq = 0
 
     try:
         while True:
@@ -56,6 +80,7 @@ def main():
             hum = rand_walk(hum, 1.2, 30.0, 90.0)
             soil = rand_walk(soil, 1.5, 10.0, 90.0)
             motion_state = random.random() < 0.1  # 10% de chance
+            seq += 1
 
             payload = {
                 "node_id": args.node,
@@ -64,10 +89,15 @@ def main():
                 "soil_moisture_pct": round(soil, 2),
                 "motion": motion_state,
                 "timestamp": iso_now(),
-                "firmware": fw
+                "firmware": fw,
+                "msg_id": f"{boot}-{seq}",
             }
-            client.publish(args.topic, json.dumps(payload), qos=0, retain=False)
-            print(f"[SIM] -> {args.topic} {payload}")
+            if args.format == "msgpack":
+                data, topic = encode_msgpack(payload), args.topic + BINARY_SUFFIX
+            else:
+                data, topic = json.dumps(payload).encode(), args.topic
+            client.publish(topic, data, qos=0, retain=False)
+            print(f"[SIM] -> {topic} ({len(data)} bytes) {payload}")
             time.sleep(args.interval)
     except KeyboardInterrupt:
         print("\n[SIM] Encerrando...")